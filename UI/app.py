@@ -1,6 +1,13 @@
 from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import os
+import threading
+import time
+import copy
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from datetime import datetime
 import qrcode
 import io
@@ -8,32 +15,388 @@ import base64
 from PIL import Image
 import json
 
+try:
+    import psycopg2
+except ImportError:  # Notifications de changement désactivées sans pilote PostgreSQL
+    psycopg2 = None
+from notifications import EcouteurChangements
+
 app = Flask(__name__, template_folder='templates')
 app.secret_key = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 
 # Configuration de l'API
 API_BASE_URL = os.environ.get('API_BASE_URL', 'http://localhost:8010')
+# Connexions gardées ouvertes vers l'API, par worker gunicorn
+API_POOL_SIZE = int(os.environ.get('API_POOL_SIZE', '10'))
+# Délais (secondes) d'établissement de connexion et de lecture de la réponse
+API_CONNECT_TIMEOUT = float(os.environ.get('API_CONNECT_TIMEOUT', '3.05'))
+API_READ_TIMEOUT = float(os.environ.get('API_READ_TIMEOUT', '15'))
+# Nouvelles tentatives des GET (erreurs réseau, 502/503/504) avec attente exponentielle
+API_GET_RETRIES = int(os.environ.get('API_GET_RETRIES', '2'))
+API_RETRY_BACKOFF = float(os.environ.get('API_RETRY_BACKOFF', '0.3'))
+# Disjoncteur : nombre d'échecs consécutifs avant ouverture, durée d'ouverture (secondes)
+API_BREAKER_THRESHOLD = int(os.environ.get('API_BREAKER_THRESHOLD', '5'))
+API_BREAKER_COOLDOWN = float(os.environ.get('API_BREAKER_COOLDOWN', '30'))
+# Appels API simultanés d'une vue (get_many), partagés par toutes les requêtes du worker
+API_FANOUT_WORKERS = int(os.environ.get('API_FANOUT_WORKERS', str(API_POOL_SIZE)))
+
+# Pool de threads partagé par les appels parallèles de get_many
+executeur_api = ThreadPoolExecutor(max_workers=API_FANOUT_WORKERS, thread_name_prefix='api-fanout')
+# Base PostgreSQL écoutée (LISTEN gmao_changements) pour invalider le cache entre workers
+NOTIFY_DATABASE_URL = os.environ.get('NOTIFY_DATABASE_URL')
+# Cache des référentiels (fournisseurs, sites, lieux, emplacements, tables d'atelier) ;
+# durée de vie longue quand les notifications de changement tiennent le cache à jour
+REFERENTIELS_CACHE_TTL = float(os.environ.get('REFERENTIELS_CACHE_TTL', '3600' if NOTIFY_DATABASE_URL and psycopg2 else '60'))
+REFERENTIELS_CACHE_TAILLE = int(os.environ.get('REFERENTIELS_CACHE_TAILLE', '256'))
+ENDPOINTS_REFERENTIELS = ('/fournisseurs/', '/sites/', '/lieux/', '/emplacements/', '/emplacements-hierarchy/', '/tables-atelier/')
+# Endpoints en cache touchés par un changement sur chaque table
+ENDPOINTS_PAR_TABLE = {
+    'fournisseurs': ('/fournisseurs/',),
+    'sites': ('/sites/', '/emplacements-hierarchy/'),
+    'lieux': ('/lieux/', '/emplacements-hierarchy/'),
+    'emplacements': ('/emplacements/', '/emplacements-hierarchy/'),
+    'tables_atelier': ('/tables-atelier/',),
+}
+# Durée (secondes) pendant laquelle un référentiel invalidé par une notification est relu
+# sur le primaire (en-tête X-Lecture-Primaire), le temps que la réplique de l'API rejoue
+# le changement ; ensuite les lectures retournent sur la réplique
+REFERENTIELS_LECTURE_PRIMAIRE = float(os.environ.get('REFERENTIELS_LECTURE_PRIMAIRE', '5'))
+
+class CacheReferentiels:
+    """Cache local au worker des listes de référence, borné en taille (LRU) et en durée de vie.
+    
+    Les écritures passant par ce worker le vident aussitôt ; celles des autres workers
+    (et des autres clients de la base) arrivent par EcouteurChangements si
+    NOTIFY_DATABASE_URL est configurée, sinon au plus tard après REFERENTIELS_CACHE_TTL
+    secondes.
+    """
+    
+    def __init__(self, taille_max, ttl):
+        self.taille_max = taille_max
+        self.ttl = ttl
+        self._entrees = OrderedDict()
+        self._verrou = threading.Lock()
+        self.succes = 0
+        self.echecs = 0
+        self.invalidations = 0
+        self._relectures = {}  # préfixe -> échéance de la relecture sur le primaire
+    
+    def get(self, cle):
+        """Copie de la valeur en cache, ou None si absente ou expirée"""
+        with self._verrou:
+            entree = self._entrees.get(cle)
+            if entree is None or entree[0] < time.monotonic():
+                self._entrees.pop(cle, None)
+                self.echecs += 1
+                return None
+            self._entrees.move_to_end(cle)
+            self.succes += 1
+            valeur = entree[1]
+        # Les vues modifient parfois les listes reçues : chaque appelant a sa copie
+        return copy.deepcopy(valeur)
+    
+    def set(self, cle, valeur):
+        with self._verrou:
+            self._entrees[cle] = (time.monotonic() + self.ttl, copy.deepcopy(valeur))
+            self._entrees.move_to_end(cle)
+            while len(self._entrees) > self.taille_max:
+                self._entrees.popitem(last=False)
+    
+    def invalider(self, prefixes=None, notifiee=False):
+        """Vider le cache après une écriture sur un référentiel.
+        
+        Avec prefixes, seules les entrées des endpoints commençant par l'un d'eux sont retirées.
+        Avec notifiee (changement connu par notification, éventuellement pas encore rejoué
+        par la réplique), ces endpoints sont relus sur le primaire pendant
+        REFERENTIELS_LECTURE_PRIMAIRE secondes.
+        """
+        with self._verrou:
+            if prefixes is None:
+                self._entrees.clear()
+            else:
+                for cle in [c for c in self._entrees if c[0].startswith(prefixes)]:
+                    del self._entrees[cle]
+            self.invalidations += 1
+            if notifiee:
+                echeance = time.monotonic() + REFERENTIELS_LECTURE_PRIMAIRE
+                for prefixe in prefixes or ENDPOINTS_REFERENTIELS:
+                    self._relectures[prefixe] = echeance
+    
+    def lecture_primaire(self, endpoint):
+        """Indique si l'endpoint doit être relu sur le primaire (invalidé par une notification récente)"""
+        with self._verrou:
+            maintenant = time.monotonic()
+            for prefixe, echeance in list(self._relectures.items()):
+                if echeance < maintenant:
+                    del self._relectures[prefixe]
+            return endpoint.startswith(tuple(self._relectures))
+    
+    def stats(self):
+        with self._verrou:
+            total = self.succes + self.echecs
+            return {
+                'entrees': len(self._entrees),
+                'taille_max': self.taille_max,
+                'ttl': self.ttl,
+                'succes': self.succes,
+                'echecs': self.echecs,
+                'taux_succes': round(self.succes / total, 3) if total else None,
+                'invalidations': self.invalidations
+            }
+
+cache_referentiels = CacheReferentiels(REFERENTIELS_CACHE_TAILLE, REFERENTIELS_CACHE_TTL)
+class CacheValidateurs:
+    """Dernier corps reçu de chaque GET avec son ETag, revalidé par If-None-Match à chaque appel.
+    
+    Le corps est gardé tel que reçu (octets immuables, sans copie) et n'est décodé que sur
+    un 304. Cache LRU borné en nombre d'entrées et en octets ; un corps plus gros que la
+    borne n'est pas gardé.
+    """
+    
+    def __init__(self, taille_max, octets_max):
+        self.taille_max = taille_max
+        self.octets_max = octets_max
+        self.octets = 0
+        self._entrees = OrderedDict()
+        self._verrou = threading.Lock()
+    
+    def get(self, cle):
+        """(etag, corps en octets, curseur), ou None"""
+        with self._verrou:
+            entree = self._entrees.get(cle)
+            if entree is not None:
+                self._entrees.move_to_end(cle)
+            return entree
+    
+    def set(self, cle, etag, contenu, curseur):
+        with self._verrou:
+            ancienne = self._entrees.pop(cle, None)
+            if ancienne is not None:
+                self.octets -= len(ancienne[1])
+            if len(contenu) > self.octets_max:
+                return
+            self._entrees[cle] = (etag, contenu, curseur)
+            self.octets += len(contenu)
+            while len(self._entrees) > self.taille_max or self.octets > self.octets_max:
+                _, (_, evince, _) = self._entrees.popitem(last=False)
+                self.octets -= len(evince)
+
+API_ETAG_CACHE_TAILLE = int(os.environ.get('API_ETAG_CACHE_TAILLE', '128'))
+# Octets de corps gardés par worker gunicorn
+API_ETAG_CACHE_OCTETS = int(os.environ.get('API_ETAG_CACHE_OCTETS', str(16 * 1024 * 1024)))
+cache_validateurs = CacheValidateurs(API_ETAG_CACHE_TAILLE, API_ETAG_CACHE_OCTETS)
+
+def est_referentiel(endpoint):
+    """Indique si un endpoint de l'API relève des données de référence mises en cache"""
+    return endpoint.startswith(ENDPOINTS_REFERENTIELS)
+
+def invalider_referentiels(table, cles=None):
+    """Callback d'EcouteurChangements : retirer du cache les endpoints de la table modifiée.
+    
+    table=None (reconnexion de l'écouteur, des notifications ont pu être perdues) : tout
+    le cache est vidé.
+    """
+    if table is None:
+        cache_referentiels.invalider(notifiee=True)
+        return
+    prefixes = ENDPOINTS_PAR_TABLE.get(table)
+    if prefixes:
+        cache_referentiels.invalider(prefixes, notifiee=True)
+
+# Un écouteur par worker gunicorn (le module est importé dans chaque worker)
+if NOTIFY_DATABASE_URL and psycopg2 is not None:
+    EcouteurChangements(NOTIFY_DATABASE_URL, invalider_referentiels).start()
+
+class APIIndisponible(requests.exceptions.RequestException):
+    """Appel refusé sans contacter l'API car le disjoncteur est ouvert"""
+
+class Disjoncteur:
+    """Disjoncteur des appels à l'API.
+    
+    Après `seuil` échecs consécutifs (API injoignable, délai dépassé, erreur 5xx), les
+    appels échouent immédiatement pendant `delai` secondes au lieu de bloquer les
+    workers ; ensuite un appel d'essai est laissé passer et referme le circuit s'il réussit.
+    """
+    
+    def __init__(self, seuil, delai):
+        self.seuil = seuil
+        self.delai = delai
+        self.echecs = 0
+        self.ouvert_jusqua = 0.0
+        self._verrou = threading.Lock()
+    
+    def autoriser(self):
+        """Indique si un appel peut être tenté"""
+        with self._verrou:
+            if self.echecs < self.seuil:
+                return True
+            if time.monotonic() >= self.ouvert_jusqua:
+                # Demi-ouvert : un seul appel d'essai jusqu'à son résultat
+                self.ouvert_jusqua = time.monotonic() + self.delai
+                return True
+            return False
+    
+    def succes(self):
+        with self._verrou:
+            self.echecs = 0
+    
+    def echec(self):
+        with self._verrou:
+            self.echecs += 1
+            if self.echecs >= self.seuil:
+                self.ouvert_jusqua = time.monotonic() + self.delai
+    
+    def etat(self):
+        """État courant, pour le diagnostic"""
+        with self._verrou:
+            if self.echecs < self.seuil:
+                return 'ferme'
+            return 'ouvert' if time.monotonic() < self.ouvert_jusqua else 'demi-ouvert'
 
 class APIClient:
     """Client pour communiquer avec l'API FastAPI"""
     
-    def __init__(self, base_url):
+    def __init__(self, base_url, pool_size=API_POOL_SIZE, timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT)):
         self.base_url = base_url
+        self.timeout = timeout
+        self.disjoncteur = Disjoncteur(API_BREAKER_THRESHOLD, API_BREAKER_COOLDOWN)
+        
+        # Session partagée : connexions keep-alive réutilisées d'une requête à l'autre.
+        # Seuls les GET sont rejoués sur erreur de lecture ou 502/503/504 ; une erreur de
+        # connexion est rejouée pour toutes les méthodes (la requête n'est pas partie).
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=API_GET_RETRIES,
+                backoff_factor=API_RETRY_BACKOFF,
+                status_forcelist=(502, 503, 504),
+                allowed_methods=frozenset(['GET']),
+                raise_on_status=False
+            )
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
     
-    def get(self, endpoint, params=None):
-        """Effectuer une requête GET"""
+    def _requete(self, methode, endpoint, **kwargs):
+        """Envoyer une requête via la session, sous contrôle du disjoncteur"""
+        if not self.disjoncteur.autoriser():
+            raise APIIndisponible(f"API indisponible (disjoncteur ouvert), appel {methode} {endpoint} non tenté")
         try:
-            response = requests.get(f"{self.base_url}{endpoint}", params=params)
-            response.raise_for_status()
-            return response.json()
+            response = self.session.request(methode, f"{self.base_url}{endpoint}", timeout=self.timeout, **kwargs)
+        except requests.exceptions.RequestException:
+            self.disjoncteur.echec()
+            raise
+        if response.status_code >= 500:
+            self.disjoncteur.echec()
+        else:
+            self.disjoncteur.succes()
+        # Écriture sur un référentiel : invalider le cache sans attendre la notification
+        # (même en cas d'échec partiel)
+        if methode != 'GET' and est_referentiel(endpoint):
+            cache_referentiels.invalider()
+        return response
+    
+    def _get_conditionnel(self, endpoint, params=None):
+        """GET conditionnel : renvoie l'ETag déjà reçu (If-None-Match) et réutilise le corps gardé sur 304.
+        
+        Retourne (corps décodé, curseur de la page suivante).
+        """
+        cle = (endpoint, tuple(sorted((params or {}).items())))
+        connu = cache_validateurs.get(cle)
+        entetes = {'If-None-Match': connu[0]} if connu else {}
+        # Référentiel rechargé juste après une notification de changement : lu sur le
+        # primaire, la réplique de l'API pouvant ne pas encore avoir rejoué le changement
+        if cache_referentiels.lecture_primaire(endpoint):
+            entetes['X-Lecture-Primaire'] = '1'
+        response = self._requete('GET', endpoint, params=params, headers=entetes)
+        if response.status_code == 304 and connu:
+            return json.loads(connu[1]), connu[2]
+        response.raise_for_status()
+        valeur = response.json()
+        curseur = response.headers.get('X-Next-Cursor')
+        if response.headers.get('ETag'):
+            cache_validateurs.set(cle, response.headers['ETag'], response.content, curseur)
+        return valeur, curseur
+    
+    def get(self, endpoint, params=None, frais=False):
+        """Effectuer une requête GET.
+        
+        Les référentiels sont servis depuis cache_referentiels, sauf avec frais=True
+        (pages d'administration qui affichent des compteurs à jour).
+        """
+        cle = (endpoint, tuple(sorted((params or {}).items())))
+        if not frais and est_referentiel(endpoint):
+            valeur = cache_referentiels.get(cle)
+            if valeur is not None:
+                return valeur
+        try:
+            valeur, _ = self._get_conditionnel(endpoint, params)
         except requests.exceptions.RequestException as e:
             print(f"Erreur API GET {endpoint}: {e}")
             return None
+        if est_referentiel(endpoint):
+            cache_referentiels.set(cle, valeur)
+        return valeur
+    
+    def get_all(self, endpoint, params=None, page_size=1000):
+        """Récupérer toutes les pages d'une liste paginée.
+        
+        Suit le curseur X-Next-Cursor quand l'API le fournit (coût constant quelle
+        que soit la profondeur), sinon pagine par skip/limit.
+        """
+        resultats = []
+        skip = 0
+        curseur = None
+        while True:
+            pagination = {'cursor': curseur} if curseur else {'skip': skip}
+            try:
+                page, curseur = self._get_conditionnel(
+                    endpoint, {**(params or {}), **pagination, 'limit': page_size}
+                )
+            except requests.exceptions.RequestException as e:
+                print(f"Erreur API GET {endpoint}: {e}")
+                return None
+            resultats.extend(page)
+            if len(page) < page_size:
+                return resultats
+            skip += page_size
+    
+    def get_many(self, appels, toutes_pages=(), timeout=None, frais=False):
+        """Effectuer plusieurs GET indépendants en parallèle et attendre qu'ils soient tous terminés.
+        
+        `appels` associe un nom à un endpoint ou à un couple (endpoint, params) ; les noms
+        listés dans `toutes_pages` (ou tous si True) sont lus via get_all. Chaque appel garde
+        son propre délai et sa gestion d'erreur : un appel en échec, ou pas terminé après
+        `timeout` secondes, vaut None sans empêcher les autres de répondre. Avec frais=True,
+        les référentiels sont relus sans passer par le cache.
+        """
+        futures = {}
+        for nom, appel in appels.items():
+            endpoint, params = (appel, None) if isinstance(appel, str) else appel
+            if toutes_pages is True or nom in toutes_pages:
+                futures[nom] = executeur_api.submit(self.get_all, endpoint, params)
+            else:
+                futures[nom] = executeur_api.submit(self.get, endpoint, params, frais)
+        
+        limite = time.monotonic() + timeout if timeout is not None else None
+        resultats = {}
+        for nom, future in futures.items():
+            try:
+                resultats[nom] = future.result(timeout=None if limite is None else max(0, limite - time.monotonic()))
+            except FuturesTimeout:
+                print(f"Erreur API GET {nom}: pas de réponse après {timeout} s")
+                resultats[nom] = None
+            except Exception as e:
+                print(f"Erreur API GET {nom}: {e}")
+                resultats[nom] = None
+        return resultats
     
     def post(self, endpoint, data=None):
         """Effectuer une requête POST"""
         try:
-            response = requests.post(f"{self.base_url}{endpoint}", json=data)
+            response = self._requete('POST', endpoint, json=data)
             if response.status_code == 422:
                 print(f"Erreur 422 pour POST {endpoint}")
                 print(f"Données envoyées: {data}")
@@ -49,7 +412,7 @@ class APIClient:
     def put(self, endpoint, data=None):
         """Effectuer une requête PUT"""
         try:
-            response = requests.put(f"{self.base_url}{endpoint}", json=data)
+            response = self._requete('PUT', endpoint, json=data)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -59,7 +422,7 @@ class APIClient:
     def delete(self, endpoint):
         """Effectuer une requête DELETE"""
         try:
-            response = requests.delete(f"{self.base_url}{endpoint}")
+            response = self._requete('DELETE', endpoint)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -85,8 +448,18 @@ def index():
 @app.route('/magasin')
 def magasin():
     """Page Magasin - Vue d'ensemble du stock"""
-    produits_raw = api_client.get('/inventaire/')
-    fournisseurs_raw = api_client.get('/fournisseurs/')
+    fournisseur_filtre = request.args.get('fournisseur')
+    filtre_actif = fournisseur_filtre and fournisseur_filtre != 'tous'
+    
+    # Filtrer par fournisseur si spécifié ; statistiques calculées par l'API sur tout le
+    # catalogue (même règle que get_stock_status)
+    donnees = api_client.get_many({
+        'produits': f'/inventaire/fournisseur/{fournisseur_filtre}' if filtre_actif else '/inventaire/',
+        'fournisseurs': '/fournisseurs/',
+        'stats': ('/inventaire/stats', {'fournisseur': fournisseur_filtre} if filtre_actif else None)
+    })
+    produits_raw = donnees['produits']
+    fournisseurs_raw = donnees['fournisseurs']
     
     if produits_raw is None:
         produits = []
@@ -101,71 +474,38 @@ def magasin():
         # L'API retourne un objet avec une propriété 'value' contenant le tableau
         fournisseurs = fournisseurs_raw.get('value', []) if isinstance(fournisseurs_raw, dict) else fournisseurs_raw
     
-    # Filtrer par fournisseur si spécifié
-    fournisseur_filtre = request.args.get('fournisseur')
-    if fournisseur_filtre and fournisseur_filtre != 'tous':
-        produits = [p for p in produits if p.get('fournisseur') == fournisseur_filtre]
-    
-    # Calculer les statistiques comme dans Streamlit
-    stats = {
-        'total_produits': len(produits),
-        'stock_critique': 0,
-        'stock_faible': 0,
-        'surstock': 0,
-        'stock_normal': 0,
-        'valeur_totale': 0
-    }
-    
-    if produits:
-        for produit in produits:
-            # Conversion sécurisée des valeurs numériques
-            try:
-                quantite = int(produit.get('quantite', 0))
-            except (ValueError, TypeError):
-                quantite = 0
-                
-            try:
-                stock_min = int(produit.get('stock_min', 0))
-            except (ValueError, TypeError):
-                stock_min = 0
-                
-            try:
-                stock_max = int(produit.get('stock_max', 100))
-            except (ValueError, TypeError):
-                stock_max = 100
-                
-            try:
-                prix = float(produit.get('prix_unitaire', 0))
-            except (ValueError, TypeError):
-                prix = 0
-            
-            # Calcul du seuil d'alerte (30% entre min et max)
-            if stock_max > stock_min:
-                seuil_alerte = stock_min + (stock_max - stock_min) * 0.3
-            else:
-                seuil_alerte = stock_min
-            
-            # Classification du stock
-            if quantite < stock_min:
-                stats['stock_critique'] += 1
-            elif quantite > stock_max:
-                stats['surstock'] += 1
-            elif quantite <= seuil_alerte:
-                stats['stock_faible'] += 1
-            else:
-                stats['stock_normal'] += 1
-            
-            # Valeur du stock
-            stats['valeur_totale'] += quantite * prix
+    stats = donnees['stats']
+    if stats is None:
+        stats = {
+            'total_produits': 0,
+            'stock_critique': 0,
+            'stock_faible': 0,
+            'surstock': 0,
+            'stock_normal': 0,
+            'valeur_totale': 0
+        }
     
     return render_template('magasin.html', produits=produits, stats=stats, fournisseurs=fournisseurs, fournisseur_filtre=fournisseur_filtre)
 
+# Classe CSS et libellé affiché par type de mouvement de l'API (type_mouvement) ;
+# les autres types (inventaire, transfert) gardent leur libellé
+NATURES_AFFICHAGE = {
+    1: ('entree', 'Entrée'),
+    2: ('sortie', 'Sortie'),
+    3: ('ajustement', 'Ajustement'),
+}
+
 @app.route('/historique-mouvements')
 def historique_mouvements():
     """Page Historique des mouvements"""
-    historique = api_client.get('/historique/')
-    fournisseurs_raw = api_client.get('/fournisseurs/')
-    produits_raw = api_client.get('/inventaire/')  # Récupérer les produits pour le lien référence → fournisseur
+    donnees = api_client.get_many({
+        'historique': '/historique/',
+        'fournisseurs': '/fournisseurs/',
+        'produits': '/inventaire/'  # Récupérer les produits pour le lien référence → fournisseur
+    })
+    historique = donnees['historique']
+    fournisseurs_raw = donnees['fournisseurs']
+    produits_raw = donnees['produits']
     
     if historique is None:
         historique = []
@@ -209,19 +549,9 @@ def historique_mouvements():
         else:
             # Conserver la nature originale et ajouter une version normalisée
             mouvement['nature_originale'] = mouvement['nature']
-            nature_lower = mouvement['nature'].lower()
-            if 'entrée' in nature_lower or 'entree' in nature_lower:
-                mouvement['nature_normalized'] = 'entree'
-                mouvement['nature_display'] = 'Entrée'
-            elif 'sortie' in nature_lower:
-                mouvement['nature_normalized'] = 'sortie'
-                mouvement['nature_display'] = 'Sortie'
-            elif 'ajustement' in nature_lower or 'régule' in nature_lower or 'regule' in nature_lower:
-                mouvement['nature_normalized'] = 'ajustement'
-                mouvement['nature_display'] = 'Ajustement'
-            else:
-                mouvement['nature_normalized'] = 'inventaire'
-                mouvement['nature_display'] = mouvement['nature']
+            mouvement['nature_normalized'], mouvement['nature_display'] = NATURES_AFFICHAGE.get(
+                mouvement.get('type_mouvement'), ('inventaire', mouvement['nature'])
+            )
             
         if 'quantite_mouvement' not in mouvement:
             mouvement['quantite_mouvement'] = mouvement.get('quantite', 0)
@@ -242,8 +572,17 @@ def historique_mouvements():
 @app.route('/alertes-stock')
 def alertes_stock():
     """Page Alertes de stock"""
-    produits = api_client.get('/inventaire/')
-    fournisseurs_raw = api_client.get('/fournisseurs/')
+    # Filtrer par fournisseur si spécifié
+    fournisseur_filtre = request.args.get('fournisseur')
+    params = {'fournisseur': fournisseur_filtre} if fournisseur_filtre and fournisseur_filtre != 'tous' else None
+    
+    # Les statuts sont calculés et indexés en base : seules les alertes sont transférées
+    donnees = api_client.get_many({
+        'alertes': ('/inventaire/alertes', params),
+        'fournisseurs': '/fournisseurs/'
+    }, toutes_pages=('alertes',))
+    produits = donnees['alertes']
+    fournisseurs_raw = donnees['fournisseurs']
     
     if produits is None:
         produits = []
@@ -255,63 +594,23 @@ def alertes_stock():
         # L'API retourne un objet avec une propriété 'value' contenant le tableau
         fournisseurs = fournisseurs_raw.get('value', []) if isinstance(fournisseurs_raw, dict) else fournisseurs_raw
     
-    # Calculer les alertes comme dans Streamlit
     produits_avec_alertes = []
-    
     for produit in produits:
-        # Conversion sécurisée des valeurs numériques
-        try:
-            quantite = int(produit.get('quantite', 0))
-        except (ValueError, TypeError):
-            quantite = 0
-            
-        try:
-            stock_min = int(produit.get('stock_min', 0))
-        except (ValueError, TypeError):
-            stock_min = 0
-            
-        try:
-            stock_max = int(produit.get('stock_max', 100))
-        except (ValueError, TypeError):
-            stock_max = 100
+        produit_alerte = produit.copy()
+        produit_alerte['statut'] = produit_alerte.get('statut_stock')
+        produit_alerte['seuil_alerte'] = int(produit_alerte.get('seuil_alerte_calcule') or 0)
         
-        # Calcul du seuil d'alerte (30% entre min et max)
-        if stock_max > stock_min:
-            seuil_alerte = stock_min + (stock_max - stock_min) * 0.3
-        else:
-            seuil_alerte = stock_min
-        
-        # Déterminer le statut
-        statut = None
-        if quantite < stock_min:
-            statut = 'critique'
-        elif quantite > stock_max:
-            statut = 'surstock'
-        elif quantite <= seuil_alerte:
-            statut = 'faible'
-        
-        # Ajouter seulement les produits avec des alertes
-        if statut:
-            produit_alerte = produit.copy()
-            produit_alerte['statut'] = statut
-            produit_alerte['seuil_alerte'] = int(seuil_alerte)
-            
-            # Ajouter des alias pour la compatibilité avec le template
-            if 'produits' in produit_alerte and 'designation' not in produit_alerte:
-                produit_alerte['designation'] = produit_alerte['produits']
-            
-            # S'assurer que les champs manquants ont des valeurs par défaut
-            produit_alerte['fournisseur'] = produit_alerte.get('fournisseur') or 'Non défini'
-            produit_alerte['emplacement'] = produit_alerte.get('emplacement') or 'Non défini'
-            produit_alerte['site'] = produit_alerte.get('site') or 'Non défini'
-            produit_alerte['lieu'] = produit_alerte.get('lieu') or 'Non défini'
-            
-            produits_avec_alertes.append(produit_alerte)
-    
-    # Filtrer par fournisseur si spécifié
-    fournisseur_filtre = request.args.get('fournisseur')
-    if fournisseur_filtre and fournisseur_filtre != 'tous':
-        produits_avec_alertes = [p for p in produits_avec_alertes if p.get('fournisseur') == fournisseur_filtre]
+        # Ajouter des alias pour la compatibilité avec le template
+        if 'produits' in produit_alerte and 'designation' not in produit_alerte:
+            produit_alerte['designation'] = produit_alerte['produits']
+        
+        # S'assurer que les champs manquants ont des valeurs par défaut
+        produit_alerte['fournisseur'] = produit_alerte.get('fournisseur') or 'Non défini'
+        produit_alerte['emplacement'] = produit_alerte.get('emplacement') or 'Non défini'
+        produit_alerte['site'] = produit_alerte.get('site') or 'Non défini'
+        produit_alerte['lieu'] = produit_alerte.get('lieu') or 'Non défini'
+        
+        produits_avec_alertes.append(produit_alerte)
     
     return render_template('alertes_stock.html', produits=produits_avec_alertes, fournisseurs=fournisseurs, fournisseur_filtre=fournisseur_filtre)
 
@@ -324,9 +623,9 @@ def demande_materiel():
     """Page Demande de matériel - équivalent Streamlit"""
     # Charger les tables d'atelier pour l'identification
     tables = api_client.get('/tables-atelier/') or []
-    produits = api_client.get('/inventaire/') or []
     
-    return render_template('demande_materiel.html', tables=tables, produits=produits)
+    # Les produits sont proposés à la saisie via /api/produits/autocomplete
+    return render_template('demande_materiel.html', tables=tables)
 
 @app.route('/gestion-demandes')
 def gestion_demandes():
@@ -436,13 +735,51 @@ def regule_stock():
     
     return render_template('regule_stock.html')
 
+@app.route('/mouvement-stock/batch', methods=['POST'])
+def mouvement_stock_batch():
+    """Enregistrer en une fois les lignes scannées et mises en attente côté navigateur"""
+    data = request.get_json() or {}
+    
+    # Construire le motif avec utilisateur et commentaires, commun à tout le lot
+    motif_parts = []
+    if data.get('utilisateur'):
+        motif_parts.append(f"Utilisateur: {data['utilisateur']}")
+    if data.get('commentaires'):
+        motif_parts.append(f"Commentaires: {data['commentaires']}")
+    motif = " | ".join(motif_parts) if motif_parts else None
+    
+    mouvements = []
+    for ligne in data.get('lignes', []):
+        try:
+            quantite = int(ligne['quantite'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'success': False, 'message': f"Quantité invalide pour la référence {ligne.get('reference')}"})
+        mouvements.append({
+            'reference_produit': ligne.get('reference'),
+            'nature': ligne.get('nature', 'Entrée'),
+            'quantite': quantite,
+            'motif': ligne.get('motif', motif)
+        })
+    
+    if not mouvements:
+        return jsonify({'success': False, 'message': 'Aucune ligne à enregistrer'})
+    
+    result = api_client.post('/mouvements-stock/batch', {
+        'mouvements': mouvements,
+        'partiel': bool(data.get('partiel', False))
+    })
+    
+    if result is None:
+        return jsonify({'success': False, 'message': 'Erreur lors de l\'enregistrement'})
+    return jsonify(result)
+
 @app.route('/preparer-inventaire')
 def preparer_inventaire():
     """Page Préparer l'inventaire"""
     listes = api_client.get('/listes-inventaire/') or []
-    produits = api_client.get('/inventaire/') or []
     
-    return render_template('preparer_inventaire.html', listes=listes, produits=produits)
+    # Les produits sont proposés à la saisie via /api/produits/autocomplete
+    return render_template('preparer_inventaire.html', listes=listes)
 
 # =====================================================
 # ADMINISTRATION
@@ -451,14 +788,20 @@ def preparer_inventaire():
 @app.route('/gestion-produits')
 def gestion_produits():
     """Page Gestion des produits"""
-    produits_raw = api_client.get('/inventaire/') or []
+    donnees = api_client.get_many({
+        'produits': '/inventaire/',
+        'fournisseurs': '/fournisseurs/',
+        'sites': '/sites/',
+        'lieux': '/lieux/',
+        'emplacements': '/emplacements-hierarchy/'
+    })
     # Normaliser les données des produits
-    produits = [normalize_produit(p.copy()) for p in produits_raw]
+    produits = [normalize_produit(p.copy()) for p in donnees['produits'] or []]
     
-    fournisseurs = api_client.get('/fournisseurs/') or []
-    sites = api_client.get('/sites/') or []
-    lieux = api_client.get('/lieux/') or []
-    emplacements = api_client.get('/emplacements-hierarchy/') or []
+    fournisseurs = donnees['fournisseurs'] or []
+    sites = donnees['sites'] or []
+    lieux = donnees['lieux'] or []
+    emplacements = donnees['emplacements'] or []
     
     return render_template('gestion_produits.html', produits=produits, 
                          fournisseurs=fournisseurs, sites=sites, lieux=lieux, emplacements=emplacements)
@@ -509,349 +852,20 @@ def import_produits():
             'erreurs': []
         }
         
-        # Caches pour éviter les doublons
-        fournisseurs_cache = {}
-        sites_cache = {}
-        lieux_cache = {}
-        emplacements_cache = {}
+        # Charger une seule fois le catalogue et la hiérarchie existants
+        index = charger_index_import()
+        if index is None:
+            return jsonify({'success': False, 'message': 'Impossible de charger le catalogue existant depuis l\'API'})
         
-        # Traiter chaque ligne
-        for index, row in df.iterrows():
-            try:
-                ligne_num = index + 2  # +2 car index commence à 0 et ligne 1 = en-têtes
-                
-                # Petite pause pour éviter les conflits de timestamp
-                import time
-                time.sleep(0.001)  # 1ms de pause
-                
-                # Extraire les données de base
-                designation = str(row.get('Désignation', '')).strip()
-                if not designation or designation == 'nan':
-                    stats['erreurs'].append(f"Ligne {ligne_num}: Désignation manquante")
-                    continue
-                
-                # Vérifier si le produit existe déjà avant de continuer le traitement
-                fournisseur_nom = str(row.get('Fournisseur Standard', '')).strip() if pd.notna(row.get('Fournisseur Standard')) else None
-                if fournisseur_nom and fournisseur_nom == 'nan':
-                    fournisseur_nom = None
-                
-                reference_fournisseur = str(row.get('Référence fournisseur', '')).strip() if pd.notna(row.get('Référence fournisseur')) else None
-                if reference_fournisseur and reference_fournisseur == 'nan':
-                    reference_fournisseur = None
-                
-                # Vérifier l'existence du produit par référence fournisseur
-                produit_existant = None
-                if reference_fournisseur:
-                    produit_existant = produit_existe_par_reference_fournisseur(reference_fournisseur, fournisseur_nom)
-                
-                if produit_existant:
-                    if gestion_doublons == 'ignorer':
-                        stats['produits_ignores'] += 1
-                        print(f"Ligne {ligne_num}: Produit avec référence fournisseur '{reference_fournisseur}' déjà existant - ignoré")
-                        continue
-                    elif gestion_doublons == 'mettre_a_jour':
-                        # On va mettre à jour le produit existant
-                        print(f"Ligne {ligne_num}: Produit avec référence fournisseur '{reference_fournisseur}' déjà existant - mise à jour")
-                        mode_mise_a_jour = True
-                        produit_id = produit_existant.get('id')
-                    else:
-                        stats['produits_ignores'] += 1
-                        continue
-                else:
-                    mode_mise_a_jour = False
-                    produit_id = None
-                
-                # Données du produit
-                produit_data = {
-                    'designation': designation,
-                    'reference_fournisseur': reference_fournisseur,
-                    'unite_stockage': str(row.get('Unité de stockage', '')).strip() if pd.notna(row.get('Unité de stockage')) else None,
-                    'unite_commande': str(row.get('Unité Commande', '')).strip() if pd.notna(row.get('Unité Commande')) else None,
-                    'stock_min': int(row.get('Min', 0)) if pd.notna(row.get('Min')) else 0,
-                    'stock_max': int(row.get('Max', 100)) if pd.notna(row.get('Max')) else 100,
-                    'prix_unitaire': float(row.get('Prix', 0)) if pd.notna(row.get('Prix')) else 0.0,
-                    'categorie': str(row.get('Catégorie', '')).strip() if pd.notna(row.get('Catégorie')) else None,
-                    'secteur': str(row.get('Secteur', '')).strip() if pd.notna(row.get('Secteur')) else None,
-                    'quantite': int(row.get('Quantité', 0)) if pd.notna(row.get('Quantité')) else 0
-                }
-                
-                # Traiter le fournisseur
-                if fournisseur_nom:
-                    if fournisseur_nom not in fournisseurs_cache:
-                        # Vérifier si le fournisseur existe
-                        fournisseurs_existants = api_client.get('/fournisseurs/') or []
-                        fournisseur_existe = any(f.get('nom_fournisseur') == fournisseur_nom for f in fournisseurs_existants)
-                        
-                        if not fournisseur_existe:
-                            # Créer le fournisseur
-                            from datetime import datetime
-                            id_fournisseur = f"F{datetime.now().strftime('%Y%m%d%H%M%S')}{index}"
-                            
-                            fournisseur_data = {
-                                'id_fournisseur': id_fournisseur,
-                                'nom_fournisseur': fournisseur_nom,
-                                'adresse': '',
-                                'contact1_nom': '',
-                                'contact1_prenom': '',
-                                'contact1_fonction': '',
-                                'contact1_tel_fixe': '',
-                                'contact1_tel_mobile': '',
-                                'contact1_email': '',
-                                'contact2_nom': '',
-                                'contact2_prenom': '',
-                                'contact2_fonction': '',
-                                'contact2_tel_fixe': '',
-                                'contact2_tel_mobile': '',
-                                'contact2_email': '',
-                                'statut': 'Actif'
-                            }
-                            
-                            result = api_client.post('/fournisseurs/', fournisseur_data)
-                            if result and 'id' in result:
-                                stats['fournisseurs_crees'] += 1
-                                fournisseurs_cache[fournisseur_nom] = True
-                            else:
-                                error_detail = result.get('message', 'Erreur inconnue') if result else 'Pas de réponse de l\'API'
-                                stats['erreurs'].append(f"Ligne {ligne_num}: Erreur création fournisseur {fournisseur_nom} - {error_detail}")
-                        else:
-                            fournisseurs_cache[fournisseur_nom] = True
-                    
-                    produit_data['fournisseur'] = fournisseur_nom
-                
-                # Traiter la hiérarchie Site → Lieu → Emplacement
-                site_nom = str(row.get('Site', '')).strip() if pd.notna(row.get('Site')) else None
-                lieu_nom = str(row.get('Lieu', '')).strip() if pd.notna(row.get('Lieu')) else None
-                emplacement_nom = str(row.get('Emplacement', '')).strip() if pd.notna(row.get('Emplacement')) else None
-                
-                site_id = None
-                lieu_id = None
-                
-                # Traiter le site
-                if site_nom and site_nom != 'nan':
-                    if site_nom not in sites_cache:
-                        # Vérifier si le site existe
-                        sites_existants = api_client.get('/sites/') or []
-                        site_existant = next((s for s in sites_existants if s.get('nom_site') == site_nom), None)
-                        
-                        if not site_existant:
-                            # Créer le site avec un code unique (max 20 caractères)
-                            from datetime import datetime
-                            import random
-                            import string
-                            import time
-                            # Utiliser un timestamp plus court + suffixe aléatoire
-                            timestamp = datetime.now().strftime('%y%m%d%H%M%S')  # 12 caractères
-                            random_suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))  # 4 caractères
-                            code_site = f"S{timestamp}{random_suffix}"  # S + 12 + 4 = 17 caractères max
-                            
-                            site_data = {
-                                'code_site': code_site,
-                                'nom_site': site_nom,
-                                'adresse': '',
-                                'ville': '',
-                                'code_postal': '',
-                                'pays': 'France',
-                                'responsable': '',
-                                'telephone': '',
-                                'email': '',
-                                'statut': 'Actif'
-                            }
-                            
-                            result = api_client.post('/sites/', site_data)
-                            if result and 'id' in result:
-                                stats['sites_crees'] += 1
-                                sites_cache[site_nom] = result['id']
-                                site_id = result['id']
-                            else:
-                                error_detail = result.get('message', 'Erreur inconnue') if result else 'Pas de réponse de l\'API'
-                                stats['erreurs'].append(f"Ligne {ligne_num}: Erreur création site {site_nom} - {error_detail}")
-                        else:
-                            sites_cache[site_nom] = site_existant['id']
-                            site_id = site_existant['id']
-                    else:
-                        site_id = sites_cache[site_nom]
-                    
-                    produit_data['site'] = site_nom
-                
-                # Traiter le lieu
-                if lieu_nom and lieu_nom != 'nan':
-                    if site_id:
-                        lieu_key = f"{site_id}_{lieu_nom}"
-                        if lieu_key not in lieux_cache:
-                            # Vérifier si le lieu existe
-                            lieux_existants = api_client.get('/lieux/') or []
-                            lieu_existant = next((l for l in lieux_existants if l.get('nom_lieu') == lieu_nom and l.get('site_id') == site_id), None)
-                            
-                            if not lieu_existant:
-                                # Créer le lieu avec un code unique
-                                from datetime import datetime
-                                import random
-                                import string
-                                import time
-                                # Utiliser un timestamp plus court + suffixe aléatoire (max 20 caractères)
-                                timestamp = datetime.now().strftime('%y%m%d%H%M%S')  # 12 caractères
-                                random_suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))  # 4 caractères
-                                code_lieu = f"L{timestamp}{random_suffix}"  # L + 12 + 4 = 17 caractères max
-                                
-                                lieu_data = {
-                                    'code_lieu': code_lieu,
-                                    'nom_lieu': lieu_nom,
-                                    'site_id': site_id,
-                                    'type_lieu': '',
-                                    'niveau': '',
-                                    'surface': None,
-                                    'responsable': '',
-                                    'statut': 'Actif'
-                                }
-                                
-                                result = api_client.post('/lieux/', lieu_data)
-                                if result and 'id' in result:
-                                    stats['lieux_crees'] += 1
-                                    lieux_cache[lieu_key] = result['id']
-                                    lieu_id = result['id']
-                                else:
-                                    error_detail = result.get('message', 'Erreur inconnue') if result else 'Pas de réponse de l\'API'
-                                    stats['erreurs'].append(f"Ligne {ligne_num}: Erreur création lieu {lieu_nom} - {error_detail}")
-                            else:
-                                lieux_cache[lieu_key] = lieu_existant['id']
-                                lieu_id = lieu_existant['id']
-                        else:
-                            lieu_id = lieux_cache[lieu_key]
-                        
-                        produit_data['lieu'] = lieu_nom
-                    else:
-                        # Si pas de site_id, on ne peut pas créer le lieu
-                        stats['erreurs'].append(f"Ligne {ligne_num}: Impossible de créer le lieu {lieu_nom} - site manquant")
-                
-                # Traiter l'emplacement
-                if emplacement_nom and emplacement_nom != 'nan':
-                    # S'assurer qu'on a un lieu_id valide
-                    if lieu_id:
-                        emplacement_key = f"{lieu_id}_{emplacement_nom}"
-                        if emplacement_key not in emplacements_cache:
-                            # Vérifier si l'emplacement existe
-                            emplacements_existants = api_client.get('/emplacements-hierarchy/') or []
-                            emplacement_existant = next((e for e in emplacements_existants if e.get('nom_emplacement') == emplacement_nom and e.get('lieu_id') == lieu_id), None)
-                            
-                            if not emplacement_existant:
-                                # Créer l'emplacement avec un code unique
-                                from datetime import datetime
-                                import random
-                                import string
-                                import time
-                                # Utiliser un timestamp plus court + suffixe aléatoire (max 20 caractères)
-                                timestamp = datetime.now().strftime('%y%m%d%H%M%S')  # 12 caractères
-                                random_suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))  # 4 caractères
-                                code_emplacement = f"E{timestamp}{random_suffix}"  # E + 12 + 4 = 17 caractères max
-                                
-                                emplacement_data = {
-                                    'code_emplacement': code_emplacement,
-                                    'nom_emplacement': emplacement_nom,
-                                    'lieu_id': lieu_id,
-                                    'type_emplacement': '',
-                                    'position': '',
-                                    'capacite_max': 100,
-                                    'temperature_min': None,
-                                    'temperature_max': None,
-                                    'humidite_max': None,
-                                    'conditions_speciales': '',
-                                    'responsable': '',
-                                    'statut': 'Actif'
-                                }
-                                
-                                result = api_client.post('/emplacements/', emplacement_data)
-                                if result and 'id' in result:
-                                    stats['emplacements_crees'] += 1
-                                    emplacements_cache[emplacement_key] = result['id']
-                                    print(f"DEBUG: Emplacement créé avec succès: {emplacement_nom} (ID: {result.get('id')}) pour lieu_id: {lieu_id}")
-                                else:
-                                    error_detail = result.get('message', 'Erreur inconnue') if result else 'Pas de réponse de l\'API'
-                                    error_msg = f"Ligne {ligne_num}: Erreur création emplacement {emplacement_nom} pour lieu_id {lieu_id} - {error_detail}"
-                                    stats['erreurs'].append(error_msg)
-                                    print(f"DEBUG: {error_msg}")
-                            else:
-                                emplacements_cache[emplacement_key] = emplacement_existant['id']
-                        
-                        produit_data['emplacement'] = emplacement_nom
-                    else:
-                        # Si pas de lieu_id, on ne peut pas créer l'emplacement
-                        stats['erreurs'].append(f"Ligne {ligne_num}: Impossible de créer l'emplacement {emplacement_nom} - lieu manquant")
-                
-                # Créer ou mettre à jour le produit
-                if mode_mise_a_jour and produit_id:
-                    # Mise à jour du produit existant
-                    produit_final = {}
-                    
-                    # Seulement mettre à jour les champs non vides
-                    if produit_data.get('reference_fournisseur'):
-                        produit_final['reference_fournisseur'] = produit_data.get('reference_fournisseur')
-                    if produit_data.get('unite_stockage'):
-                        produit_final['unite_stockage'] = produit_data.get('unite_stockage')
-                    if produit_data.get('unite_commande'):
-                        produit_final['unite_commande'] = produit_data.get('unite_commande')
-                    if produit_data.get('stock_min') is not None:
-                        produit_final['stock_min'] = produit_data.get('stock_min', 0)
-                    if produit_data.get('stock_max') is not None:
-                        produit_final['stock_max'] = produit_data.get('stock_max', 100)
-                    if produit_data.get('site'):
-                        produit_final['site'] = produit_data.get('site')
-                    if produit_data.get('lieu'):
-                        produit_final['lieu'] = produit_data.get('lieu')
-                    if produit_data.get('emplacement'):
-                        produit_final['emplacement'] = produit_data.get('emplacement')
-                    if produit_data.get('fournisseur'):
-                        produit_final['fournisseur'] = produit_data.get('fournisseur')
-                    if produit_data.get('prix_unitaire') is not None:
-                        produit_final['prix_unitaire'] = produit_data.get('prix_unitaire', 0.0)
-                    if produit_data.get('categorie'):
-                        produit_final['categorie'] = produit_data.get('categorie')
-                    if produit_data.get('secteur'):
-                        produit_final['secteur'] = produit_data.get('secteur')
-                    if produit_data.get('quantite') is not None:
-                        produit_final['quantite'] = produit_data.get('quantite', 0)
-                    # Note: On ne met pas à jour la quantité lors de l'importation pour éviter d'écraser le stock
-                    
-                    result = api_client.put(f'/inventaire/{produit_id}', produit_final)
-                    if result:
-                        stats['produits_mis_a_jour'] += 1
-                    else:
-                        error_detail = result.get('message', 'Erreur inconnue') if result else 'Pas de réponse de l\'API'
-                        stats['erreurs'].append(f"Ligne {ligne_num}: Erreur mise à jour produit {designation} - {error_detail}")
-                else:
-                    # Création d'un nouveau produit
-                    # Générer un code QR automatique
-                    import random
-                    import string
-                    qr_code = ''.join(random.choices(string.digits, k=10))
-                    
-                    produit_final = {
-                        'code': qr_code,
-                        'reference': qr_code,
-                        'reference_fournisseur': produit_data.get('reference_fournisseur'),
-                        'produits': produit_data['designation'],
-                        'unite_stockage': produit_data.get('unite_stockage'),
-                        'unite_commande': produit_data.get('unite_commande'),
-                        'stock_min': produit_data.get('stock_min', 0),
-                        'stock_max': produit_data.get('stock_max', 100),
-                        'site': produit_data.get('site'),
-                        'lieu': produit_data.get('lieu'),
-                        'emplacement': produit_data.get('emplacement'),
-                        'fournisseur': produit_data.get('fournisseur'),
-                        'prix_unitaire': produit_data.get('prix_unitaire', 0.0),
-                        'categorie': produit_data.get('categorie'),
-                        'secteur': produit_data.get('secteur'),
-                        'quantite': produit_data.get('quantite', 0)
-                    }
-                    
-                    result = api_client.post('/inventaire/', produit_final)
-                    if result and 'id' in result:
-                        stats['produits_crees'] += 1
-                    else:
-                        error_detail = result.get('message', 'Erreur inconnue') if result else 'Pas de réponse de l\'API'
-                        stats['erreurs'].append(f"Ligne {ligne_num}: Erreur création produit {designation} - {error_detail}")
-                    
-            except Exception as e:
-                stats['erreurs'].append(f"Ligne {ligne_num}: Erreur - {str(e)}")
+        # Normaliser toutes les lignes en une seule passe
+        lignes = preparer_lignes_import(df, stats)
+        
+        # Créer les fournisseurs, sites, lieux et emplacements manquants (une fois par nom)
+        resoudre_referentiels_import(lignes, index, stats)
+        
+        # Calculer le plan créer / mettre à jour / ignorer puis l'envoyer à l'API
+        plan = planifier_import(lignes, index, gestion_doublons, stats)
+        executer_plan_import(plan, index, stats)
         
         # Préparer le message de résultat
         message = f"Importation terminée:\n"
@@ -1087,14 +1101,16 @@ def mouvement_stock_api():
 @app.route('/gestion-tables')
 def gestion_tables():
     """Page Gestion des tables d'atelier"""
-    tables = api_client.get('/tables-atelier/') or []
+    # Page d'édition : lecture directe, pour voir aussi les modifications faites via d'autres workers
+    tables = api_client.get('/tables-atelier/', frais=True) or []
     
     return render_template('gestion_tables.html', tables=tables)
 
 @app.route('/gestion-fournisseurs')
 def gestion_fournisseurs():
     """Page Gestion des fournisseurs"""
-    fournisseurs = api_client.get('/fournisseurs/') or []
+    # Page d'édition : lecture directe, pour voir aussi les modifications faites via d'autres workers
+    fournisseurs = api_client.get('/fournisseurs/', frais=True) or []
     print(f"Fournisseurs récupérés: {fournisseurs}")  # Debug
     
     return render_template('gestion_fournisseurs.html', fournisseurs=fournisseurs)
@@ -1102,9 +1118,15 @@ def gestion_fournisseurs():
 @app.route('/gestion-emplacements')
 def gestion_emplacements():
     """Page Gestion de la hiérarchie Site > Lieu > Emplacement"""
-    sites = api_client.get('/sites/') or []
-    lieux = api_client.get('/lieux/') or []
-    emplacements = api_client.get('/emplacements-hierarchy/') or []
+    # Page d'édition : lecture directe, pour voir aussi les modifications faites via d'autres workers
+    donnees = api_client.get_many({
+        'sites': '/sites/',
+        'lieux': '/lieux/',
+        'emplacements': '/emplacements-hierarchy/'
+    }, frais=True)
+    sites = donnees['sites'] or []
+    lieux = donnees['lieux'] or []
+    emplacements = donnees['emplacements'] or []
     
     return render_template('gestion_emplacements.html', 
                          sites=sites, 
@@ -1149,6 +1171,20 @@ def api_produit(reference):
     else:
         return jsonify({'error': 'Produit non trouvé'}), 404
 
+@app.route('/api/produits/autocomplete')
+def api_produits_autocomplete():
+    """API endpoint pour les suggestions de produits des sélecteurs (référence ou désignation)"""
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify([])
+    suggestions = api_client.get('/inventaire/autocomplete', params={'q': q, 'limit': request.args.get('limit', 10)})
+    return jsonify(suggestions or [])
+
+@app.route('/api/cache-referentiels/stats')
+def api_cache_referentiels_stats():
+    """Compteurs du cache des référentiels de ce worker (succès, échecs, invalidations)"""
+    return jsonify(cache_referentiels.stats())
+
 # Compatibilité avec les anciennes routes
 @app.route('/demandes')
 def demandes():
@@ -1714,6 +1750,356 @@ def get_emplacements_by_lieu(lieu_id):
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erreur: {str(e)}'})
 
+# =====================================================
+# FONCTIONS HELPER POUR L'IMPORTATION EXCEL
+# =====================================================
+
+# Colonnes texte du fichier Excel → champs du produit
+COLONNES_IMPORT_TEXTE = {
+    'Désignation': 'designation',
+    'Référence fournisseur': 'reference_fournisseur',
+    'Unité de stockage': 'unite_stockage',
+    'Unité Commande': 'unite_commande',
+    'Catégorie': 'categorie',
+    'Secteur': 'secteur',
+    'Fournisseur Standard': 'fournisseur',
+    'Site': 'site',
+    'Lieu': 'lieu',
+    'Emplacement': 'emplacement'
+}
+
+# Colonnes numériques du fichier Excel → (champ du produit, valeur par défaut, type)
+COLONNES_IMPORT_NUMERIQUES = {
+    'Min': ('stock_min', 0, int),
+    'Max': ('stock_max', 100, int),
+    'Prix': ('prix_unitaire', 0.0, float),
+    'Quantité': ('quantite', 0, int)
+}
+
+# Nombre de produits envoyés par appel à /inventaire/bulk
+TAILLE_LOT_IMPORT = 1000
+
+# Champs envoyés à l'API pour un produit importé
+CHAMPS_PRODUIT_IMPORT = [
+    'reference_fournisseur', 'unite_stockage', 'unite_commande', 'stock_min', 'stock_max',
+    'site', 'lieu', 'emplacement', 'fournisseur', 'prix_unitaire', 'categorie', 'secteur', 'quantite'
+]
+
+def generer_code_unique(prefixe):
+    """Générer un code de 17 caractères max (préfixe + timestamp + suffixe aléatoire)"""
+    import random
+    import string
+    timestamp = datetime.now().strftime('%y%m%d%H%M%S')  # 12 caractères
+    random_suffix = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))  # 4 caractères
+    return f"{prefixe}{timestamp}{random_suffix}"
+
+def charger_index_import():
+    """Charger une seule fois le catalogue et la hiérarchie sous forme d'index en mémoire"""
+    import pandas as pd
+    
+    donnees = api_client.get_many({
+        'produits': '/inventaire/',
+        'fournisseurs': '/fournisseurs/',
+        'sites': '/sites/',
+        'lieux': '/lieux/',
+        'emplacements': '/emplacements-hierarchy/'
+    }, toutes_pages=True)
+    produits, fournisseurs, sites, lieux, emplacements = (
+        donnees[nom] for nom in ('produits', 'fournisseurs', 'sites', 'lieux', 'emplacements')
+    )
+    if any(donnees is None for donnees in (produits, fournisseurs, sites, lieux, emplacements)):
+        return None
+    
+    # Catalogue indexé par (référence fournisseur, fournisseur), insensible à la casse
+    catalogue = pd.DataFrame(produits, columns=['id', 'reference', 'reference_fournisseur', 'fournisseur'])
+    catalogue['cle_reference'] = catalogue['reference_fournisseur'].fillna('').astype(str).str.strip().str.lower()
+    catalogue['cle_fournisseur'] = catalogue['fournisseur'].fillna('').astype(str).str.strip().str.lower()
+    catalogue = catalogue[catalogue['cle_reference'] != '']
+    
+    return {
+        'catalogue': catalogue,
+        'references_qr': {p.get('reference') for p in produits},
+        'fournisseurs': {f.get('nom_fournisseur') for f in fournisseurs},
+        'sites': {s['nom_site']: s['id'] for s in sites},
+        'lieux': {(l['site_id'], l['nom_lieu']): l['id'] for l in lieux},
+        'emplacements': {(e['lieu_id'], e['nom_emplacement']): e['id'] for e in emplacements}
+    }
+
+def preparer_lignes_import(df, stats):
+    """Normaliser les colonnes du fichier et écarter les lignes invalides"""
+    import pandas as pd
+    
+    lignes = pd.DataFrame({'ligne_num': df.index + 2}, index=df.index)  # +2 car ligne 1 = en-têtes
+    valides = pd.Series(True, index=df.index)
+    
+    for colonne, champ in COLONNES_IMPORT_TEXTE.items():
+        if colonne in df.columns:
+            valeurs = df[colonne].astype(str).str.strip()
+            lignes[champ] = valeurs.where(df[colonne].notna() & ~valeurs.isin(['', 'nan']))
+        else:
+            lignes[champ] = pd.Series(pd.NA, index=df.index, dtype=object)
+    
+    for colonne, (champ, _, _) in COLONNES_IMPORT_NUMERIQUES.items():
+        if colonne in df.columns:
+            valeurs = pd.to_numeric(df[colonne], errors='coerce')
+            invalides = df[colonne].notna() & valeurs.isna()
+            for ligne_num in lignes.loc[invalides, 'ligne_num']:
+                stats['erreurs'].append(f"Ligne {ligne_num}: Valeur invalide pour la colonne '{colonne}'")
+            valides &= ~invalides
+            lignes[champ] = valeurs
+        else:
+            lignes[champ] = float('nan')
+    
+    sans_designation = lignes['designation'].isna()
+    for ligne_num in lignes.loc[sans_designation & valides, 'ligne_num']:
+        stats['erreurs'].append(f"Ligne {ligne_num}: Désignation manquante")
+    valides &= ~sans_designation
+    
+    lignes = lignes[valides].copy()
+    lignes['cle_reference'] = lignes['reference_fournisseur'].str.lower()
+    lignes['cle_fournisseur'] = lignes['fournisseur'].str.lower().fillna('')
+    return lignes
+
+def _creer_referentiel(endpoint, donnees, libelle, nom, ligne_num, stats):
+    """Créer un fournisseur, site, lieu ou emplacement et retourner la réponse de l'API"""
+    result = api_client.post(endpoint, donnees)
+    if result and 'id' in result:
+        return result
+    error_detail = result.get('message', 'Erreur inconnue') if result else 'Pas de réponse de l\'API'
+    stats['erreurs'].append(f"Ligne {ligne_num}: Erreur création {libelle} {nom} - {error_detail}")
+    return None
+
+def resoudre_referentiels_import(lignes, index, stats):
+    """Créer les fournisseurs et la hiérarchie manquants et rattacher les identifiants aux lignes"""
+    import pandas as pd
+    
+    # Fournisseurs : une création par nom inconnu
+    premieres = lignes.dropna(subset=['fournisseur']).drop_duplicates('fournisseur')
+    for position, (fournisseur_nom, ligne_num) in enumerate(zip(premieres['fournisseur'], premieres['ligne_num'])):
+        if fournisseur_nom in index['fournisseurs']:
+            continue
+        fournisseur_data = {
+            'id_fournisseur': f"F{datetime.now().strftime('%Y%m%d%H%M%S')}{position}",
+            'nom_fournisseur': fournisseur_nom,
+            'adresse': '',
+            'contact1_nom': '',
+            'contact1_prenom': '',
+            'contact1_fonction': '',
+            'contact1_tel_fixe': '',
+            'contact1_tel_mobile': '',
+            'contact1_email': '',
+            'contact2_nom': '',
+            'contact2_prenom': '',
+            'contact2_fonction': '',
+            'contact2_tel_fixe': '',
+            'contact2_tel_mobile': '',
+            'contact2_email': '',
+            'statut': 'Actif'
+        }
+        if _creer_referentiel('/fournisseurs/', fournisseur_data, 'fournisseur', fournisseur_nom, ligne_num, stats):
+            stats['fournisseurs_crees'] += 1
+            index['fournisseurs'].add(fournisseur_nom)
+    
+    # Sites
+    premieres = lignes.dropna(subset=['site']).drop_duplicates('site')
+    for site_nom, ligne_num in zip(premieres['site'], premieres['ligne_num']):
+        if site_nom in index['sites']:
+            continue
+        site_data = {
+            'code_site': generer_code_unique('S'),
+            'nom_site': site_nom,
+            'adresse': '',
+            'ville': '',
+            'code_postal': '',
+            'pays': 'France',
+            'responsable': '',
+            'telephone': '',
+            'email': '',
+            'statut': 'Actif'
+        }
+        result = _creer_referentiel('/sites/', site_data, 'site', site_nom, ligne_num, stats)
+        if result:
+            stats['sites_crees'] += 1
+            index['sites'][site_nom] = result['id']
+    lignes['site_id'] = lignes['site'].map(index['sites'])
+    
+    # Lieux (un lieu est identifié par son nom dans un site)
+    avec_lieu = lignes['lieu'].notna()
+    sans_site = avec_lieu & lignes['site_id'].isna()
+    for ligne_num, lieu_nom in zip(lignes.loc[sans_site, 'ligne_num'], lignes.loc[sans_site, 'lieu']):
+        stats['erreurs'].append(f"Ligne {ligne_num}: Impossible de créer le lieu {lieu_nom} - site manquant")
+    premieres = lignes[avec_lieu & lignes['site_id'].notna()].drop_duplicates(['site_id', 'lieu'])
+    for site_id, lieu_nom, ligne_num in zip(premieres['site_id'], premieres['lieu'], premieres['ligne_num']):
+        if (site_id, lieu_nom) in index['lieux']:
+            continue
+        lieu_data = {
+            'code_lieu': generer_code_unique('L'),
+            'nom_lieu': lieu_nom,
+            'site_id': int(site_id),
+            'type_lieu': '',
+            'niveau': '',
+            'surface': None,
+            'responsable': '',
+            'statut': 'Actif'
+        }
+        result = _creer_referentiel('/lieux/', lieu_data, 'lieu', lieu_nom, ligne_num, stats)
+        if result:
+            stats['lieux_crees'] += 1
+            index['lieux'][(site_id, lieu_nom)] = result['id']
+    lignes['lieu_id'] = pd.Series(list(zip(lignes['site_id'], lignes['lieu'])), index=lignes.index).map(index['lieux'])
+    lignes.loc[sans_site, 'lieu'] = None
+    
+    # Emplacements (un emplacement est identifié par son nom dans un lieu)
+    avec_emplacement = lignes['emplacement'].notna()
+    sans_lieu = avec_emplacement & lignes['lieu_id'].isna()
+    for ligne_num, emplacement_nom in zip(lignes.loc[sans_lieu, 'ligne_num'], lignes.loc[sans_lieu, 'emplacement']):
+        stats['erreurs'].append(f"Ligne {ligne_num}: Impossible de créer l'emplacement {emplacement_nom} - lieu manquant")
+    premieres = lignes[avec_emplacement & lignes['lieu_id'].notna()].drop_duplicates(['lieu_id', 'emplacement'])
+    for lieu_id, emplacement_nom, ligne_num in zip(premieres['lieu_id'], premieres['emplacement'], premieres['ligne_num']):
+        if (lieu_id, emplacement_nom) in index['emplacements']:
+            continue
+        emplacement_data = {
+            'code_emplacement': generer_code_unique('E'),
+            'nom_emplacement': emplacement_nom,
+            'lieu_id': int(lieu_id),
+            'type_emplacement': '',
+            'position': '',
+            'capacite_max': 100,
+            'temperature_min': None,
+            'temperature_max': None,
+            'humidite_max': None,
+            'conditions_speciales': '',
+            'responsable': '',
+            'statut': 'Actif'
+        }
+        result = _creer_referentiel('/emplacements/', emplacement_data, 'emplacement', emplacement_nom, ligne_num, stats)
+        if result:
+            stats['emplacements_crees'] += 1
+            index['emplacements'][(lieu_id, emplacement_nom)] = result['id']
+    lignes.loc[sans_lieu, 'emplacement'] = None
+
+def planifier_import(lignes, index, gestion_doublons, stats):
+    """Calculer en une passe vectorisée les produits à créer, mettre à jour ou ignorer"""
+    import numpy as np
+    import pandas as pd
+    
+    catalogue = index['catalogue']
+    avec_reference = lignes['cle_reference'].notna()
+    
+    # Produit existant : même référence fournisseur chez le même fournisseur,
+    # ou même référence fournisseur seule si la ligne n'indique pas de fournisseur
+    par_couple = catalogue.drop_duplicates(['cle_reference', 'cle_fournisseur'])[['cle_reference', 'cle_fournisseur', 'id']]
+    id_par_couple = lignes[['cle_reference', 'cle_fournisseur']].merge(
+        par_couple, how='left', on=['cle_reference', 'cle_fournisseur']
+    )['id'].to_numpy()
+    id_par_reference = lignes['cle_reference'].map(
+        catalogue.drop_duplicates('cle_reference').set_index('cle_reference')['id']
+    ).to_numpy()
+    produit_id = np.where(lignes['fournisseur'].notna(), id_par_couple, id_par_reference)
+    lignes['produit_id'] = pd.Series(produit_id, index=lignes.index).where(avec_reference)
+    
+    # Doublons à l'intérieur du fichier : seule la première ligne d'un couple crée le produit
+    lignes['groupe'] = np.where(
+        avec_reference,
+        lignes['cle_reference'].fillna('') + '\x1f' + lignes['cle_fournisseur'],
+        'ligne-' + lignes['ligne_num'].astype(str)
+    )
+    existant = lignes['produit_id'].notna()
+    premiere = ~lignes.duplicated('groupe', keep='first')
+    
+    doublons = existant | ~premiere
+    if gestion_doublons != 'mettre_a_jour':
+        stats['produits_ignores'] += int(doublons.sum())
+        lignes = lignes[~doublons]
+        doublons = doublons[~doublons]
+    if lignes.empty:
+        return lignes.assign(action=[], nb_mises_a_jour=[])
+    
+    # Fusionner les lignes d'un même produit : la dernière valeur non vide l'emporte,
+    # comme si chaque doublon avait été appliqué à la suite du précédent
+    plan = lignes.groupby('groupe', sort=False).agg(
+        {**{champ: 'last' for champ in CHAMPS_PRODUIT_IMPORT},
+         'designation': 'first', 'produit_id': 'first', 'ligne_num': list}
+    )
+    plan['nb_mises_a_jour'] = doublons.groupby(lignes['groupe'], sort=False).sum().reindex(plan.index).to_numpy()
+    plan['action'] = np.where(plan['produit_id'].notna(), 'mettre_a_jour', 'creer')
+    return plan
+
+def _valeur_import(valeur, type_=None):
+    """Convertir une valeur pandas en valeur JSON (None si absente)"""
+    import pandas as pd
+    if valeur is None or pd.isna(valeur):
+        return None
+    return type_(valeur) if type_ else valeur
+
+def construire_produit_import(ligne, mise_a_jour):
+    """Construire le corps de requête d'un produit importé"""
+    numeriques = {champ: (defaut, type_) for champ, defaut, type_ in COLONNES_IMPORT_NUMERIQUES.values()}
+    produit = {}
+    for champ in CHAMPS_PRODUIT_IMPORT:
+        if champ in numeriques:
+            defaut, type_ = numeriques[champ]
+            valeur = _valeur_import(ligne[champ], type_)
+            if valeur is None and not mise_a_jour:
+                valeur = defaut
+        else:
+            valeur = _valeur_import(ligne[champ])
+        # En mise à jour, seuls les champs non vides sont envoyés
+        if valeur is not None or not mise_a_jour:
+            produit[champ] = valeur
+    if not mise_a_jour:
+        produit['produits'] = ligne['designation']
+    return produit
+
+def executer_plan_import(plan, index, stats):
+    """Envoyer le plan d'importation à l'API par lots via /inventaire/bulk"""
+    import random
+    import string
+    
+    lignes_plan = plan.to_dict('records')
+    items = []
+    for ligne in lignes_plan:
+        if ligne['action'] == 'mettre_a_jour':
+            items.append({'id': int(ligne['produit_id']), **construire_produit_import(ligne, mise_a_jour=True)})
+            continue
+        
+        # Générer un code QR à 10 chiffres qui n'existe pas encore dans le catalogue
+        qr_code = ''.join(random.choices(string.digits, k=10))
+        while qr_code in index['references_qr']:
+            qr_code = ''.join(random.choices(string.digits, k=10))
+        index['references_qr'].add(qr_code)
+        items.append({'code': qr_code, 'reference': qr_code, **construire_produit_import(ligne, mise_a_jour=False)})
+    
+    for debut in range(0, len(items), TAILLE_LOT_IMPORT):
+        lot = items[debut:debut + TAILLE_LOT_IMPORT]
+        result = api_client.post('/inventaire/bulk', {'items': lot, 'conflit': 'ignorer'})
+        # Une ligne du lot sans résultat (pas de réponse, corps d'erreur, réponse tronquée)
+        # est comptée en erreur au lieu de disparaître des statistiques
+        message = 'Pas de réponse de l\'API' if result is None else 'Aucun résultat renvoyé par l\'API pour cette ligne'
+        resultats = [{'statut': 'error', 'message': message} for _ in lot]
+        recus = result.get('resultats') if isinstance(result, dict) else None
+        for position, resultat in enumerate(recus if isinstance(recus, list) else []):
+            if not isinstance(resultat, dict):
+                continue
+            index_lot = resultat.get('index', position)
+            if isinstance(index_lot, int) and 0 <= index_lot < len(lot):
+                resultats[index_lot] = resultat
+        for position, resultat in enumerate(resultats):
+            ligne = lignes_plan[debut + position]
+            ligne_num = ligne['ligne_num'][0]
+            if resultat['statut'] == 'created':
+                stats['produits_crees'] += 1
+                stats['produits_mis_a_jour'] += int(ligne['nb_mises_a_jour'])
+            elif resultat['statut'] == 'updated':
+                stats['produits_mis_a_jour'] += int(ligne['nb_mises_a_jour'])
+            elif resultat['statut'] == 'skipped':
+                stats['produits_ignores'] += 1
+            else:
+                action = 'mise à jour' if ligne['action'] == 'mettre_a_jour' else 'création'
+                stats['erreurs'].append(
+                    f"Ligne {ligne_num}: Erreur {action} produit {ligne['designation']} - {resultat.get('message') or 'Erreur inconnue'}"
+                )
+
 # =====================================================
 # FONCTIONS HELPER POUR ÉVITER LES DOUBLONS
 # =====================================================
@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+class CacheLRU:
+    """Cache mémoire du processus, borné en nombre d'entrées (LRU) et en durée de vie.
+
+    Chaque worker de l'API a son propre cache : les écritures d'un worker vident son
+    cache, celles des autres arrivent par LISTEN/NOTIFY (notifications.py) et la durée
+    de vie borne le retard si une notification est perdue.
+
+    Une lecture qui remplit le cache prend une génération (generation()) avant d'aller en
+    base et la passe à set() : si la clé a été invalidée entre-temps, la valeur lue est
+    peut-être antérieure à l'écriture et n'est pas mise en cache.
+    """
+
+    def __init__(self, taille_max: int = 1024, ttl: float = 30.0):
+        self.taille_max = taille_max
+        self.ttl = ttl
+        self._entrees = OrderedDict()
+        self._verrou = threading.Lock()
+        self._generation = 0
+        self._invalidations = {}  # clé -> génération de sa dernière invalidation
+        self._dernier_vidage = 0
+        self.succes = 0
+        self.echecs = 0
+        self.refus = 0
+
+    def get(self, cle):
+        """Valeur en cache, ou None si absente ou expirée"""
+        with self._verrou:
+            entree = self._entrees.get(cle)
+            if entree is None or entree[0] < time.monotonic():
+                if entree is not None:
+                    del self._entrees[cle]
+                self.echecs += 1
+                return None
+            self._entrees.move_to_end(cle)
+            self.succes += 1
+            return entree[1]
+
+    def generation(self) -> int:
+        """Génération courante, à prendre avant la lecture en base qui remplira le cache"""
+        with self._verrou:
+            return self._generation
+
+    def set(self, cle, valeur, generation: Optional[int] = None) -> bool:
+        """Mettre une valeur en cache en évinçant la moins récemment utilisée si plein.
+
+        Avec generation, la valeur est ignorée si la clé a été invalidée depuis. Retourne
+        True si la valeur a été mise en cache.
+        """
+        with self._verrou:
+            if generation is not None and max(self._dernier_vidage, self._invalidations.get(cle, 0)) > generation:
+                self.refus += 1
+                return False
+            self._entrees[cle] = (time.monotonic() + self.ttl, valeur)
+            self._entrees.move_to_end(cle)
+            while len(self._entrees) > self.taille_max:
+                self._entrees.popitem(last=False)
+            return True
+
+    def supprimer(self, *cles):
+        """Invalider les entrées données (les clés absentes sont ignorées)"""
+        with self._verrou:
+            self._generation += 1
+            for cle in cles:
+                self._entrees.pop(cle, None)
+                self._invalidations[cle] = self._generation
+            # Borner la mémoire des invalidations : les oublier vaut un vidage (plus prudent)
+            if len(self._invalidations) > self.taille_max:
+                self._invalidations.clear()
+                self._dernier_vidage = self._generation
+
+    def vider(self):
+        """Invalider toutes les entrées"""
+        with self._verrou:
+            self._generation += 1
+            self._entrees.clear()
+            self._invalidations.clear()
+            self._dernier_vidage = self._generation
+
+    def stats(self):
+        """Compteurs d'utilisation du cache"""
+        with self._verrou:
+            total = self.succes + self.echecs
+            return {
+                "entrees": len(self._entrees),
+                "taille_max": self.taille_max,
+                "ttl": self.ttl,
+                "succes": self.succes,
+                "echecs": self.echecs,
+                "refus": self.refus,
+                "taux_succes": round(self.succes / total, 3) if total else None
+            }
@@ -1,17 +1,190 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, desc, asc
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, or_, desc, asc, func, update, insert, delete, tuple_, case, literal, collate, extract, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from pydantic import BaseModel, ValidationError
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, date
+import base64
+import hashlib
+import json
 import models
 import schemas
+from cache import CacheLRU
+from database import lever_statement_timeout, normaliser_texte
+
+# Nombre de lignes par instruction pour les écritures en masse
+TAILLE_LOT_BULK = 1000
+
+# Préfixes d'autocomplétion récents ; vidé à chaque écriture sur l'inventaire
+cache_autocomplete = CacheLRU(taille_max=2048, ttl=30)
+
+# Réponses JSON (et leur ETag) de /inventaire/reference/{reference} (scans QR) déjà sérialisées ;
+# chaque écriture sur un produit retire l'entrée de sa référence
+cache_produits_reference = CacheLRU(taille_max=4096, ttl=300)
+
+def invalider_caches(table: Optional[str], cles=None):
+    """Invalider les caches du worker suite aux changements notifiés par PostgreSQL.
+
+    cles : clés (références) des lignes modifiées, None si la notification ne les
+    détaille pas (instruction touchant beaucoup de lignes). table=None (reconnexion de
+    l'écouteur) : des changements ont pu être manqués, tous les caches sont vidés.
+    """
+    if table is None:
+        cache_autocomplete.vider()
+        cache_produits_reference.vider()
+    elif table == "inventaire":
+        cache_autocomplete.vider()
+        if cles is None:
+            cache_produits_reference.vider()
+        else:
+            cache_produits_reference.supprimer(*cles)
+
+def _par_lots(elements, taille=TAILLE_LOT_BULK):
+    """Découper une liste en lots de taille fixe"""
+    elements = list(elements)
+    for debut in range(0, len(elements), taille):
+        yield elements[debut:debut + taille]
+
+def _insert_dialecte(db: Session, table):
+    """INSERT du dialecte courant, pour disposer de ON CONFLICT (PostgreSQL ou SQLite)"""
+    if db.get_bind().dialect.name == "postgresql":
+        return pg_insert(table)
+    return sqlite_insert(table)
+
+# =====================================================
+# ÉCRITURES EN UN ALLER-RETOUR (INSERT/UPDATE/DELETE … RETURNING)
+# =====================================================
+
+def _valider_ligne_retournee(db: Session, requete):
+    """Exécuter une écriture … RETURNING d'entité puis valider.
+
+    L'objet construit depuis la ligne renvoyée par la base (valeurs par défaut et
+    triggers compris) est détaché de la session : il reste lisible après le commit,
+    la réponse est sérialisée sans relecture. None si aucune ligne n'est touchée.
+    """
+    ligne = db.scalars(requete.execution_options(populate_existing=True)).one_or_none()
+    if ligne is not None:
+        db.expunge(ligne)
+    db.commit()
+    return ligne
+
+def creer_ligne(db: Session, modele, valeurs: dict):
+    """INSERT … RETURNING : la ligne créée, sans refresh"""
+    return _valider_ligne_retournee(db, insert(modele).values(**valeurs).returning(modele))
+
+def modifier_ligne(db: Session, modele, id: int, modifications: BaseModel):
+    """UPDATE … RETURNING des seuls champs fournis (mise à jour partielle) ; None si l'id n'existe pas"""
+    valeurs = modifications.model_dump(exclude_unset=True)
+    if not valeurs:
+        return db.get(modele, id)
+    return _valider_ligne_retournee(db, update(modele).where(modele.id == id).values(**valeurs).returning(modele))
+
+def supprimer_ligne(db: Session, modele, id: int):
+    """DELETE … RETURNING : la ligne supprimée, None si l'id n'existe pas.
+
+    Les lignes dépendantes sont supprimées par les ON DELETE CASCADE de la base
+    (activés aussi sous SQLite, voir database.py), sans les charger en session.
+    """
+    return _valider_ligne_retournee(db, delete(modele).where(modele.id == id).returning(modele))
+
+# =====================================================
+# PAGINATION PAR CURSEUR (KEYSET)
+# =====================================================
+
+# Ordre de tri de chaque liste paginée : colonnes (la dernière est unique) et sens
+TRI_INVENTAIRE = ((models.Inventaire.id,), False)
+TRI_FOURNISSEURS = ((models.Fournisseur.id,), False)
+TRI_DEMANDES = ((models.Demande.date_demande, models.Demande.id), True)
+TRI_HISTORIQUE = ((models.Historique.date_mouvement, models.Historique.id), True)
+TRI_LISTES_INVENTAIRE = ((models.ListeInventaire.date_creation, models.ListeInventaire.id), True)
+
+class CurseurInvalide(ValueError):
+    """Curseur de pagination illisible ou ne correspondant pas à la liste demandée"""
+
+def encoder_curseur(valeurs):
+    """Encoder les valeurs de tri de la dernière ligne en curseur opaque"""
+    brut = json.dumps([v.isoformat() if isinstance(v, (datetime, date)) else v for v in valeurs])
+    return base64.urlsafe_b64encode(brut.encode()).decode().rstrip("=")
+
+def decoder_curseur(curseur: str, colonnes):
+    """Décoder un curseur en valeurs typées selon les colonnes de tri"""
+    try:
+        valeurs = json.loads(base64.urlsafe_b64decode(curseur + "=" * (-len(curseur) % 4)))
+        if not isinstance(valeurs, list) or len(valeurs) != len(colonnes):
+            raise ValueError
+        return [
+            datetime.fromisoformat(v) if colonne.type.python_type is datetime
+            else date.fromisoformat(v) if colonne.type.python_type is date
+            else int(v)
+            for colonne, v in zip(colonnes, valeurs)
+        ]
+    except (ValueError, TypeError):
+        raise CurseurInvalide("Curseur de pagination invalide")
+
+def requete_paginee(query, tri, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    """Borner une requête (Query ou select()) à une page, par curseur si fourni, sinon par
+    skip/limit (compatibilité).
+    
+    Avec un curseur, la page commence juste après la dernière ligne de la page
+    précédente : le coût ne dépend plus de la profondeur et les insertions
+    concurrentes ne décalent pas les lignes d'une page à l'autre.
+    """
+    colonnes, decroissant = tri
+    query = query.order_by(*[desc(c) if decroissant else asc(c) for c in colonnes])
+    if cursor:
+        valeurs = decoder_curseur(cursor, colonnes)
+        cle, borne = tuple_(*colonnes), tuple_(*valeurs)
+        query = query.filter(cle < borne if decroissant else cle > borne)
+    else:
+        query = query.offset(skip)
+    return query.limit(limit)
+
+def paginer(query, tri, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    """Lignes d'une page d'une Query (voir requete_paginee)"""
+    return requete_paginee(query, tri, skip, limit, cursor).all()
+
+def curseur_suivant(lignes, tri, limit: int):
+    """Curseur de la page suivante, ou None si la page est la dernière"""
+    if not lignes or len(lignes) < limit:
+        return None
+    colonnes, _ = tri
+    return encoder_curseur([getattr(lignes[-1], c.key) for c in colonnes])
+
+# =====================================================
+# VERSIONS DES TABLES (ETAG)
+# =====================================================
+
+def version_tables(db: Session, *modeles):
+    """Version du contenu des tables : somme des compteurs tenus par trigger (PostgreSQL).
+
+    Une lecture d'index de versions_tables quelle que soit la taille des tables ; le
+    compteur est incrémenté dans la transaction de chaque écriture.
+    """
+    noms = [modele.__tablename__ for modele in modeles]
+    return _versions_par_table(noms, db.execute(_requete_versions(noms)).all())
+
+def _requete_versions(noms):
+    return select(models.VersionTable.nom_table, func.sum(models.VersionTable.version)).where(
+        models.VersionTable.nom_table.in_(noms)
+    ).group_by(models.VersionTable.nom_table)
+
+def _versions_par_table(noms, lignes):
+    versions = dict(lignes)
+    return [int(versions.get(nom, 0)) for nom in noms]
+
+def etag_faible(*elements) -> str:
+    """ETag faible (W/"...") dérivé d'une empreinte des éléments donnés"""
+    return 'W/"%s"' % hashlib.md5(repr(elements).encode()).hexdigest()
 
 # =====================================================
 # CRUD POUR INVENTAIRE (PRODUITS)
 # =====================================================
 
-def get_inventaire(db: Session, skip: int = 0, limit: int = 100):
+def get_inventaire(db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
     """Récupérer tous les produits de l'inventaire"""
-    return db.query(models.Inventaire).offset(skip).limit(limit).all()
+    return paginer(db.query(models.Inventaire), TRI_INVENTAIRE, skip, limit, cursor)
 
 def get_inventaire_by_id(db: Session, inventaire_id: int):
     """Récupérer un produit par son ID"""
@@ -21,49 +194,269 @@ def get_inventaire_by_reference(db: Session, reference: str):
     """Récupérer un produit par sa référence QR"""
     return db.query(models.Inventaire).filter(models.Inventaire.reference == reference).first()
 
+def get_inventaire_by_reference_json(db: Session, reference: str):
+    """Produit d'une référence QR déjà sérialisé en JSON, servi depuis cache_produits_reference.
+    
+    Retourne (corps JSON, ETag du corps), ou None si le produit n'existe pas (les absences
+    ne sont pas mises en cache).
+    """
+    entree = cache_produits_reference.get(reference)
+    if entree is not None:
+        return entree
+    generation = cache_produits_reference.generation()
+    return _mettre_en_cache_produit(reference, get_inventaire_by_reference(db, reference), generation)
+
+def _mettre_en_cache_produit(reference: str, db_inventaire, generation: int):
+    """Sérialiser le produit lu ; il n'est mis en cache que si sa référence n'a pas été
+    invalidée depuis la génération prise avant la lecture (écriture concurrente)"""
+    if db_inventaire is None:
+        return None
+    corps = schemas.InventaireResponse.model_validate(db_inventaire).model_dump_json().encode()
+    entree = (corps, etag_faible(corps))
+    cache_produits_reference.set(reference, entree, generation)
+    return entree
+
 def get_inventaire_by_code(db: Session, code: str):
     """Récupérer un produit par son code"""
     return db.query(models.Inventaire).filter(models.Inventaire.code == code).first()
 
 def search_inventaire(db: Session, search_term: str, skip: int = 0, limit: int = 100):
-    """Rechercher des produits par terme de recherche"""
-    return db.query(models.Inventaire).filter(
-        or_(
-            models.Inventaire.code.ilike(f"%{search_term}%"),
-            models.Inventaire.produits.ilike(f"%{search_term}%"),
-            models.Inventaire.reference.ilike(f"%{search_term}%"),
-            models.Inventaire.fournisseur.ilike(f"%{search_term}%"),
-            models.Inventaire.categorie.ilike(f"%{search_term}%")
+    """Rechercher des produits par terme de recherche.
+    
+    Le terme est cherché sans tenir compte des accents ni de la casse dans le code, la
+    désignation, la référence, le fournisseur et la catégorie. Sous PostgreSQL, la
+    recherche passe par l'index trigramme idx_inventaire_recherche, accepte les fautes
+    de frappe légères et classe les résultats par similarité.
+    """
+    document = func.gmao_document_recherche(
+        models.Inventaire.code, models.Inventaire.produits, models.Inventaire.reference,
+        models.Inventaire.fournisseur, models.Inventaire.categorie
+    )
+    terme = func.gmao_normaliser(search_term)
+    contient = document.like(literal("%") + terme + literal("%"))
+    query = db.query(models.Inventaire)
+    if db.get_bind().dialect.name == "postgresql":
+        query = query.filter(or_(contient, terme.op("<%")(document))).order_by(
+            desc(func.word_similarity(terme, document)), models.Inventaire.id
         )
-    ).offset(skip).limit(limit).all()
+    else:
+        # Repli SQLite : sous-chaîne seulement, les correspondances les plus tôt dans le texte d'abord
+        query = query.filter(contient).order_by(func.instr(document, terme), models.Inventaire.id)
+    return query.offset(skip).limit(limit).all()
+
+def autocomplete_inventaire(db: Session, q: str, limit: int = 10):
+    """Suggestions de produits dont la référence ou la désignation commence par q.
+    
+    Deux recherches par préfixe (référence puis désignation normalisée), chacune servie
+    dans l'ordre d'un index en collation C et arrêtée à limit lignes ; le résultat des
+    préfixes fréquents est gardé dans cache_autocomplete.
+    """
+    prefixe = q.strip()
+    cle = (normaliser_texte(prefixe), limit)
+    suggestions = cache_autocomplete.get(cle)
+    if suggestions is not None:
+        return suggestions
+    generation = cache_autocomplete.generation()
+    
+    def cle_prefixe(expression):
+        # Sous PostgreSQL, même collation que les index idx_inventaire_*_prefixe
+        if db.get_bind().dialect.name == "postgresql":
+            return collate(expression, "C")
+        return expression
+    
+    colonnes = (models.Inventaire.id, models.Inventaire.reference, models.Inventaire.produits, models.Inventaire.quantite)
+    reference = cle_prefixe(models.Inventaire.reference)
+    par_reference = db.query(*colonnes).filter(
+        reference.startswith(prefixe, autoescape=True)
+    ).order_by(reference).limit(limit).all()
+    designation = cle_prefixe(func.gmao_normaliser(models.Inventaire.produits))
+    par_designation = db.query(*colonnes).filter(
+        designation.startswith(normaliser_texte(prefixe), autoescape=True)
+    ).order_by(designation).limit(limit).all()
+    
+    suggestions = []
+    vus = set()
+    for ligne in par_reference + par_designation:
+        if ligne.id not in vus and len(suggestions) < limit:
+            vus.add(ligne.id)
+            suggestions.append(ligne._asdict())
+    cache_autocomplete.set(cle, suggestions, generation)
+    return suggestions
 
 def create_inventaire(db: Session, inventaire: schemas.InventaireCreate):
     """Créer un nouveau produit dans l'inventaire"""
-    db_inventaire = models.Inventaire(**inventaire.model_dump())
-    db.add(db_inventaire)
-    db.commit()
-    db.refresh(db_inventaire)
+    db_inventaire = creer_ligne(db, models.Inventaire, inventaire.model_dump())
+    cache_autocomplete.vider()
     return db_inventaire
 
+def designation_produit(inventaire_id: int):
+    """Désignation actuelle d'un produit (sous-requête, évaluée par la base dans l'écriture)"""
+    return select(models.Inventaire.produits).where(models.Inventaire.id == inventaire_id).scalar_subquery()
+
 def update_inventaire(db: Session, inventaire_id: int, inventaire: schemas.InventaireUpdate):
     """Mettre à jour un produit de l'inventaire"""
-    db_inventaire = db.query(models.Inventaire).filter(models.Inventaire.id == inventaire_id).first()
+    update_data = inventaire.model_dump(exclude_unset=True)
+    if "produits" in update_data:
+        # Renommage : l'historique garde l'ancienne désignation (copiée par la base, sans la relire)
+        table = models.Historique.__table__
+        actuelle = designation_produit(inventaire_id)
+        db.execute(
+            update(table).where(
+                table.c.inventaire_id == inventaire_id, table.c.produit.is_(None), actuelle != update_data["produits"]
+            ).values(produit=actuelle)
+        )
+    db_inventaire = modifier_ligne(db, models.Inventaire, inventaire_id, inventaire)
     if db_inventaire:
-        update_data = inventaire.model_dump(exclude_unset=True)
-        for field, value in update_data.items():
-            setattr(db_inventaire, field, value)
-        db.commit()
-        db.refresh(db_inventaire)
+        cache_autocomplete.vider()
+        cache_produits_reference.supprimer(db_inventaire.reference)
     return db_inventaire
 
 def delete_inventaire(db: Session, inventaire_id: int):
     """Supprimer un produit de l'inventaire"""
-    db_inventaire = db.query(models.Inventaire).filter(models.Inventaire.id == inventaire_id).first()
+    figer_libelles_historique(db, {inventaire_id: designation_produit(inventaire_id)}, detacher=True)
+    db_inventaire = supprimer_ligne(db, models.Inventaire, inventaire_id)
     if db_inventaire:
-        db.delete(db_inventaire)
-        db.commit()
+        cache_autocomplete.vider()
+        cache_produits_reference.supprimer(db_inventaire.reference)
     return db_inventaire
 
+def bulk_upsert_inventaire(db: Session, items: List[schemas.InventaireBulkItem], conflit: str = "ignorer"):
+    """Créer et mettre à jour des produits en masse dans une seule transaction.
+    
+    Les lignes sans `id` sont insérées par INSERT multi-lignes ... ON CONFLICT (reference),
+    les lignes avec `id` sont des mises à jour partielles. Une mise à jour qui ne change
+    rien est ignorée ("skipped") ; un code déjà porté par un autre produit, en base ou
+    dans le lot, met la ligne en erreur. Retourne un résultat par ligne.
+    """
+    # Un gros import dépasse facilement le DB_STATEMENT_TIMEOUT des requêtes interactives
+    lever_statement_timeout(db)
+    resultats = [None] * len(items)
+    creations = {}  # reference -> (index, données complètes, champs fournis)
+    mises_a_jour = []  # (index, id, champs fournis)
+    
+    def resultat(index, statut, id=None, reference=None, message=None):
+        resultats[index] = {"index": index, "statut": statut, "id": id, "reference": reference, "message": message}
+    
+    # Valider chaque ligne indépendamment
+    for index, item in enumerate(items):
+        donnees = item.model_dump(exclude_unset=True)
+        donnees.pop("id", None)
+        if item.id is not None:
+            donnees.pop("reference", None)  # La référence QR ne peut pas être modifiée
+            mises_a_jour.append((index, item.id, donnees))
+            continue
+        try:
+            produit = schemas.InventaireCreate(**donnees)
+        except ValidationError as e:
+            message = "; ".join(f"{'.'.join(str(l) for l in err['loc'])}: {err['msg']}" for err in e.errors())
+            resultat(index, "error", reference=item.reference, message=message)
+            continue
+        if produit.reference in creations:
+            resultat(index, "error", reference=produit.reference, message="Référence en double dans le lot")
+            continue
+        creation = produit.model_dump()
+        creation["date_entree"] = creation["date_entree"] or date.today()
+        creations[produit.reference] = (index, creation, set(donnees))
+    
+    # Références déjà connues : la création devient une mise à jour (conflit="mettre_a_jour") ou est ignorée
+    references_existantes = {}
+    for lot in _par_lots(creations):
+        references_existantes.update(
+            db.query(models.Inventaire.reference, models.Inventaire.id).filter(models.Inventaire.reference.in_(lot)).all()
+        )
+    for reference in [r for r in creations if r in references_existantes]:
+        index, creation, champs_fournis = creations.pop(reference)
+        if conflit == "mettre_a_jour":
+            champs = {champ: creation[champ] for champ in champs_fournis if champ != "reference"}
+            mises_a_jour.append((index, references_existantes[reference], champs))
+        else:
+            resultat(index, "skipped", id=references_existantes[reference], reference=reference,
+                     message="Un produit avec cette référence existe déjà")
+    
+    # Valeurs actuelles des produits mis à jour : seuls les champs qui changent sont écrits
+    colonnes_modifiables = [getattr(models.Inventaire, champ) for champ in schemas.InventaireUpdate.model_fields]
+    actuels = {}  # id -> valeurs actuelles (dont reference)
+    for lot in _par_lots({id for _, id, _ in mises_a_jour}):
+        for ligne in db.query(models.Inventaire.id, models.Inventaire.reference, *colonnes_modifiables).filter(
+            models.Inventaire.id.in_(lot)
+        ):
+            actuels[ligne.id] = ligne._asdict()
+    a_modifier = []  # (index, id, champs modifiés)
+    for index, id, champs in mises_a_jour:
+        if id not in actuels:
+            resultat(index, "error", id=id, message="Produit non trouvé")
+            continue
+        champs = {champ: valeur for champ, valeur in champs.items() if valeur != actuels[id][champ]}
+        if not champs:
+            resultat(index, "skipped", id=id, reference=actuels[id]["reference"], message="Aucune modification")
+            continue
+        a_modifier.append((index, id, champs))
+    
+    # Un code ne peut appartenir qu'à un produit : contrôle des nouveaux codes (créations et
+    # mises à jour) contre la base et contre les autres lignes du lot
+    proprietaires_codes = {}  # code -> ids des produits qui le portent en base
+    nouveaux_codes = {c["code"] for _, c, _ in creations.values()} | {c["code"] for _, _, c in a_modifier if "code" in c}
+    for lot in _par_lots(nouveaux_codes):
+        for code, id in db.query(models.Inventaire.code, models.Inventaire.id).filter(models.Inventaire.code.in_(lot)):
+            proprietaires_codes.setdefault(code, set()).add(id)
+    codes_du_lot = set()
+    
+    def code_disponible(code, id=None):
+        if code in codes_du_lot or proprietaires_codes.get(code, set()) - {id}:
+            return False
+        codes_du_lot.add(code)
+        return True
+    
+    a_inserer = []
+    for reference, (index, creation, champs_fournis) in creations.items():
+        if not code_disponible(creation["code"]):
+            resultat(index, "error", reference=reference, message="Un produit avec ce code existe déjà")
+            continue
+        a_inserer.append((index, creation))
+    
+    # INSERT multi-lignes ; une référence créée entre-temps par un autre client est rejetée par ON CONFLICT
+    for lot in _par_lots(a_inserer):
+        stmt = _insert_dialecte(db, models.Inventaire).values([creation for _, creation in lot])
+        stmt = stmt.on_conflict_do_nothing(index_elements=["reference"])
+        stmt = stmt.returning(models.Inventaire.id, models.Inventaire.reference)
+        inseres = {reference: id for id, reference in db.execute(stmt)}
+        for index, creation in lot:
+            reference = creation["reference"]
+            if reference in inseres:
+                resultat(index, "created", id=inseres[reference], reference=reference)
+            else:
+                resultat(index, "skipped", reference=reference, message="Un produit avec cette référence existe déjà")
+    
+    # Mises à jour partielles : une instruction UPDATE par clé primaire, exécutée en executemany
+    lignes_maj = []
+    renommes = {}
+    for index, id, champs in a_modifier:
+        reference = actuels[id]["reference"]
+        if "code" in champs and not code_disponible(champs["code"], id):
+            resultat(index, "error", id=id, reference=reference, message="Un produit avec ce code existe déjà")
+            continue
+        lignes_maj.append({"id": id, **champs})
+        if "produits" in champs:
+            renommes[id] = actuels[id]["produits"]
+        resultat(index, "updated", id=id, reference=reference)
+    figer_libelles_historique(db, renommes)
+    for lot in _par_lots(lignes_maj):
+        db.execute(update(models.Inventaire), lot)
+    
+    db.commit()
+    cache_autocomplete.vider()
+    cache_produits_reference.supprimer(*(r["reference"] for r in resultats if r["statut"] == "updated"))
+    
+    statuts = [r["statut"] for r in resultats]
+    return {
+        "total": len(resultats),
+        "crees": statuts.count("created"),
+        "mis_a_jour": statuts.count("updated"),
+        "ignores": statuts.count("skipped"),
+        "erreurs": statuts.count("error"),
+        "resultats": resultats
+    }
+
 def get_inventaire_by_emplacement(db: Session, emplacement: str):
     """Récupérer tous les produits d'un emplacement"""
     return db.query(models.Inventaire).filter(models.Inventaire.emplacement == emplacement).all()
@@ -73,18 +466,77 @@ def get_inventaire_by_fournisseur(db: Session, fournisseur: str):
     return db.query(models.Inventaire).filter(models.Inventaire.fournisseur == fournisseur).all()
 
 def get_inventaire_stock_faible(db: Session):
-    """Récupérer les produits avec un stock faible (quantité <= stock_min)"""
+    """Récupérer les produits avec un stock critique ou faible (sous le seuil d'alerte)"""
     return db.query(models.Inventaire).filter(
-        models.Inventaire.quantite <= models.Inventaire.stock_min
-    ).all()
+        models.Inventaire.statut_stock.in_(("critique", "faible"))
+    ).order_by(models.Inventaire.id).all()
+
+# Statuts de stock signalés comme alertes (colonne générée inventaire.statut_stock)
+STATUTS_ALERTE = ("critique", "faible", "surstock")
+
+def get_inventaire_alertes(db: Session, statut: Optional[str] = None, fournisseur: Optional[str] = None,
+                           skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    """Récupérer les produits en alerte de stock, par statut et fournisseur, via l'index sur statut_stock"""
+    query = db.query(models.Inventaire)
+    if statut:
+        query = query.filter(models.Inventaire.statut_stock == statut)
+    else:
+        # Même prédicat que l'index partiel idx_inventaire_alertes
+        query = query.filter(models.Inventaire.statut_stock != "normal")
+    if fournisseur:
+        query = query.filter(models.Inventaire.fournisseur == fournisseur)
+    return paginer(query, TRI_INVENTAIRE, skip, limit, cursor)
+
+def get_inventaire_stats(db: Session, fournisseur: Optional[str] = None, site: Optional[str] = None,
+                         categorie: Optional[str] = None):
+    """Compter les produits par statut de stock et totaliser la valeur du stock en une requête"""
+    statut = models.Inventaire.statut_stock
+    query = db.query(
+        func.count(models.Inventaire.id).label("total_produits"),
+        func.count(case((statut == "critique", 1))).label("stock_critique"),
+        func.count(case((statut == "faible", 1))).label("stock_faible"),
+        func.count(case((statut == "surstock", 1))).label("surstock"),
+        func.count(case((statut == "normal", 1))).label("stock_normal"),
+        func.coalesce(func.sum(
+            func.coalesce(models.Inventaire.quantite, 0) * func.coalesce(models.Inventaire.prix_unitaire, 0)
+        ), 0).label("valeur_totale")
+    )
+    if fournisseur:
+        query = query.filter(models.Inventaire.fournisseur == fournisseur)
+    if site:
+        query = query.filter(models.Inventaire.site == site)
+    if categorie:
+        query = query.filter(models.Inventaire.categorie == categorie)
+    return query.one()._asdict()
+
+# Colonnes exportables par /inventaire/export, dans l'ordre du fichier par défaut
+COLONNES_EXPORT_INVENTAIRE = tuple(models.Inventaire.__table__.columns.keys())
+
+def requete_export_inventaire(colonnes: List[str], fournisseur: Optional[str] = None, site: Optional[str] = None,
+                              categorie: Optional[str] = None, statut: Optional[str] = None):
+    """Requête Core de l'export de l'inventaire : colonnes choisies, filtres, ordre par id.
+    
+    Les lignes sont lues sous forme de tuples, sans instancier d'objets ORM.
+    """
+    table = models.Inventaire.__table__
+    requete = select(*[table.c[nom] for nom in colonnes]).order_by(table.c.id)
+    if fournisseur:
+        requete = requete.where(table.c.fournisseur == fournisseur)
+    if site:
+        requete = requete.where(table.c.site == site)
+    if categorie:
+        requete = requete.where(table.c.categorie == categorie)
+    if statut:
+        requete = requete.where(table.c.statut_stock == statut)
+    return requete
 
 # =====================================================
 # CRUD POUR FOURNISSEURS
 # =====================================================
 
-def get_fournisseurs(db: Session, skip: int = 0, limit: int = 100):
+def get_fournisseurs(db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
     """Récupérer tous les fournisseurs"""
-    return db.query(models.Fournisseur).offset(skip).limit(limit).all()
+    return paginer(db.query(models.Fournisseur), TRI_FOURNISSEURS, skip, limit, cursor)
 
 def get_fournisseur_by_id(db: Session, fournisseur_id: int):
     """Récupérer un fournisseur par son ID"""
@@ -96,30 +548,15 @@ def get_fournisseur_by_id_fournisseur(db: Session, id_fournisseur: str):
 
 def create_fournisseur(db: Session, fournisseur: schemas.FournisseurCreate):
     """Créer un nouveau fournisseur"""
-    db_fournisseur = models.Fournisseur(**fournisseur.model_dump())
-    db.add(db_fournisseur)
-    db.commit()
-    db.refresh(db_fournisseur)
-    return db_fournisseur
+    return creer_ligne(db, models.Fournisseur, fournisseur.model_dump())
 
 def update_fournisseur(db: Session, fournisseur_id: int, fournisseur: schemas.FournisseurUpdate):
     """Mettre à jour un fournisseur"""
-    db_fournisseur = db.query(models.Fournisseur).filter(models.Fournisseur.id == fournisseur_id).first()
-    if db_fournisseur:
-        update_data = fournisseur.model_dump(exclude_unset=True)
-        for field, value in update_data.items():
-            setattr(db_fournisseur, field, value)
-        db.commit()
-        db.refresh(db_fournisseur)
-    return db_fournisseur
+    return modifier_ligne(db, models.Fournisseur, fournisseur_id, fournisseur)
 
 def delete_fournisseur(db: Session, fournisseur_id: int):
     """Supprimer un fournisseur"""
-    db_fournisseur = db.query(models.Fournisseur).filter(models.Fournisseur.id == fournisseur_id).first()
-    if db_fournisseur:
-        db.delete(db_fournisseur)
-        db.commit()
-    return db_fournisseur
+    return supprimer_ligne(db, models.Fournisseur, fournisseur_id)
 
 # =====================================================
 # CRUD POUR LA HIÉRARCHIE SITE > LIEU > EMPLACEMENT
@@ -140,30 +577,15 @@ def get_site_by_code(db: Session, code_site: str):
 
 def create_site(db: Session, site: schemas.SiteCreate):
     """Créer un nouveau site"""
-    db_site = models.Site(**site.model_dump())
-    db.add(db_site)
-    db.commit()
-    db.refresh(db_site)
-    return db_site
+    return creer_ligne(db, models.Site, site.model_dump())
 
 def update_site(db: Session, site_id: int, site: schemas.SiteUpdate):
     """Mettre à jour un site"""
-    db_site = db.query(models.Site).filter(models.Site.id == site_id).first()
-    if db_site:
-        update_data = site.model_dump(exclude_unset=True)
-        for field, value in update_data.items():
-            setattr(db_site, field, value)
-        db.commit()
-        db.refresh(db_site)
-    return db_site
+    return modifier_ligne(db, models.Site, site_id, site)
 
 def delete_site(db: Session, site_id: int):
     """Supprimer un site"""
-    db_site = db.query(models.Site).filter(models.Site.id == site_id).first()
-    if db_site:
-        db.delete(db_site)
-        db.commit()
-    return db_site
+    return supprimer_ligne(db, models.Site, site_id)
 
 # LIEUX
 def get_lieux(db: Session, skip: int = 0, limit: int = 100):
@@ -184,30 +606,15 @@ def get_lieu_by_code(db: Session, code_lieu: str):
 
 def create_lieu(db: Session, lieu: schemas.LieuCreate):
     """Créer un nouveau lieu"""
-    db_lieu = models.Lieu(**lieu.model_dump())
-    db.add(db_lieu)
-    db.commit()
-    db.refresh(db_lieu)
-    return db_lieu
+    return creer_ligne(db, models.Lieu, lieu.model_dump())
 
 def update_lieu(db: Session, lieu_id: int, lieu: schemas.LieuUpdate):
     """Mettre à jour un lieu"""
-    db_lieu = db.query(models.Lieu).filter(models.Lieu.id == lieu_id).first()
-    if db_lieu:
-        update_data = lieu.model_dump(exclude_unset=True)
-        for field, value in update_data.items():
-            setattr(db_lieu, field, value)
-        db.commit()
-        db.refresh(db_lieu)
-    return db_lieu
+    return modifier_ligne(db, models.Lieu, lieu_id, lieu)
 
 def delete_lieu(db: Session, lieu_id: int):
     """Supprimer un lieu"""
-    db_lieu = db.query(models.Lieu).filter(models.Lieu.id == lieu_id).first()
-    if db_lieu:
-        db.delete(db_lieu)
-        db.commit()
-    return db_lieu
+    return supprimer_ligne(db, models.Lieu, lieu_id)
 
 # EMPLACEMENTS
 def get_emplacements(db: Session, skip: int = 0, limit: int = 100):
@@ -240,30 +647,15 @@ def create_emplacement(db: Session, emplacement: schemas.EmplacementCreate):
     emplacement_data = emplacement.model_dump()
     emplacement_data['code_emplacement'] = code_emplacement
     
-    db_emplacement = models.Emplacement(**emplacement_data)
-    db.add(db_emplacement)
-    db.commit()
-    db.refresh(db_emplacement)
-    return db_emplacement
+    return creer_ligne(db, models.Emplacement, emplacement_data)
 
 def update_emplacement(db: Session, emplacement_id: int, emplacement: schemas.EmplacementUpdate):
     """Mettre à jour un emplacement"""
-    db_emplacement = db.query(models.Emplacement).filter(models.Emplacement.id == emplacement_id).first()
-    if db_emplacement:
-        update_data = emplacement.model_dump(exclude_unset=True)
-        for field, value in update_data.items():
-            setattr(db_emplacement, field, value)
-        db.commit()
-        db.refresh(db_emplacement)
-    return db_emplacement
+    return modifier_ligne(db, models.Emplacement, emplacement_id, emplacement)
 
 def delete_emplacement(db: Session, emplacement_id: int):
     """Supprimer un emplacement"""
-    db_emplacement = db.query(models.Emplacement).filter(models.Emplacement.id == emplacement_id).first()
-    if db_emplacement:
-        db.delete(db_emplacement)
-        db.commit()
-    return db_emplacement
+    return supprimer_ligne(db, models.Emplacement, emplacement_id)
 
 # FONCTIONS UTILITAIRES POUR LA HIÉRARCHIE
 def get_emplacements_with_hierarchy(db: Session, skip: int = 0, limit: int = 100):
@@ -305,9 +697,9 @@ def get_sites_with_stats(db: Session):
 # CRUD POUR DEMANDES
 # =====================================================
 
-def get_demandes(db: Session, skip: int = 0, limit: int = 100):
+def get_demandes(db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
     """Récupérer toutes les demandes"""
-    return db.query(models.Demande).order_by(desc(models.Demande.date_demande)).offset(skip).limit(limit).all()
+    return paginer(db.query(models.Demande), TRI_DEMANDES, skip, limit, cursor)
 
 def get_demande_by_id(db: Session, demande_id: int):
     """Récupérer une demande par son ID"""
@@ -327,46 +719,131 @@ def get_demandes_by_demandeur(db: Session, demandeur: str):
 
 def create_demande(db: Session, demande: schemas.DemandeCreate):
     """Créer une nouvelle demande"""
-    db_demande = models.Demande(**demande.model_dump())
-    db.add(db_demande)
-    db.commit()
-    db.refresh(db_demande)
-    return db_demande
+    return creer_ligne(db, models.Demande, demande.model_dump())
 
 def update_demande(db: Session, demande_id: int, demande: schemas.DemandeUpdate):
     """Mettre à jour une demande"""
-    db_demande = db.query(models.Demande).filter(models.Demande.id == demande_id).first()
-    if db_demande:
-        update_data = demande.model_dump(exclude_unset=True)
-        for field, value in update_data.items():
-            setattr(db_demande, field, value)
-        db.commit()
-        db.refresh(db_demande)
-    return db_demande
+    return modifier_ligne(db, models.Demande, demande_id, demande)
 
 # =====================================================
 # CRUD POUR HISTORIQUE
 # =====================================================
 
-def get_historique(db: Session, skip: int = 0, limit: int = 100):
+def get_historique(db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
     """Récupérer l'historique des mouvements"""
-    return db.query(models.Historique).order_by(desc(models.Historique.date_mouvement)).offset(skip).limit(limit).all()
+    return paginer(db.query(models.Historique), TRI_HISTORIQUE, skip, limit, cursor)
 
 def get_historique_by_reference(db: Session, reference: str):
     """Récupérer l'historique d'un produit par sa référence"""
     return db.query(models.Historique).filter(models.Historique.reference == reference).order_by(desc(models.Historique.date_mouvement)).all()
 
+def filtre_nature_historique(nature: str):
+    """Condition « nature == libellé » sur l'index de type_mouvement.
+
+    Un libellé standard (TYPES_MOUVEMENT) n'est pas stocké : il correspond aux lignes de
+    son type sans libellé libre ; un autre libellé est comparé à la colonne nature.
+    """
+    table = models.Historique.__table__
+    code = models.code_type_mouvement(nature)
+    if nature == models.TYPES_MOUVEMENT[code]:
+        return and_(table.c.type_mouvement == code, table.c.nature.is_(None))
+    return and_(table.c.type_mouvement == code, table.c.nature == nature)
+
 def get_historique_by_nature(db: Session, nature: str):
     """Récupérer l'historique par type de mouvement"""
-    return db.query(models.Historique).filter(models.Historique.nature == nature).order_by(desc(models.Historique.date_mouvement)).all()
+    return db.query(models.Historique).filter(filtre_nature_historique(nature)).order_by(desc(models.Historique.date_mouvement)).all()
+
+def valeurs_historique(nature: str, produit: Optional[str], inventaire_id: Optional[int] = None,
+                       libelle_inventaire: Optional[str] = None) -> dict:
+    """Colonnes compactes d'une ligne d'historique (attributs du modèle Historique).
+
+    Le libellé du produit et la nature ne sont recopiés que s'ils diffèrent de la fiche
+    inventaire liée et du libellé standard du type de mouvement.
+    """
+    code = models.code_type_mouvement(nature)
+    return {
+        "inventaire_id": inventaire_id,
+        "type_mouvement": code,
+        "nature_libre": None if nature == models.TYPES_MOUVEMENT[code] else nature,
+        "produit_libelle": None if inventaire_id is not None and produit == libelle_inventaire else produit
+    }
+
+def figer_libelles_historique(db: Session, libelles: dict, detacher: bool = False):
+    """Recopier dans l'historique la désignation actuelle de produits (id -> désignation,
+    valeur ou sous-requête) sur le point d'être renommés ou supprimés ; sans commit.
+
+    detacher : délier aussi les mouvements du produit supprimé (ON DELETE SET NULL de
+    PostgreSQL, que SQLite n'applique pas et dont il peut réutiliser l'id), dans la même
+    instruction.
+    """
+    table = models.Historique.__table__
+    for id, libelle in libelles.items():
+        if detacher:
+            db.execute(
+                update(table).where(table.c.inventaire_id == id)
+                .values(produit=func.coalesce(table.c.produit, libelle), inventaire_id=None)
+            )
+        else:
+            db.execute(
+                update(table).where(table.c.inventaire_id == id, table.c.produit.is_(None)).values(produit=libelle)
+            )
+
+# Colonnes de /historique/export et des fichiers Parquet, dans l'ordre du fichier : format
+# d'avant la compaction de la table, pour que les archives déjà écrites restent lisibles
+COLONNES_EXPORT_HISTORIQUE = (
+    "id", "date_mouvement", "reference", "produit", "nature",
+    "quantite_mouvement", "quantite_avant", "quantite_apres", "created_at"
+)
+
+def requete_export_historique(debut: Optional[datetime] = None, fin: Optional[datetime] = None,
+                              nature: Optional[str] = None, reference: Optional[str] = None):
+    """Requête Core de l'export de l'historique sur [debut, fin[, ordre chronologique.
+    
+    Parcourue via idx_historique_date_id, ou idx_historique_reference_date pour un produit.
+    """
+    table = models.Historique.__table__
+    inventaire = models.Inventaire.__table__
+    colonnes = {
+        "produit": func.coalesce(table.c.produit, inventaire.c.produits).label("produit"),
+        "nature": func.coalesce(
+            table.c.nature, case(models.TYPES_MOUVEMENT, value=table.c.type_mouvement)
+        ).label("nature")
+    }
+    requete = select(
+        *[colonnes.get(nom, table.c[nom]) for nom in COLONNES_EXPORT_HISTORIQUE]
+    ).select_from(
+        table.outerjoin(inventaire, inventaire.c.id == table.c.inventaire_id)
+    ).order_by(table.c.date_mouvement, table.c.id)
+    if debut:
+        requete = requete.where(table.c.date_mouvement >= debut)
+    if fin:
+        requete = requete.where(table.c.date_mouvement < fin)
+    if nature:
+        requete = requete.where(filtre_nature_historique(nature))
+    if reference:
+        requete = requete.where(table.c.reference == reference)
+    return requete
 
 def create_historique(db: Session, historique: schemas.HistoriqueCreate):
     """Créer un nouvel enregistrement d'historique"""
-    db_historique = models.Historique(**historique.model_dump())
-    db.add(db_historique)
+    donnees = historique.model_dump()
+    produit = db.query(models.Inventaire.id, models.Inventaire.produits).filter(
+        models.Inventaire.reference == historique.reference
+    ).first() if historique.reference else None
+    donnees.update(valeurs_historique(
+        donnees.pop("nature"), donnees.pop("produit"),
+        produit.id if produit else None, produit.produits if produit else None
+    ))
+    # Colonnes de la table (RETURNING ne peut pas porter les column_property de
+    # models.Historique) ; désignation et nature reconstituées comme ces dernières
+    table = models.Historique.__table__
+    ligne = db.execute(insert(models.Historique).values(**donnees).returning(*table.c)).one()
     db.commit()
-    db.refresh(db_historique)
-    return db_historique
+    return schemas.HistoriqueResponse.model_validate({
+        **ligne._mapping,
+        "produit": ligne.produit or (produit.produits if produit else None),
+        "nature": ligne.nature or models.TYPES_MOUVEMENT[ligne.type_mouvement],
+    })
 
 # =====================================================
 # CRUD POUR TABLES D'ATELIER
@@ -390,38 +867,23 @@ def get_tables_atelier_by_type(db: Session, type_atelier: str):
 
 def create_table_atelier(db: Session, table: schemas.TableAtelierCreate):
     """Créer une nouvelle table d'atelier"""
-    db_table = models.TableAtelier(**table.model_dump())
-    db.add(db_table)
-    db.commit()
-    db.refresh(db_table)
-    return db_table
+    return creer_ligne(db, models.TableAtelier, table.model_dump())
 
 def update_table_atelier(db: Session, table_id: int, table: schemas.TableAtelierUpdate):
     """Mettre à jour une table d'atelier"""
-    db_table = db.query(models.TableAtelier).filter(models.TableAtelier.id == table_id).first()
-    if db_table:
-        update_data = table.model_dump(exclude_unset=True)
-        for field, value in update_data.items():
-            setattr(db_table, field, value)
-        db.commit()
-        db.refresh(db_table)
-    return db_table
+    return modifier_ligne(db, models.TableAtelier, table_id, table)
 
 def delete_table_atelier(db: Session, table_id: int):
     """Supprimer une table d'atelier"""
-    db_table = db.query(models.TableAtelier).filter(models.TableAtelier.id == table_id).first()
-    if db_table:
-        db.delete(db_table)
-        db.commit()
-    return db_table
+    return supprimer_ligne(db, models.TableAtelier, table_id)
 
 # =====================================================
 # CRUD POUR LISTES D'INVENTAIRE
 # =====================================================
 
-def get_listes_inventaire(db: Session, skip: int = 0, limit: int = 100):
+def get_listes_inventaire(db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
     """Récupérer toutes les listes d'inventaire"""
-    return db.query(models.ListeInventaire).order_by(desc(models.ListeInventaire.date_creation)).offset(skip).limit(limit).all()
+    return paginer(db.query(models.ListeInventaire), TRI_LISTES_INVENTAIRE, skip, limit, cursor)
 
 def get_liste_inventaire_by_id(db: Session, liste_id: int):
     """Récupérer une liste d'inventaire par son ID"""
@@ -433,30 +895,15 @@ def get_liste_inventaire_by_id_liste(db: Session, id_liste: str):
 
 def create_liste_inventaire(db: Session, liste: schemas.ListeInventaireCreate):
     """Créer une nouvelle liste d'inventaire"""
-    db_liste = models.ListeInventaire(**liste.model_dump())
-    db.add(db_liste)
-    db.commit()
-    db.refresh(db_liste)
-    return db_liste
+    return creer_ligne(db, models.ListeInventaire, liste.model_dump())
 
 def update_liste_inventaire(db: Session, liste_id: int, liste: schemas.ListeInventaireUpdate):
     """Mettre à jour une liste d'inventaire"""
-    db_liste = db.query(models.ListeInventaire).filter(models.ListeInventaire.id == liste_id).first()
-    if db_liste:
-        update_data = liste.model_dump(exclude_unset=True)
-        for field, value in update_data.items():
-            setattr(db_liste, field, value)
-        db.commit()
-        db.refresh(db_liste)
-    return db_liste
+    return modifier_ligne(db, models.ListeInventaire, liste_id, liste)
 
 def delete_liste_inventaire(db: Session, liste_id: int):
     """Supprimer une liste d'inventaire"""
-    db_liste = db.query(models.ListeInventaire).filter(models.ListeInventaire.id == liste_id).first()
-    if db_liste:
-        db.delete(db_liste)
-        db.commit()
-    return db_liste
+    return supprimer_ligne(db, models.ListeInventaire, liste_id)
 
 # =====================================================
 # CRUD POUR PRODUITS DES LISTES D'INVENTAIRE
@@ -468,75 +915,271 @@ def get_produits_liste_inventaire(db: Session, id_liste: str):
 
 def create_produit_liste_inventaire(db: Session, produit: schemas.ProduitListeInventaireCreate):
     """Ajouter un produit à une liste d'inventaire"""
-    db_produit = models.ProduitListeInventaire(**produit.model_dump())
-    db.add(db_produit)
-    db.commit()
-    db.refresh(db_produit)
-    return db_produit
+    return creer_ligne(db, models.ProduitListeInventaire, produit.model_dump())
 
 def update_produit_liste_inventaire(db: Session, produit_id: int, produit: schemas.ProduitListeInventaireUpdate):
     """Mettre à jour un produit dans une liste d'inventaire"""
-    db_produit = db.query(models.ProduitListeInventaire).filter(models.ProduitListeInventaire.id == produit_id).first()
-    if db_produit:
-        update_data = produit.model_dump(exclude_unset=True)
-        for field, value in update_data.items():
-            setattr(db_produit, field, value)
-        db.commit()
-        db.refresh(db_produit)
-    return db_produit
+    return modifier_ligne(db, models.ProduitListeInventaire, produit_id, produit)
 
 # =====================================================
 # FONCTIONS UTILITAIRES POUR LES MOUVEMENTS DE STOCK
 # =====================================================
 
 def effectuer_mouvement_stock(db: Session, mouvement: schemas.MouvementStockCreate):
-    """Effectuer un mouvement de stock et mettre à jour l'inventaire"""
-    # Récupérer le produit
-    produit = get_inventaire_by_reference(db, mouvement.reference_produit)
-    if not produit:
-        return {"success": False, "message": "Produit non trouvé"}
-    
-    # Calculer les nouvelles quantités
-    quantite_avant = produit.quantite
-    
-    if mouvement.nature.lower() == "entrée":
-        quantite_apres = quantite_avant + mouvement.quantite
-    elif mouvement.nature.lower() == "sortie":
-        if quantite_avant < mouvement.quantite:
-            return {"success": False, "message": "Stock insuffisant"}
-        quantite_apres = quantite_avant - mouvement.quantite
-    elif mouvement.nature.lower() == "ajustement":
-        # Pour un ajustement, mouvement.quantite est la nouvelle quantité totale
-        quantite_apres = mouvement.quantite
-    else:
-        return {"success": False, "message": "Type de mouvement invalide"}
+    """Effectuer un mouvement de stock et mettre à jour l'inventaire.
     
-    # Calculer la quantité de mouvement pour l'historique
-    if mouvement.nature.lower() == "ajustement":
-        # Pour un ajustement, la quantité de mouvement est la différence
-        quantite_mouvement_historique = abs(quantite_apres - quantite_avant)
-    else:
-        # Pour entrée/sortie, c'est la quantité du mouvement
-        quantite_mouvement_historique = mouvement.quantite
+    La quantité est modifiée par un UPDATE conditionnel (ou sous verrou de ligne pour un
+    ajustement) et l'historique est inséré dans la même transaction : deux scanners
+    simultanés sur la même référence ne peuvent pas perdre de mise à jour.
+    """
+    nature = mouvement.nature.lower()
+    produit = None
+    if nature == "ajustement":
+        produit = db.execute(_verrou_ajustement(mouvement)).first()
+        if not produit:
+            db.rollback()
+            return {"success": False, "message": "Produit non trouvé"}
+    elif nature not in ("entrée", "sortie"):
+        existe = db.execute(_existence_produit(mouvement)).first()
+        return {"success": False, "message": "Type de mouvement invalide" if existe else "Produit non trouvé"}
+    
+    ligne = db.execute(_update_mouvement(mouvement, nature, produit), execution_options={"synchronize_session": False}).first()
+    if ligne is None:
+        # Aucune ligne modifiée : produit absent ou stock insuffisant
+        existe = db.execute(_existence_produit(mouvement)).first()
+        db.rollback()
+        return {"success": False, "message": "Stock insuffisant" if existe else "Produit non trouvé"}
     
-    # Créer l'enregistrement d'historique
-    historique_data = schemas.HistoriqueCreate(
+    # Enregistrer l'historique dans la même transaction que la mise à jour du stock
+    db.execute(_historique_mouvement(mouvement, nature, ligne, produit))
+    db.commit()
+    return _mouvement_effectue(mouvement, ligne.quantite)
+
+# Instructions d'un mouvement unitaire, communes à effectuer_mouvement_stock et à sa
+# version asynchrone
+
+def _verrou_ajustement(mouvement: schemas.MouvementStockCreate):
+    """Ligne à ajuster, verrouillée : l'ajustement remplace la quantité lue"""
+    return select(models.Inventaire.id, models.Inventaire.quantite).where(
+        models.Inventaire.reference == mouvement.reference_produit
+    ).with_for_update()
+
+def _existence_produit(mouvement: schemas.MouvementStockCreate):
+    return select(models.Inventaire.id).where(models.Inventaire.reference == mouvement.reference_produit)
+
+def _update_mouvement(mouvement: schemas.MouvementStockCreate, nature: str, produit=None):
+    """UPDATE ... RETURNING de la quantité ; pour un ajustement, sur la ligne verrouillée produit"""
+    quantite_actuelle = func.coalesce(models.Inventaire.quantite, 0)
+    if nature == "entrée":
+        stmt = update(models.Inventaire).where(
+            models.Inventaire.reference == mouvement.reference_produit
+        ).values(quantite=quantite_actuelle + mouvement.quantite)
+    elif nature == "sortie":
+        # La condition sur le stock est évaluée sur la ligne verrouillée par l'UPDATE
+        stmt = update(models.Inventaire).where(
+            models.Inventaire.reference == mouvement.reference_produit,
+            quantite_actuelle >= mouvement.quantite
+        ).values(quantite=quantite_actuelle - mouvement.quantite)
+    else:
+        # Pour un ajustement, mouvement.quantite est la nouvelle quantité totale
+        stmt = update(models.Inventaire).where(
+            models.Inventaire.id == produit.id
+        ).values(quantite=mouvement.quantite)
+    return stmt.returning(models.Inventaire.id, models.Inventaire.produits, models.Inventaire.quantite)
+
+def _historique_mouvement(mouvement: schemas.MouvementStockCreate, nature: str, ligne, produit=None):
+    """INSERT de l'historique d'un mouvement, d'après la ligne retournée par _update_mouvement"""
+    quantite_apres = ligne.quantite
+    if nature == "entrée":
+        quantite_avant = quantite_apres - mouvement.quantite
+    elif nature == "sortie":
+        quantite_avant = quantite_apres + mouvement.quantite
+    else:
+        quantite_avant = produit.quantite or 0
+    return insert(models.Historique).values(
         date_mouvement=datetime.now(),
         reference=mouvement.reference_produit,
-        produit=produit.produits,
-        nature=mouvement.nature,
-        quantite_mouvement=quantite_mouvement_historique,
+        **valeurs_historique(mouvement.nature, ligne.produits, ligne.id, ligne.produits),
+        # Pour un ajustement, la quantité de mouvement est la différence
+        quantite_mouvement=abs(quantite_apres - quantite_avant) if nature == "ajustement" else mouvement.quantite,
         quantite_avant=quantite_avant,
         quantite_apres=quantite_apres
     )
-    create_historique(db, historique_data)
-    
-    # Mettre à jour la quantité dans l'inventaire
-    update_data = schemas.InventaireUpdate(quantite=quantite_apres)
-    update_inventaire(db, produit.id, update_data)
-    
+
+def _mouvement_effectue(mouvement: schemas.MouvementStockCreate, quantite_apres: int):
+    """Invalider les caches du produit (après commit) et construire la réponse"""
+    cache_autocomplete.vider()
+    cache_produits_reference.supprimer(mouvement.reference_produit)
     return {
         "success": True, 
         "message": f"Mouvement de stock effectué avec succès",
         "nouveau_stock": quantite_apres
-    } 
\ No newline at end of file
+    }
+
+def effectuer_mouvements_stock_batch(db: Session, mouvements: List[schemas.MouvementStockCreate], partiel: bool = False):
+    """Effectuer une série de mouvements de stock en une seule transaction.
+    
+    Les lignes d'inventaire concernées sont verrouillées dans l'ordre de leur référence
+    (octet par octet, d'un lot de lecture à l'autre comme à l'intérieur de chacun) : deux
+    lots concurrents prennent leurs verrous dans le même ordre et ne peuvent pas
+    s'interbloquer. Les mouvements sont appliqués dans l'ordre du lot, puis les quantités
+    et l'historique sont écrits en une fois. Par défaut le lot est tout ou rien ; en mode partiel, les lignes en erreur sont
+    ignorées et les autres sont enregistrées.
+    """
+    # sorted() compare les points de code, comme la collation C de PostgreSQL (et BINARY
+    # de SQLite) : l'ordre entre les lots et dans chaque lot est le même
+    references = sorted({m.reference_produit for m in mouvements})
+    ordre = models.Inventaire.reference
+    if db.get_bind().dialect.name == "postgresql":
+        ordre = collate(ordre, "C")
+    stocks = {}
+    for lot in _par_lots(references):
+        lignes = db.query(
+            models.Inventaire.id, models.Inventaire.reference,
+            models.Inventaire.produits, models.Inventaire.quantite
+        ).filter(
+            models.Inventaire.reference.in_(lot)
+        ).order_by(ordre).with_for_update().all()
+        for ligne in lignes:
+            stocks[ligne.reference] = {
+                "id": ligne.id,
+                "produits": ligne.produits,
+                "quantite": ligne.quantite or 0
+            }
+    
+    resultats = []
+    historiques = []
+    maintenant = datetime.now()
+    for index, mouvement in enumerate(mouvements):
+        resultat = {"index": index, "reference_produit": mouvement.reference_produit}
+        resultats.append(resultat)
+        stock = stocks.get(mouvement.reference_produit)
+        nature = mouvement.nature.lower()
+        
+        if not stock:
+            resultat.update(success=False, message="Produit non trouvé")
+            continue
+        quantite_avant = stock["quantite"]
+        if nature == "entrée":
+            quantite_apres = quantite_avant + mouvement.quantite
+        elif nature == "sortie":
+            if quantite_avant < mouvement.quantite:
+                resultat.update(success=False, message="Stock insuffisant")
+                continue
+            quantite_apres = quantite_avant - mouvement.quantite
+        elif nature == "ajustement":
+            quantite_apres = mouvement.quantite
+        else:
+            resultat.update(success=False, message="Type de mouvement invalide")
+            continue
+        
+        stock["quantite"] = quantite_apres
+        stock["modifie"] = True
+        historiques.append({
+            "date_mouvement": maintenant,
+            "reference": mouvement.reference_produit,
+            **valeurs_historique(mouvement.nature, stock["produits"], stock["id"], stock["produits"]),
+            "quantite_mouvement": abs(quantite_apres - quantite_avant) if nature == "ajustement" else mouvement.quantite,
+            "quantite_avant": quantite_avant,
+            "quantite_apres": quantite_apres
+        })
+        resultat.update(
+            success=True,
+            message="Mouvement de stock effectué avec succès",
+            quantite_avant=quantite_avant,
+            nouveau_stock=quantite_apres
+        )
+    
+    erreurs = sum(1 for r in resultats if not r["success"])
+    if erreurs and not partiel:
+        # Tout ou rien : aucune ligne n'est enregistrée
+        db.rollback()
+        for resultat in resultats:
+            if resultat["success"]:
+                resultat.update(
+                    success=False, message="Annulé : le lot contient des erreurs",
+                    quantite_avant=None, nouveau_stock=None
+                )
+        return {
+            "success": False,
+            "message": f"Lot annulé : {erreurs} ligne(s) en erreur",
+            "total": len(mouvements),
+            "effectues": 0,
+            "erreurs": erreurs,
+            "resultats": resultats
+        }
+    
+    modifications = [
+        {"id": stock["id"], "quantite": stock["quantite"]}
+        for stock in stocks.values() if stock.get("modifie")
+    ]
+    for lot in _par_lots(modifications):
+        db.execute(update(models.Inventaire), lot)
+    for lot in _par_lots(historiques):
+        db.execute(insert(models.Historique), lot)
+    db.commit()
+    cache_autocomplete.vider()
+    cache_produits_reference.supprimer(*(r for r, stock in stocks.items() if stock.get("modifie")))
+    
+    return {
+        "success": erreurs == 0,
+        "message": f"{len(historiques)} mouvement(s) effectué(s), {erreurs} erreur(s)",
+        "total": len(mouvements),
+        "effectues": len(historiques),
+        "erreurs": erreurs,
+        "resultats": resultats
+    }
+
+# =====================================================
+# ACCÈS ASYNCHRONE (ROUTES LES PLUS SOLLICITÉES)
+# =====================================================
+# Mêmes instructions que les fonctions synchrones, exécutées par await db.execute(...) :
+# la boucle d'événements ne porte que l'attente de la base et un travail Python borné
+# (une page, un mouvement). Les traitements par ligne d'un lot (mouvements par lot,
+# import en masse) restent synchrones, exécutés dans le pool de threads de Starlette.
+
+async def get_inventaire_by_reference_json_async(db: AsyncSession, reference: str):
+    """get_inventaire_by_reference_json ; un succès de cache ne touche pas la base"""
+    entree = cache_produits_reference.get(reference)
+    if entree is not None:
+        return entree
+    generation = cache_produits_reference.generation()
+    resultat = await db.execute(select(models.Inventaire).where(models.Inventaire.reference == reference))
+    return _mettre_en_cache_produit(reference, resultat.scalars().first(), generation)
+
+async def get_inventaire_async(db: AsyncSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    requete = requete_paginee(select(models.Inventaire), TRI_INVENTAIRE, skip, limit, cursor)
+    return (await db.execute(requete)).scalars().all()
+
+async def get_historique_async(db: AsyncSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    requete = requete_paginee(select(models.Historique), TRI_HISTORIQUE, skip, limit, cursor)
+    return (await db.execute(requete)).scalars().all()
+
+async def effectuer_mouvement_stock_async(db: AsyncSession, mouvement: schemas.MouvementStockCreate):
+    """effectuer_mouvement_stock, mêmes instructions et même transaction"""
+    nature = mouvement.nature.lower()
+    produit = None
+    if nature == "ajustement":
+        produit = (await db.execute(_verrou_ajustement(mouvement))).first()
+        if not produit:
+            await db.rollback()
+            return {"success": False, "message": "Produit non trouvé"}
+    elif nature not in ("entrée", "sortie"):
+        existe = (await db.execute(_existence_produit(mouvement))).first()
+        return {"success": False, "message": "Type de mouvement invalide" if existe else "Produit non trouvé"}
+    
+    ligne = (await db.execute(
+        _update_mouvement(mouvement, nature, produit), execution_options={"synchronize_session": False}
+    )).first()
+    if ligne is None:
+        existe = (await db.execute(_existence_produit(mouvement))).first()
+        await db.rollback()
+        return {"success": False, "message": "Stock insuffisant" if existe else "Produit non trouvé"}
+    
+    await db.execute(_historique_mouvement(mouvement, nature, ligne, produit))
+    await db.commit()
+    return _mouvement_effectue(mouvement, ligne.quantite)
+
+async def version_tables_async(db: AsyncSession, *modeles):
+    noms = [modele.__tablename__ for modele in modeles]
+    return _versions_par_table(noms, (await db.execute(_requete_versions(noms))).all())
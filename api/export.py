@@ -0,0 +1,250 @@
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Optional
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, Numeric, func, select
+from database import ReadSessionLocal, SessionLocal, lever_statement_timeout
+import crud
+import models
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # Export Parquet indisponible sans pyarrow
+    pa = pc = pq = None
+
+# Lignes lues par aller-retour avec la base et écrites par morceau de réponse
+TAILLE_LOT_EXPORT = 1000
+
+FORMATS_EXPORT = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+def lignes_en_flux(requete, taille_lot: int = TAILLE_LOT_EXPORT, fabrique=ReadSessionLocal, sans_limite: bool = False):
+    """Exécuter une requête Core et produire ses lignes par lots via un curseur côté serveur.
+
+    La session est propre au flux : elle reste ouverte pendant toute la réponse et
+    n'est liée ni à la durée de vie de la requête HTTP ni à get_db. Par défaut, elle
+    lit sur la réplique (database.DATABASE_READ_URL) quand il y en a une. Avec
+    sans_limite, DB_STATEMENT_TIMEOUT ne s'applique pas (exports Parquet).
+    """
+    db = fabrique()
+    try:
+        if sans_limite:
+            lever_statement_timeout(db)
+        resultat = db.execute(requete, execution_options={"yield_per": taille_lot})
+        for lot in resultat.partitions():
+            yield lot
+    finally:
+        db.close()
+
+def _valeur_texte(valeur):
+    """Valeur sérialisable en JSON (même rendu que les réponses de l'API)"""
+    if isinstance(valeur, (datetime, date)):
+        return valeur.isoformat()
+    if isinstance(valeur, Decimal):
+        return str(valeur)
+    return valeur
+
+def flux_csv(colonnes, lots):
+    """Morceaux CSV (en-tête puis un morceau par lot de lignes)"""
+    tampon = io.StringIO()
+    ecrivain = csv.writer(tampon)
+    ecrivain.writerow(colonnes)
+    for lot in lots:
+        ecrivain.writerows(lot)
+        yield tampon.getvalue()
+        tampon.seek(0)
+        tampon.truncate()
+    yield tampon.getvalue()
+
+def flux_ndjson(colonnes, lots):
+    """Morceaux NDJSON : un objet JSON par ligne"""
+    for lot in lots:
+        yield "".join(
+            json.dumps({c: _valeur_texte(v) for c, v in zip(colonnes, ligne)}, ensure_ascii=False) + "\n"
+            for ligne in lot
+        )
+
+def flux_gzip(morceaux, niveau: int = 6):
+    """Compresser des morceaux de texte au fil de l'eau (fichier .gz complet, en mémoire constante)"""
+    compresseur = zlib.compressobj(niveau, zlib.DEFLATED, 31)  # 31 : en-tête et contrôle gzip
+    for morceau in morceaux:
+        donnees = compresseur.compress(morceau.encode("utf-8"))
+        if donnees:
+            yield donnees
+    yield compresseur.flush()
+
+def reponse_export(lots, colonnes, format: str, nom_fichier: str, gzip: bool = False):
+    """StreamingResponse de lots de lignes (lignes_en_flux...) au format csv ou ndjson, en pièce jointe"""
+    flux = (flux_csv if format == "csv" else flux_ndjson)(colonnes, lots)
+    media_type = FORMATS_EXPORT[format]
+    nom_fichier = f"{nom_fichier}.{format}"
+    if gzip:
+        flux = flux_gzip(flux)
+        media_type = "application/gzip"
+        nom_fichier += ".gz"
+    return StreamingResponse(
+        flux,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{nom_fichier}"'}
+    )
+
+# =====================================================
+# EXPORT PARQUET POUR L'ANALYSE
+# =====================================================
+
+# Répertoire des fichiers Parquet, partitionnés par mois : <table>/mois=AAAA-MM/<table>.parquet
+EXPORT_PARQUET_DIR = os.getenv("EXPORT_PARQUET_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "exports"))
+# historique_archive : mois sortis de la table historique par maintenance.archiver_historique
+TABLES_PARQUET = ("historique", "inventaire", "historique_archive")
+
+def parquet_disponible() -> bool:
+    return pq is not None
+
+def _type_arrow(colonne):
+    """Type Arrow d'une colonne SQLAlchemy"""
+    type_sql = colonne.type
+    if isinstance(type_sql, Boolean):
+        return pa.bool_()
+    if isinstance(type_sql, Integer):
+        return pa.int64()
+    if isinstance(type_sql, Float):
+        return pa.float64()
+    if isinstance(type_sql, Numeric):
+        return pa.decimal128(type_sql.precision or 18, type_sql.scale or 0)
+    if isinstance(type_sql, DateTime):
+        return pa.timestamp("us")
+    if isinstance(type_sql, Date):
+        return pa.date32()
+    return pa.string()
+
+def chemin_parquet(table: str, mois: str, repertoire: str = EXPORT_PARQUET_DIR) -> str:
+    return os.path.join(repertoire, table, f"mois={mois}", f"{table}.parquet")
+
+def ecrire_parquet(requete, chemin: str, fabrique=SessionLocal) -> int:
+    """Écrire le résultat d'une requête dans un fichier Parquet, lot par lot (mémoire constante).
+    
+    Le fichier est écrit sous un nom temporaire puis renommé : un fichier présent est complet.
+    Lecture sur le primaire par défaut : sur la réplique, une lecture aussi longue peut être
+    annulée par le rejeu du primaire (conflit avec le détachement des partitions archivées).
+    """
+    colonnes = [c.name for c in requete.selected_columns]
+    schema = pa.schema([(c.name, _type_arrow(c)) for c in requete.selected_columns])
+    os.makedirs(os.path.dirname(chemin), exist_ok=True)
+    temporaire = chemin + ".tmp"
+    lignes = 0
+    with pq.ParquetWriter(temporaire, schema, compression="zstd") as ecrivain:
+        for lot in lignes_en_flux(requete, fabrique=fabrique, sans_limite=True):
+            ecrivain.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array([ligne[i] for ligne in lot], type=schema.field(i).type) for i in range(len(colonnes))],
+                schema=schema
+            ))
+            lignes += len(lot)
+    os.replace(temporaire, chemin)
+    return lignes
+
+def debut_mois(jour) -> date:
+    return date(jour.year, jour.month, 1)
+
+def mois_suivant(mois: date) -> date:
+    return date(mois.year + mois.month // 12, mois.month % 12 + 1, 1)
+
+def exporter_historique_parquet(repertoire: str = EXPORT_PARQUET_DIR):
+    """Écrire en Parquet chaque mois complet de l'historique (selon created_at) pas encore exporté.
+    
+    Les mouvements ne sont jamais modifiés après insertion : un mois terminé et déjà
+    exporté n'est pas relu, chaque exécution n'ajoute que les nouveaux mois.
+    """
+    table = models.Historique.__table__
+    db = SessionLocal()
+    try:
+        premier = db.execute(select(func.min(table.c.created_at))).scalar()
+    finally:
+        db.close()
+    fichiers = []
+    if premier is None:
+        return fichiers
+    mois, mois_courant = debut_mois(premier), debut_mois(date.today())
+    while mois < mois_courant:
+        chemin = chemin_parquet("historique", mois.strftime("%Y-%m"), repertoire)
+        if not os.path.exists(chemin):
+            requete = crud.requete_export_historique().where(
+                table.c.created_at >= mois, table.c.created_at < mois_suivant(mois)
+            ).order_by(None).order_by(table.c.created_at, table.c.id)
+            fichiers.append({"table": "historique", "mois": mois.strftime("%Y-%m"), "lignes": ecrire_parquet(requete, chemin)})
+        mois = mois_suivant(mois)
+    return fichiers
+
+def exporter_inventaire_parquet(repertoire: str = EXPORT_PARQUET_DIR):
+    """Écrire l'instantané de l'inventaire du mois en cours s'il n'existe pas encore"""
+    table = models.Inventaire.__table__
+    mois = date.today().strftime("%Y-%m")
+    chemin = chemin_parquet("inventaire", mois, repertoire)
+    if os.path.exists(chemin):
+        return []
+    requete = select(table).order_by(table.c.id)
+    return [{"table": "inventaire", "mois": mois, "lignes": ecrire_parquet(requete, chemin)}]
+
+def lots_archives_historique(colonnes, debut: Optional[datetime] = None, fin: Optional[datetime] = None,
+                             nature: Optional[str] = None, reference: Optional[str] = None,
+                             repertoire: str = EXPORT_PARQUET_DIR, taille_lot: int = TAILLE_LOT_EXPORT):
+    """Lots de lignes des mois archivés correspondant aux filtres, dans l'ordre chronologique.
+    
+    Même forme que lignes_en_flux : l'export de l'historique enchaîne les archives puis la table.
+    """
+    if pq is None:
+        return
+    for fichier in fichiers_parquet(repertoire):
+        if fichier["table"] != "historique_archive":
+            continue
+        mois = datetime.strptime(fichier["mois"], "%Y-%m")
+        if (fin and mois >= fin) or (debut and datetime.combine(mois_suivant(mois), datetime.min.time()) <= debut):
+            continue
+        lecteur = pq.ParquetFile(chemin_parquet("historique_archive", fichier["mois"], repertoire))
+        for lot in lecteur.iter_batches(batch_size=taille_lot, columns=list(colonnes)):
+            conditions = []
+            if debut:
+                conditions.append(pc.greater_equal(lot.column("date_mouvement"), pa.scalar(debut, pa.timestamp("us"))))
+            if fin:
+                conditions.append(pc.less(lot.column("date_mouvement"), pa.scalar(fin, pa.timestamp("us"))))
+            if nature:
+                conditions.append(pc.equal(lot.column("nature"), nature))
+            if reference:
+                conditions.append(pc.equal(lot.column("reference"), reference))
+            if conditions:
+                masque = conditions[0]
+                for condition in conditions[1:]:
+                    masque = pc.and_(masque, condition)
+                lot = lot.filter(masque)
+            if lot.num_rows:
+                yield list(zip(*[colonne.to_pylist() for colonne in lot.columns]))
+
+def exporter_parquet(repertoire: str = EXPORT_PARQUET_DIR):
+    """Export incrémental de l'historique et de l'instantané mensuel de l'inventaire"""
+    return exporter_historique_parquet(repertoire) + exporter_inventaire_parquet(repertoire)
+
+def fichiers_parquet(repertoire: str = EXPORT_PARQUET_DIR):
+    """Fichiers Parquet disponibles, par table et par mois"""
+    fichiers = []
+    for table in TABLES_PARQUET:
+        dossier = os.path.join(repertoire, table)
+        if not os.path.isdir(dossier):
+            continue
+        for partition in sorted(os.listdir(dossier)):
+            chemin = os.path.join(dossier, partition, f"{table}.parquet")
+            if partition.startswith("mois=") and os.path.exists(chemin):
+                fichiers.append({"table": table, "mois": partition[len("mois="):], "taille": os.path.getsize(chemin)})
+    return fichiers
+
+if __name__ == "__main__":
+    # Exécution planifiée (cron) : python export.py
+    for fichier in exporter_parquet():
+        print(f"{fichier['table']} {fichier['mois']} : {fichier['lignes']} lignes")
@@ -24,7 +24,24 @@ CREATE TABLE IF NOT EXISTS inventaire (
     quantite INTEGER DEFAULT 0,
     date_entree DATE DEFAULT CURRENT_DATE,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Seuil d'alerte à 30 % entre stock_min et stock_max (stock_min si l'intervalle est vide)
+    seuil_alerte_calcule DOUBLE PRECISION GENERATED ALWAYS AS (
+        CASE WHEN COALESCE(stock_max, 100) > COALESCE(stock_min, 0)
+        THEN CAST(COALESCE(stock_min, 0) AS DOUBLE PRECISION)
+            + CAST(COALESCE(stock_max, 100) - COALESCE(stock_min, 0) AS DOUBLE PRECISION) * 0.3
+        ELSE CAST(COALESCE(stock_min, 0) AS DOUBLE PRECISION) END
+    ) STORED,
+    -- Statut du stock, même règle que get_stock_status de l'interface
+    statut_stock VARCHAR(10) GENERATED ALWAYS AS (
+        CASE WHEN COALESCE(quantite, 0) < COALESCE(stock_min, 0) THEN 'critique'
+        WHEN COALESCE(quantite, 0) > COALESCE(stock_max, 100) THEN 'surstock'
+        WHEN COALESCE(quantite, 0) <= CASE WHEN COALESCE(stock_max, 100) > COALESCE(stock_min, 0)
+            THEN CAST(COALESCE(stock_min, 0) AS DOUBLE PRECISION)
+                + CAST(COALESCE(stock_max, 100) - COALESCE(stock_min, 0) AS DOUBLE PRECISION) * 0.3
+            ELSE CAST(COALESCE(stock_min, 0) AS DOUBLE PRECISION) END THEN 'faible'
+        ELSE 'normal' END
+    ) STORED
 );
 
 -- =====================================================
@@ -141,17 +158,26 @@ CREATE TABLE IF NOT EXISTS demandes (
 -- =====================================================
 -- TABLE: HISTORIQUE DES MOUVEMENTS
 -- =====================================================
+-- Partitionnée par mois sur date_mouvement (voir PARTITIONNEMENT DE L'HISTORIQUE) ;
+-- la clé primaire doit inclure la clé de partitionnement.
+-- Format compact : le produit est désigné par inventaire_id et la nature par
+-- type_mouvement ; produit et nature ne sont renseignés que s'ils ne s'en déduisent pas
+-- (produit renommé ou supprimé depuis, libellé non standard). La vue historique_complet
+-- restitue les colonnes d'origine.
 CREATE TABLE IF NOT EXISTS historique (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     date_mouvement TIMESTAMP NOT NULL,
     reference VARCHAR(20), -- Référence du produit
-    produit VARCHAR(500) NOT NULL,
-    nature VARCHAR(50) NOT NULL, -- Entrée, Sortie, Ajustement
+    inventaire_id INTEGER REFERENCES inventaire(id) ON DELETE SET NULL,
+    type_mouvement SMALLINT NOT NULL, -- 1 Entrée, 2 Sortie, 3 Ajustement, 4 Inventaire, 5 Transfert
+    produit VARCHAR(500),
+    nature VARCHAR(50),
     quantite_mouvement INTEGER NOT NULL,
     quantite_avant INTEGER NOT NULL,
     quantite_apres INTEGER NOT NULL,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, date_mouvement)
+) PARTITION BY RANGE (date_mouvement);
 
 -- =====================================================
 -- TABLE: TABLES D'ATELIER
@@ -202,6 +228,27 @@ CREATE TABLE IF NOT EXISTS produits_listes_inventaire (
     FOREIGN KEY (id_liste) REFERENCES listes_inventaire(id_liste) ON DELETE CASCADE
 );
 
+-- =====================================================
+-- RECHERCHE DE PRODUITS (TRIGRAMMES, SANS ACCENTS)
+-- =====================================================
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- unaccent() n'est que STABLE : enveloppe IMMUTABLE (dictionnaire explicite) pour l'indexation
+CREATE OR REPLACE FUNCTION gmao_normaliser(texte TEXT)
+RETURNS TEXT AS $$
+    SELECT lower(public.unaccent('public.unaccent'::regdictionary, texte))
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+
+-- Texte recherché d'un produit : code, désignation, référence, fournisseur et catégorie
+CREATE OR REPLACE FUNCTION gmao_document_recherche(code TEXT, produits TEXT, reference TEXT, fournisseur TEXT, categorie TEXT)
+RETURNS TEXT AS $$
+    SELECT gmao_normaliser(
+        COALESCE(code, '') || ' ' || COALESCE(produits, '') || ' ' || COALESCE(reference, '') || ' '
+        || COALESCE(fournisseur, '') || ' ' || COALESCE(categorie, '')
+    )
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
 -- =====================================================
 -- INDEX POUR AMÉLIORER LES PERFORMANCES
 -- =====================================================
@@ -212,6 +259,16 @@ CREATE INDEX IF NOT EXISTS idx_inventaire_reference ON inventaire(reference);
 CREATE INDEX IF NOT EXISTS idx_inventaire_fournisseur ON inventaire(fournisseur);
 CREATE INDEX IF NOT EXISTS idx_inventaire_emplacement ON inventaire(emplacement);
 CREATE INDEX IF NOT EXISTS idx_inventaire_categorie ON inventaire(categorie);
+-- Alertes de stock : filtre par statut (et fournisseur), pagination par id
+CREATE INDEX IF NOT EXISTS idx_inventaire_statut_stock ON inventaire(statut_stock, fournisseur, id);
+CREATE INDEX IF NOT EXISTS idx_inventaire_alertes ON inventaire(id) WHERE statut_stock <> 'normal';
+-- Recherche plein texte tolérante (LIKE '%terme%' et similarité trigramme)
+CREATE INDEX IF NOT EXISTS idx_inventaire_recherche ON inventaire
+    USING GIN (gmao_document_recherche(code, produits, reference, fournisseur, categorie) gin_trgm_ops);
+-- Autocomplétion par préfixe sur la référence et la désignation normalisée : en collation C,
+-- l'index sert à la fois LIKE 'préfixe%' et l'ordre de tri, le parcours s'arrête après LIMIT lignes
+CREATE INDEX IF NOT EXISTS idx_inventaire_reference_prefixe ON inventaire((reference COLLATE "C"));
+CREATE INDEX IF NOT EXISTS idx_inventaire_produits_prefixe ON inventaire((gmao_normaliser(produits) COLLATE "C"));
 
 -- Index sur les fournisseurs
 CREATE INDEX IF NOT EXISTS idx_fournisseurs_nom ON fournisseurs(nom_fournisseur);
@@ -235,11 +292,31 @@ CREATE INDEX IF NOT EXISTS idx_emplacements_lieu ON emplacements(lieu_id);
 CREATE INDEX IF NOT EXISTS idx_demandes_statut ON demandes(statut);
 CREATE INDEX IF NOT EXISTS idx_demandes_demandeur ON demandes(demandeur);
 CREATE INDEX IF NOT EXISTS idx_demandes_date ON demandes(date_demande);
+-- Pagination par curseur : ORDER BY date_demande DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_demandes_date_id ON demandes(date_demande DESC, id DESC);
 
 -- Index sur l'historique
 CREATE INDEX IF NOT EXISTS idx_historique_reference ON historique(reference);
 CREATE INDEX IF NOT EXISTS idx_historique_date ON historique(date_mouvement);
-CREATE INDEX IF NOT EXISTS idx_historique_nature ON historique(nature);
+-- Filtre par nature : WHERE type_mouvement = ? ORDER BY date_mouvement DESC
+CREATE INDEX IF NOT EXISTS idx_historique_type ON historique(type_mouvement, date_mouvement DESC);
+CREATE INDEX IF NOT EXISTS idx_historique_inventaire ON historique(inventaire_id);
+-- Pagination par curseur : ORDER BY date_mouvement DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_historique_date_id ON historique(date_mouvement DESC, id DESC);
+-- Export d'un produit sur une période : WHERE reference = ? AND date_mouvement ... ORDER BY date_mouvement, id
+CREATE INDEX IF NOT EXISTS idx_historique_reference_date ON historique(reference, date_mouvement, id);
+
+-- Historique au format d'origine, pour les requêtes SQL et outils de reporting existants
+CREATE OR REPLACE VIEW historique_complet AS
+SELECT h.id, h.date_mouvement, h.reference,
+       COALESCE(h.produit, i.produits) AS produit,
+       COALESCE(h.nature, CASE h.type_mouvement
+           WHEN 1 THEN 'Entrée' WHEN 2 THEN 'Sortie' WHEN 3 THEN 'Ajustement'
+           WHEN 4 THEN 'Inventaire' WHEN 5 THEN 'Transfert' END) AS nature,
+       h.quantite_mouvement, h.quantite_avant, h.quantite_apres, h.created_at,
+       h.inventaire_id, h.type_mouvement
+FROM historique h
+LEFT JOIN inventaire i ON i.id = h.inventaire_id;
 
 -- Index sur les tables d'atelier
 CREATE INDEX IF NOT EXISTS idx_tables_atelier_type ON tables_atelier(type_atelier);
@@ -247,6 +324,8 @@ CREATE INDEX IF NOT EXISTS idx_tables_atelier_responsable ON tables_atelier(resp
 
 -- Index sur les listes d'inventaire
 CREATE INDEX IF NOT EXISTS idx_listes_inventaire_statut ON listes_inventaire(statut);
+-- Pagination par curseur : ORDER BY date_creation DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_listes_inventaire_date_id ON listes_inventaire(date_creation DESC, id DESC);
 CREATE INDEX IF NOT EXISTS idx_produits_listes_reference ON produits_listes_inventaire(reference_produit);
 
 -- =====================================================
@@ -364,3 +443,211 @@ CREATE TRIGGER update_lieux_updated_at BEFORE UPDATE ON lieux
 
 CREATE TRIGGER update_emplacements_updated_at BEFORE UPDATE ON emplacements
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+-- =====================================================
+-- NOTIFICATIONS DE CHANGEMENT (COHÉRENCE DES CACHES)
+-- =====================================================
+-- Chaque instruction validée qui modifie une table en cache publie sur le canal
+-- gmao_changements une seule notification {table, op, lignes: [{id, cle, ancienne_cle}]} ;
+-- les workers de l'API et de l'interface vident les entrées de cache concernées. NOTIFY
+-- est transactionnel : rien n'est publié si la transaction échoue. Un trigger par
+-- opération : les tables de transition n'acceptent qu'un seul événement.
+
+CREATE OR REPLACE FUNCTION notifier_changements()
+RETURNS TRIGGER AS $$
+DECLARE
+    -- Arguments du trigger : colonne clé ('' si aucune), puis colonnes dont la seule
+    -- modification ne justifie pas de notification (compteurs recalculés par trigger)
+    colonne_cle TEXT := NULLIF(TG_ARGV[0], '');
+    ignorees TEXT[] := COALESCE(TG_ARGV[1:TG_NARGS - 1], '{}');
+    lignes JSONB;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT jsonb_agg(jsonb_build_object('id', n.id, 'cle', to_jsonb(n) ->> colonne_cle))
+        INTO lignes FROM nouvelles n;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT jsonb_agg(jsonb_build_object('id', a.id, 'cle', to_jsonb(a) ->> colonne_cle))
+        INTO lignes FROM anciennes a;
+    ELSE
+        SELECT jsonb_agg(jsonb_build_object(
+                   'id', n.id, 'cle', to_jsonb(n) ->> colonne_cle, 'ancienne_cle', to_jsonb(a) ->> colonne_cle))
+        INTO lignes
+        FROM nouvelles n JOIN anciennes a ON a.id = n.id
+        WHERE (to_jsonb(a) - ignorees) IS DISTINCT FROM (to_jsonb(n) - ignorees);
+    END IF;
+    IF lignes IS NULL THEN
+        RETURN NULL;
+    END IF;
+    -- Au-delà de 50 lignes (NOTIFY est limité à 8000 octets), la notification ne détaille
+    -- pas les lignes : les écouteurs vident alors les caches de toute la table
+    PERFORM pg_notify('gmao_changements', json_build_object(
+        'table', TG_TABLE_NAME,
+        'op', TG_OP,
+        'lignes', CASE WHEN jsonb_array_length(lignes) <= 50 THEN lignes END
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_notifier_inventaire_insert
+    AFTER INSERT ON inventaire REFERENCING NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('reference');
+
+CREATE TRIGGER trigger_notifier_inventaire_update
+    AFTER UPDATE ON inventaire REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('reference');
+
+CREATE TRIGGER trigger_notifier_inventaire_delete
+    AFTER DELETE ON inventaire REFERENCING OLD TABLE AS anciennes
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('reference');
+
+CREATE TRIGGER trigger_notifier_sites_insert
+    AFTER INSERT ON sites REFERENCING NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+CREATE TRIGGER trigger_notifier_sites_update
+    AFTER UPDATE ON sites REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+CREATE TRIGGER trigger_notifier_sites_delete
+    AFTER DELETE ON sites REFERENCING OLD TABLE AS anciennes
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+CREATE TRIGGER trigger_notifier_lieux_insert
+    AFTER INSERT ON lieux REFERENCING NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+CREATE TRIGGER trigger_notifier_lieux_update
+    AFTER UPDATE ON lieux REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+CREATE TRIGGER trigger_notifier_lieux_delete
+    AFTER DELETE ON lieux REFERENCING OLD TABLE AS anciennes
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+CREATE TRIGGER trigger_notifier_tables_atelier_insert
+    AFTER INSERT ON tables_atelier REFERENCING NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+CREATE TRIGGER trigger_notifier_tables_atelier_update
+    AFTER UPDATE ON tables_atelier REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+CREATE TRIGGER trigger_notifier_tables_atelier_delete
+    AFTER DELETE ON tables_atelier REFERENCING OLD TABLE AS anciennes
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+-- Fournisseurs et emplacements : les compteurs recalculés à chaque mouvement de stock
+-- (update_fournisseur_stats, update_emplacement_stats) ne déclenchent pas de notification
+CREATE TRIGGER trigger_notifier_fournisseurs_insert
+    AFTER INSERT ON fournisseurs REFERENCING NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('', 'nb_produits', 'valeur_stock_total', 'updated_at');
+
+CREATE TRIGGER trigger_notifier_fournisseurs_update
+    AFTER UPDATE ON fournisseurs REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('', 'nb_produits', 'valeur_stock_total', 'updated_at');
+
+CREATE TRIGGER trigger_notifier_fournisseurs_delete
+    AFTER DELETE ON fournisseurs REFERENCING OLD TABLE AS anciennes
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('', 'nb_produits', 'valeur_stock_total', 'updated_at');
+
+CREATE TRIGGER trigger_notifier_emplacements_insert
+    AFTER INSERT ON emplacements REFERENCING NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('', 'nb_produits', 'taux_occupation', 'updated_at');
+
+CREATE TRIGGER trigger_notifier_emplacements_update
+    AFTER UPDATE ON emplacements REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('', 'nb_produits', 'taux_occupation', 'updated_at');
+
+CREATE TRIGGER trigger_notifier_emplacements_delete
+    AFTER DELETE ON emplacements REFERENCING OLD TABLE AS anciennes
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('', 'nb_produits', 'taux_occupation', 'updated_at');
+
+-- =====================================================
+-- VERSIONS DES TABLES (ETAG DES LISTES)
+-- =====================================================
+-- Chaque instruction qui modifie une table lue derrière un ETag (main.etag_tables)
+-- incrémente un compteur, dans la transaction de l'écriture : la version est visible en
+-- même temps que les données. Le compteur est réparti en tranches (une par groupe de
+-- connexions, sommées à la lecture) pour que les écritures concurrentes, les mouvements
+-- de stock en particulier, n'attendent pas toutes le verrou de la même ligne.
+CREATE TABLE IF NOT EXISTS versions_tables (
+    nom_table VARCHAR(63) NOT NULL,
+    tranche SMALLINT NOT NULL,
+    version BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (nom_table, tranche)
+);
+
+CREATE OR REPLACE FUNCTION incrementer_version_table()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO versions_tables (nom_table, tranche, version)
+    VALUES (TG_TABLE_NAME, pg_backend_pid() % 16, 1)
+    ON CONFLICT (nom_table, tranche) DO UPDATE SET version = versions_tables.version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trigger_version_inventaire
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON inventaire
+    FOR EACH STATEMENT EXECUTE FUNCTION incrementer_version_table();
+
+CREATE TRIGGER trigger_version_fournisseurs
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON fournisseurs
+    FOR EACH STATEMENT EXECUTE FUNCTION incrementer_version_table();
+
+CREATE TRIGGER trigger_version_sites
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON sites
+    FOR EACH STATEMENT EXECUTE FUNCTION incrementer_version_table();
+
+CREATE TRIGGER trigger_version_lieux
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON lieux
+    FOR EACH STATEMENT EXECUTE FUNCTION incrementer_version_table();
+
+CREATE TRIGGER trigger_version_emplacements
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON emplacements
+    FOR EACH STATEMENT EXECUTE FUNCTION incrementer_version_table();
+
+-- =====================================================
+-- PARTITIONNEMENT DE L'HISTORIQUE
+-- =====================================================
+-- Une partition par mois (historique_AAAA_MM), créées à l'avance par
+-- gmao_creer_partitions_historique() : au démarrage de l'API et par le job de maintenance
+-- (api/maintenance.py), qui archive aussi les partitions anciennes. La partition par
+-- défaut recueille les mouvements d'un mois sans partition ; ils sont déplacés dans la
+-- partition du mois lorsqu'elle est créée.
+CREATE TABLE IF NOT EXISTS historique_defaut PARTITION OF historique DEFAULT;
+
+CREATE OR REPLACE FUNCTION gmao_creer_partitions_historique(
+    debut DATE DEFAULT date_trunc('month', CURRENT_DATE)::date,
+    fin DATE DEFAULT (date_trunc('month', CURRENT_DATE) + INTERVAL '4 months')::date
+)
+RETURNS INTEGER AS $$
+DECLARE
+    mois DATE := date_trunc('month', debut)::date;
+    mois_suivant DATE;
+    nom_partition TEXT;
+    creees INTEGER := 0;
+BEGIN
+    -- Plusieurs workers de l'API appellent la fonction à leur démarrage
+    PERFORM pg_advisory_xact_lock(hashtext('gmao_creer_partitions_historique'));
+    WHILE mois < fin LOOP
+        mois_suivant := (mois + INTERVAL '1 month')::date;
+        nom_partition := 'historique_' || to_char(mois, 'YYYY_MM');
+        IF to_regclass(nom_partition) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE historique INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', nom_partition);
+            EXECUTE format(
+                'WITH deplaces AS (DELETE FROM historique_defaut WHERE date_mouvement >= %L AND date_mouvement < %L RETURNING *) '
+                'INSERT INTO %I SELECT * FROM deplaces',
+                mois, mois_suivant, nom_partition
+            );
+            EXECUTE format('ALTER TABLE historique ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', nom_partition, mois, mois_suivant);
+            creees := creees + 1;
+        END IF;
+        mois := mois_suivant;
+    END LOOP;
+    RETURN creees;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT gmao_creer_partitions_historique();
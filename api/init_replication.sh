@@ -0,0 +1,6 @@
+#!/bin/bash
+# Exécuté par l'image postgres à l'initialisation du primaire (docker-entrypoint-initdb.d) :
+# autoriser la réplique (service postgres-replica) à se connecter en streaming replication.
+# Pour un primaire déjà initialisé, ajouter cette ligne à pg_hba.conf puis recharger.
+set -e
+echo "host replication ${POSTGRES_USER} all scram-sha-256" >> "$PGDATA/pg_hba.conf"
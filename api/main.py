@@ -1,11 +1,22 @@
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, Depends, HTTPException, Path, Query, Request, Response
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional, Union
+import itertools
+import os
+from datetime import date, datetime
 import crud
+import export
+import maintenance
 import models
 import schemas
-from database import SessionLocal, engine, get_db
+from database import (
+    COOKIE_ECRITURE, DATABASE_READ_URL, DB_READ_FRESHNESS, SessionLocal, async_engine, engine,
+    fabrique_session_lecture, get_async_db, get_async_read_db, get_db, get_read_db, stats_pools
+)
+from notifications import EcouteurChangements
 
 # Créer les tables
 models.Base.metadata.create_all(bind=engine)
@@ -24,17 +35,105 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+@app.on_event("startup")
+def demarrer_ecoute_changements():
+    """Invalider les caches de ce worker sur les écritures des autres (LISTEN/NOTIFY)"""
+    if engine.dialect.name != "postgresql":
+        return
+    dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+    app.state.ecouteur_changements = EcouteurChangements(dsn, crud.invalider_caches)
+    app.state.ecouteur_changements.start()
+
+@app.on_event("startup")
+def creer_partitions_historique():
+    """Partitions mensuelles de l'historique du mois en cours et des mois suivants"""
+    maintenance.creer_partitions_historique()
+
+@app.on_event("shutdown")
+def arreter_ecoute_changements():
+    ecouteur = getattr(app.state, "ecouteur_changements", None)
+    if ecouteur is not None:
+        ecouteur.arreter()
+
+@app.on_event("shutdown")
+async def fermer_pool_asynchrone():
+    await async_engine.dispose()
+
+if DATABASE_READ_URL:
+    @app.middleware("http")
+    async def marquer_ecritures(request: Request, call_next):
+        """Après une écriture réussie, le client lit sur le primaire pendant DB_READ_FRESHNESS
+        secondes (cookie) : il voit ses propres écritures même si la réplique est en retard"""
+        response = await call_next(request)
+        if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+            response.set_cookie(COOKIE_ECRITURE, "1", max_age=DB_READ_FRESHNESS, httponly=True, samesite="lax")
+        return response
+
+@app.exception_handler(crud.CurseurInvalide)
+def curseur_invalide_handler(request: Request, exc: crud.CurseurInvalide):
+    """Un curseur de pagination illisible est une erreur du client"""
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+def exposer_curseur(response: Response, lignes, tri, limit: int):
+    """Renseigner l'en-tête X-Next-Cursor avec le curseur de la page suivante"""
+    curseur = crud.curseur_suivant(lignes, tri, limit)
+    if curseur:
+        response.headers["X-Next-Cursor"] = curseur
+    return lignes
+
+def etag_correspond(request: Request, etag: str) -> bool:
+    """Indique si l'en-tête If-None-Match du client désigne l'ETag donné (comparaison faible)"""
+    valeurs = request.headers.get("if-none-match")
+    if not valeurs:
+        return False
+    attendu = etag.removeprefix("W/")
+    return any(v.strip() == "*" or v.strip().removeprefix("W/") == attendu for v in valeurs.split(","))
+
+def etag_ligne(request: Request, response: Response, ligne):
+    """ETag faible d'une route à une ligne, dérivé de son id et de son updated_at.
+    
+    304 sans corps si le client a déjà cette version. Réservé à PostgreSQL, comme
+    etag_tables (updated_at à la seconde sous SQLite).
+    """
+    if engine.dialect.name != "postgresql":
+        return ligne
+    etag = crud.etag_faible(request.url.path, ligne.id, ligne.updated_at)
+    if etag_correspond(request, etag):
+        raise HTTPException(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return ligne
+
+def etag_tables(*modeles):
+    """Dépendance des routes de liste : ETag faible dérivé de la version des tables lues
+    (compteurs de versions_tables, voir crud.version_tables).
+    
+    Si le client possède déjà cette version (If-None-Match), la route n'est pas exécutée
+    et la réponse est un 304 sans corps. Réservé à PostgreSQL : sous SQLite, updated_at
+    est à la seconde et deux écritures dans la même seconde donneraient le même ETag.
+    Asynchrone : la vérification n'occupe pas de thread, même devant une route synchrone.
+    """
+    async def verifier(request: Request, response: Response, db: AsyncSession = Depends(get_async_read_db)):
+        if db.bind.dialect.name != "postgresql":
+            return
+        version = await crud.version_tables_async(db, *modeles)
+        etag = crud.etag_faible(request.url.path, request.url.query, version)
+        if etag_correspond(request, etag):
+            raise HTTPException(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+    return verifier
+
 # =====================================================
 # ROUTES POUR L'INVENTAIRE (PRODUITS)
 # =====================================================
 
-@app.get("/inventaire/", response_model=List[schemas.InventaireResponse])
-def read_inventaire(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@app.get("/inventaire/", response_model=List[schemas.InventaireResponse], dependencies=[Depends(etag_tables(models.Inventaire))])
+async def read_inventaire(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_read_db)):
     """Récupérer tous les produits de l'inventaire"""
-    inventaire = crud.get_inventaire(db, skip=skip, limit=limit)
-    return inventaire
+    inventaire = await crud.get_inventaire_async(db, skip=skip, limit=limit, cursor=cursor)
+    return exposer_curseur(response, inventaire, crud.TRI_INVENTAIRE, limit)
 
 @app.post("/inventaire/", response_model=schemas.InventaireResponse)
 def create_inventaire(inventaire: schemas.InventaireCreate, db: Session = Depends(get_db)):
@@ -51,36 +150,106 @@ def create_inventaire(inventaire: schemas.InventaireCreate, db: Session = Depend
     
     return crud.create_inventaire(db=db, inventaire=inventaire)
 
+@app.post("/inventaire/bulk", response_model=schemas.InventaireBulkResponse)
+def bulk_upsert_inventaire(requete: schemas.InventaireBulkRequest, db: Session = Depends(get_db)):
+    """Créer ou mettre à jour des produits en masse, avec un résultat par ligne"""
+    if requete.conflit not in ("ignorer", "mettre_a_jour"):
+        raise HTTPException(status_code=400, detail="Le mode de conflit doit être 'ignorer' ou 'mettre_a_jour'")
+    return crud.bulk_upsert_inventaire(db, items=requete.items, conflit=requete.conflit)
+
+@app.get("/inventaire/stats", response_model=schemas.InventaireStats)
+def read_inventaire_stats(
+    fournisseur: Optional[str] = None,
+    site: Optional[str] = None,
+    categorie: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """Indicateurs de stock (nombre de produits par statut et valeur totale) calculés en base"""
+    return crud.get_inventaire_stats(db, fournisseur=fournisseur, site=site, categorie=categorie)
+
+@app.get("/inventaire/autocomplete", response_model=List[schemas.InventaireAutocomplete])
+def autocomplete_inventaire(
+    q: str = Query(..., min_length=1, description="Début de la référence ou de la désignation"),
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db)  # Primaire : le cache partagé ne doit pas recevoir une lecture en retard
+):
+    """Suggestions légères de produits pour les sélecteurs et le scanner"""
+    return crud.autocomplete_inventaire(db, q=q, limit=limit)
+
+@app.get("/inventaire/alertes", response_model=List[schemas.InventaireResponse], dependencies=[Depends(etag_tables(models.Inventaire))])
+def read_inventaire_alertes(
+    response: Response,
+    statut: Optional[str] = Query(None, description="critique, faible ou surstock (toutes les alertes si absent)"),
+    fournisseur: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    """Récupérer les produits en alerte de stock"""
+    if statut and statut not in crud.STATUTS_ALERTE:
+        raise HTTPException(status_code=400, detail="Le statut doit être 'critique', 'faible' ou 'surstock'")
+    inventaire = crud.get_inventaire_alertes(db, statut=statut, fournisseur=fournisseur, skip=skip, limit=limit, cursor=cursor)
+    return exposer_curseur(response, inventaire, crud.TRI_INVENTAIRE, limit)
+
+@app.get("/inventaire/export")
+def export_inventaire(
+    request: Request,
+    format: str = Query("csv", description="csv ou ndjson"),
+    colonnes: Optional[str] = Query(None, description="Colonnes à exporter, séparées par des virgules (toutes si absent)"),
+    fournisseur: Optional[str] = None,
+    site: Optional[str] = None,
+    categorie: Optional[str] = None,
+    statut: Optional[str] = Query(None, description="critique, faible, surstock ou normal")
+):
+    """Exporter tout l'inventaire en flux (mémoire constante quel que soit le nombre de produits)"""
+    if format not in export.FORMATS_EXPORT:
+        raise HTTPException(status_code=400, detail="Le format doit être 'csv' ou 'ndjson'")
+    noms = [nom.strip() for nom in colonnes.split(",") if nom.strip()] if colonnes else list(crud.COLONNES_EXPORT_INVENTAIRE)
+    inconnues = [nom for nom in noms if nom not in crud.COLONNES_EXPORT_INVENTAIRE]
+    if inconnues or not noms:
+        raise HTTPException(status_code=400, detail=f"Colonnes inconnues : {', '.join(inconnues) or '(aucune colonne)'}")
+    requete = crud.requete_export_inventaire(noms, fournisseur=fournisseur, site=site, categorie=categorie, statut=statut)
+    lots = export.lignes_en_flux(requete, fabrique=fabrique_session_lecture(request))
+    return export.reponse_export(lots, noms, format, "inventaire")
+
 @app.get("/inventaire/{inventaire_id}", response_model=schemas.InventaireResponse)
-def read_inventaire_by_id(inventaire_id: int, db: Session = Depends(get_db)):
+def read_inventaire_by_id(inventaire_id: int, request: Request, response: Response, db: Session = Depends(get_read_db)):
     """Récupérer un produit par son ID"""
     db_inventaire = crud.get_inventaire_by_id(db, inventaire_id=inventaire_id)
     if db_inventaire is None:
         raise HTTPException(status_code=404, detail="Produit non trouvé")
-    return db_inventaire
+    return etag_ligne(request, response, db_inventaire)
 
 @app.get("/inventaire/reference/{reference}", response_model=schemas.InventaireResponse)
-def read_inventaire_by_reference(reference: str, db: Session = Depends(get_db)):
-    """Récupérer un produit par sa référence QR"""
-    db_inventaire = crud.get_inventaire_by_reference(db, reference=reference)
-    if db_inventaire is None:
+async def read_inventaire_by_reference(reference: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Récupérer un produit par sa référence QR (réponse en cache, voir crud.cache_produits_reference).
+    
+    Lue sur le primaire : une lecture sur une réplique en retard mettrait en cache, pour
+    tous les clients, un produit que la notification de son écriture vient d'invalider.
+    """
+    produit = await crud.get_inventaire_by_reference_json_async(db, reference=reference)
+    if produit is None:
         raise HTTPException(status_code=404, detail="Produit non trouvé")
-    return db_inventaire
+    corps, etag = produit
+    if etag_correspond(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=corps, media_type="application/json", headers={"ETag": etag})
 
 @app.get("/inventaire/code/{code}", response_model=schemas.InventaireResponse)
-def read_inventaire_by_code(code: str, db: Session = Depends(get_db)):
+def read_inventaire_by_code(code: str, request: Request, response: Response, db: Session = Depends(get_read_db)):
     """Récupérer un produit par son code"""
     db_inventaire = crud.get_inventaire_by_code(db, code=code)
     if db_inventaire is None:
         raise HTTPException(status_code=404, detail="Produit non trouvé")
-    return db_inventaire
+    return etag_ligne(request, response, db_inventaire)
 
-@app.get("/inventaire/search/", response_model=List[schemas.InventaireResponse])
+@app.get("/inventaire/search/", response_model=List[schemas.InventaireResponse], dependencies=[Depends(etag_tables(models.Inventaire))])
 def search_inventaire(
     search: str = Query(..., description="Terme de recherche"),
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Rechercher des produits par terme de recherche"""
     inventaire = crud.search_inventaire(db, search_term=search, skip=skip, limit=limit)
@@ -102,20 +271,20 @@ def delete_inventaire(inventaire_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Produit non trouvé")
     return {"message": "Produit supprimé avec succès"}
 
-@app.get("/inventaire/emplacement/{emplacement}", response_model=List[schemas.InventaireResponse])
-def read_inventaire_by_emplacement(emplacement: str, db: Session = Depends(get_db)):
+@app.get("/inventaire/emplacement/{emplacement}", response_model=List[schemas.InventaireResponse], dependencies=[Depends(etag_tables(models.Inventaire))])
+def read_inventaire_by_emplacement(emplacement: str, db: Session = Depends(get_read_db)):
     """Récupérer tous les produits d'un emplacement"""
     inventaire = crud.get_inventaire_by_emplacement(db, emplacement=emplacement)
     return inventaire
 
-@app.get("/inventaire/fournisseur/{fournisseur}", response_model=List[schemas.InventaireResponse])
-def read_inventaire_by_fournisseur(fournisseur: str, db: Session = Depends(get_db)):
+@app.get("/inventaire/fournisseur/{fournisseur}", response_model=List[schemas.InventaireResponse], dependencies=[Depends(etag_tables(models.Inventaire))])
+def read_inventaire_by_fournisseur(fournisseur: str, db: Session = Depends(get_read_db)):
     """Récupérer tous les produits d'un fournisseur"""
     inventaire = crud.get_inventaire_by_fournisseur(db, fournisseur=fournisseur)
     return inventaire
 
-@app.get("/inventaire/stock-faible/", response_model=List[schemas.InventaireResponse])
-def read_inventaire_stock_faible(db: Session = Depends(get_db)):
+@app.get("/inventaire/stock-faible/", response_model=List[schemas.InventaireResponse], dependencies=[Depends(etag_tables(models.Inventaire))])
+def read_inventaire_stock_faible(db: Session = Depends(get_read_db)):
     """Récupérer les produits avec un stock faible"""
     inventaire = crud.get_inventaire_stock_faible(db)
     return inventaire
@@ -124,11 +293,11 @@ def read_inventaire_stock_faible(db: Session = Depends(get_db)):
 # ROUTES POUR LES FOURNISSEURS
 # =====================================================
 
-@app.get("/fournisseurs/", response_model=List[schemas.FournisseurResponse])
-def read_fournisseurs(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@app.get("/fournisseurs/", response_model=List[schemas.FournisseurResponse], dependencies=[Depends(etag_tables(models.Fournisseur))])
+def read_fournisseurs(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_read_db)):
     """Récupérer tous les fournisseurs"""
-    fournisseurs = crud.get_fournisseurs(db, skip=skip, limit=limit)
-    return fournisseurs
+    fournisseurs = crud.get_fournisseurs(db, skip=skip, limit=limit, cursor=cursor)
+    return exposer_curseur(response, fournisseurs, crud.TRI_FOURNISSEURS, limit)
 
 @app.post("/fournisseurs/", response_model=schemas.FournisseurResponse)
 def create_fournisseur(fournisseur: schemas.FournisseurCreate, db: Session = Depends(get_db)):
@@ -141,20 +310,20 @@ def create_fournisseur(fournisseur: schemas.FournisseurCreate, db: Session = Dep
     return crud.create_fournisseur(db=db, fournisseur=fournisseur)
 
 @app.get("/fournisseurs/{fournisseur_id}", response_model=schemas.FournisseurResponse)
-def read_fournisseur(fournisseur_id: int, db: Session = Depends(get_db)):
+def read_fournisseur(fournisseur_id: int, request: Request, response: Response, db: Session = Depends(get_read_db)):
     """Récupérer un fournisseur par son ID"""
     db_fournisseur = crud.get_fournisseur_by_id(db, fournisseur_id=fournisseur_id)
     if db_fournisseur is None:
         raise HTTPException(status_code=404, detail="Fournisseur non trouvé")
-    return db_fournisseur
+    return etag_ligne(request, response, db_fournisseur)
 
 @app.get("/fournisseurs/id/{id_fournisseur}", response_model=schemas.FournisseurResponse)
-def read_fournisseur_by_id_fournisseur(id_fournisseur: str, db: Session = Depends(get_db)):
+def read_fournisseur_by_id_fournisseur(id_fournisseur: str, request: Request, response: Response, db: Session = Depends(get_read_db)):
     """Récupérer un fournisseur par son ID fournisseur"""
     db_fournisseur = crud.get_fournisseur_by_id_fournisseur(db, id_fournisseur=id_fournisseur)
     if db_fournisseur is None:
         raise HTTPException(status_code=404, detail="Fournisseur non trouvé")
-    return db_fournisseur
+    return etag_ligne(request, response, db_fournisseur)
 
 @app.put("/fournisseurs/{fournisseur_id}", response_model=schemas.FournisseurResponse)
 def update_fournisseur(fournisseur_id: int, fournisseur: schemas.FournisseurUpdate, db: Session = Depends(get_db)):
@@ -177,8 +346,8 @@ def delete_fournisseur(fournisseur_id: int, db: Session = Depends(get_db)):
 # =====================================================
 
 # SITES
-@app.get("/sites/", response_model=List[schemas.SiteResponse])
-def read_sites(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@app.get("/sites/", response_model=List[schemas.SiteResponse], dependencies=[Depends(etag_tables(models.Site))])
+def read_sites(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """Récupérer tous les sites"""
     sites = crud.get_sites(db, skip=skip, limit=limit)
     return sites
@@ -194,12 +363,12 @@ def create_site(site: schemas.SiteCreate, db: Session = Depends(get_db)):
     return crud.create_site(db=db, site=site)
 
 @app.get("/sites/{site_id}", response_model=schemas.SiteResponse)
-def read_site(site_id: int, db: Session = Depends(get_db)):
+def read_site(site_id: int, request: Request, response: Response, db: Session = Depends(get_read_db)):
     """Récupérer un site par son ID"""
     db_site = crud.get_site_by_id(db, site_id=site_id)
     if db_site is None:
         raise HTTPException(status_code=404, detail="Site non trouvé")
-    return db_site
+    return etag_ligne(request, response, db_site)
 
 @app.put("/sites/{site_id}", response_model=schemas.SiteResponse)
 def update_site(site_id: int, site: schemas.SiteUpdate, db: Session = Depends(get_db)):
@@ -218,14 +387,14 @@ def delete_site(site_id: int, db: Session = Depends(get_db)):
     return {"message": "Site supprimé avec succès"}
 
 # LIEUX
-@app.get("/lieux/", response_model=List[schemas.LieuResponse])
-def read_lieux(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@app.get("/lieux/", response_model=List[schemas.LieuResponse], dependencies=[Depends(etag_tables(models.Lieu))])
+def read_lieux(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """Récupérer tous les lieux"""
     lieux = crud.get_lieux(db, skip=skip, limit=limit)
     return lieux
 
-@app.get("/lieux/site/{site_id}", response_model=List[schemas.LieuResponse])
-def read_lieux_by_site(site_id: int, db: Session = Depends(get_db)):
+@app.get("/lieux/site/{site_id}", response_model=List[schemas.LieuResponse], dependencies=[Depends(etag_tables(models.Lieu))])
+def read_lieux_by_site(site_id: int, db: Session = Depends(get_read_db)):
     """Récupérer tous les lieux d'un site"""
     lieux = crud.get_lieux_by_site(db, site_id=site_id)
     return lieux
@@ -246,12 +415,12 @@ def create_lieu(lieu: schemas.LieuCreate, db: Session = Depends(get_db)):
     return crud.create_lieu(db=db, lieu=lieu)
 
 @app.get("/lieux/{lieu_id}", response_model=schemas.LieuResponse)
-def read_lieu(lieu_id: int, db: Session = Depends(get_db)):
+def read_lieu(lieu_id: int, request: Request, response: Response, db: Session = Depends(get_read_db)):
     """Récupérer un lieu par son ID"""
     db_lieu = crud.get_lieu_by_id(db, lieu_id=lieu_id)
     if db_lieu is None:
         raise HTTPException(status_code=404, detail="Lieu non trouvé")
-    return db_lieu
+    return etag_ligne(request, response, db_lieu)
 
 @app.put("/lieux/{lieu_id}", response_model=schemas.LieuResponse)
 def update_lieu(lieu_id: int, lieu: schemas.LieuUpdate, db: Session = Depends(get_db)):
@@ -270,14 +439,14 @@ def delete_lieu(lieu_id: int, db: Session = Depends(get_db)):
     return {"message": "Lieu supprimé avec succès"}
 
 # EMPLACEMENTS
-@app.get("/emplacements/", response_model=List[schemas.EmplacementResponse])
-def read_emplacements(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@app.get("/emplacements/", response_model=List[schemas.EmplacementResponse], dependencies=[Depends(etag_tables(models.Emplacement))])
+def read_emplacements(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """Récupérer tous les emplacements"""
     emplacements = crud.get_emplacements(db, skip=skip, limit=limit)
     return emplacements
 
-@app.get("/emplacements/lieu/{lieu_id}", response_model=List[schemas.EmplacementResponse])
-def read_emplacements_by_lieu(lieu_id: int, db: Session = Depends(get_db)):
+@app.get("/emplacements/lieu/{lieu_id}", response_model=List[schemas.EmplacementResponse], dependencies=[Depends(etag_tables(models.Emplacement))])
+def read_emplacements_by_lieu(lieu_id: int, db: Session = Depends(get_read_db)):
     """Récupérer tous les emplacements d'un lieu"""
     emplacements = crud.get_emplacements_by_lieu(db, lieu_id=lieu_id)
     return emplacements
@@ -293,12 +462,12 @@ def create_emplacement(emplacement: schemas.EmplacementCreate, db: Session = Dep
     return crud.create_emplacement(db=db, emplacement=emplacement)
 
 @app.get("/emplacements/{emplacement_id}", response_model=schemas.EmplacementResponse)
-def read_emplacement(emplacement_id: int, db: Session = Depends(get_db)):
+def read_emplacement(emplacement_id: int, request: Request, response: Response, db: Session = Depends(get_read_db)):
     """Récupérer un emplacement par son ID"""
     db_emplacement = crud.get_emplacement_by_id(db, emplacement_id=emplacement_id)
     if db_emplacement is None:
         raise HTTPException(status_code=404, detail="Emplacement non trouvé")
-    return db_emplacement
+    return etag_ligne(request, response, db_emplacement)
 
 @app.put("/emplacements/{emplacement_id}", response_model=schemas.EmplacementResponse)
 def update_emplacement(emplacement_id: int, emplacement: schemas.EmplacementUpdate, db: Session = Depends(get_db)):
@@ -317,8 +486,8 @@ def delete_emplacement(emplacement_id: int, db: Session = Depends(get_db)):
     return {"message": "Emplacement supprimé avec succès"}
 
 # ROUTES AVEC HIÉRARCHIE COMPLÈTE
-@app.get("/emplacements-hierarchy/", response_model=List[schemas.EmplacementWithHierarchy])
-def read_emplacements_with_hierarchy(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@app.get("/emplacements-hierarchy/", response_model=List[schemas.EmplacementWithHierarchy], dependencies=[Depends(etag_tables(models.Site, models.Lieu, models.Emplacement))])
+def read_emplacements_with_hierarchy(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """Récupérer tous les emplacements avec leur hiérarchie complète"""
     results = crud.get_emplacements_with_hierarchy(db, skip=skip, limit=limit)
     
@@ -339,10 +508,10 @@ def read_emplacements_with_hierarchy(skip: int = 0, limit: int = 100, db: Sessio
 # =====================================================
 
 @app.get("/demandes/", response_model=List[schemas.DemandeResponse])
-def read_demandes(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_demandes(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_read_db)):
     """Récupérer toutes les demandes"""
-    demandes = crud.get_demandes(db, skip=skip, limit=limit)
-    return demandes
+    demandes = crud.get_demandes(db, skip=skip, limit=limit, cursor=cursor)
+    return exposer_curseur(response, demandes, crud.TRI_DEMANDES, limit)
 
 @app.post("/demandes/", response_model=schemas.DemandeResponse)
 def create_demande(demande: schemas.DemandeCreate, db: Session = Depends(get_db)):
@@ -355,7 +524,7 @@ def create_demande(demande: schemas.DemandeCreate, db: Session = Depends(get_db)
     return crud.create_demande(db=db, demande=demande)
 
 @app.get("/demandes/{demande_id}", response_model=schemas.DemandeResponse)
-def read_demande(demande_id: int, db: Session = Depends(get_db)):
+def read_demande(demande_id: int, db: Session = Depends(get_read_db)):
     """Récupérer une demande par son ID"""
     db_demande = crud.get_demande_by_id(db, demande_id=demande_id)
     if db_demande is None:
@@ -363,13 +532,13 @@ def read_demande(demande_id: int, db: Session = Depends(get_db)):
     return db_demande
 
 @app.get("/demandes/statut/{statut}", response_model=List[schemas.DemandeResponse])
-def read_demandes_by_statut(statut: str, db: Session = Depends(get_db)):
+def read_demandes_by_statut(statut: str, db: Session = Depends(get_read_db)):
     """Récupérer les demandes par statut"""
     demandes = crud.get_demandes_by_statut(db, statut=statut)
     return demandes
 
 @app.get("/demandes/demandeur/{demandeur}", response_model=List[schemas.DemandeResponse])
-def read_demandes_by_demandeur(demandeur: str, db: Session = Depends(get_db)):
+def read_demandes_by_demandeur(demandeur: str, db: Session = Depends(get_read_db)):
     """Récupérer les demandes par demandeur"""
     demandes = crud.get_demandes_by_demandeur(db, demandeur=demandeur)
     return demandes
@@ -387,19 +556,50 @@ def update_demande(demande_id: int, demande: schemas.DemandeUpdate, db: Session
 # =====================================================
 
 @app.get("/historique/", response_model=List[schemas.HistoriqueResponse])
-def read_historique(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+async def read_historique(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: AsyncSession = Depends(get_async_read_db)):
     """Récupérer l'historique des mouvements"""
-    historique = crud.get_historique(db, skip=skip, limit=limit)
-    return historique
+    historique = await crud.get_historique_async(db, skip=skip, limit=limit, cursor=cursor)
+    return exposer_curseur(response, historique, crud.TRI_HISTORIQUE, limit)
+
+@app.get("/historique/export")
+def export_historique(
+    request: Request,
+    debut: Optional[Union[datetime, date]] = Query(None, alias="from", description="Début de période (inclus)"),
+    fin: Optional[Union[datetime, date]] = Query(None, alias="to", description="Fin de période (exclue)"),
+    nature: Optional[str] = None,
+    reference: Optional[str] = None,
+    format: str = Query("csv", description="csv ou ndjson"),
+    gzip: bool = Query(True, description="Compresser le fichier au fil de l'eau")
+):
+    """Exporter l'historique des mouvements en flux, filtré par période, nature et produit"""
+    if format not in export.FORMATS_EXPORT:
+        raise HTTPException(status_code=400, detail="Le format doit être 'csv' ou 'ndjson'")
+    # Une date seule désigne le début de la journée
+    debut, fin = [
+        datetime.combine(borne, datetime.min.time()) if type(borne) is date else borne
+        for borne in (debut, fin)
+    ]
+    if debut and fin and fin <= debut:
+        raise HTTPException(status_code=400, detail="La fin de période doit être postérieure au début")
+    # Mois archivés (maintenance.archiver_historique) puis mouvements encore en base
+    colonnes = crud.COLONNES_EXPORT_HISTORIQUE
+    lots = itertools.chain(
+        export.lots_archives_historique(colonnes, debut=debut, fin=fin, nature=nature, reference=reference),
+        export.lignes_en_flux(
+            crud.requete_export_historique(debut=debut, fin=fin, nature=nature, reference=reference),
+            fabrique=fabrique_session_lecture(request)
+        )
+    )
+    return export.reponse_export(lots, colonnes, format, "historique", gzip=gzip)
 
 @app.get("/historique/reference/{reference}", response_model=List[schemas.HistoriqueResponse])
-def read_historique_by_reference(reference: str, db: Session = Depends(get_db)):
+def read_historique_by_reference(reference: str, db: Session = Depends(get_read_db)):
     """Récupérer l'historique d'un produit par sa référence"""
     historique = crud.get_historique_by_reference(db, reference=reference)
     return historique
 
 @app.get("/historique/nature/{nature}", response_model=List[schemas.HistoriqueResponse])
-def read_historique_by_nature(nature: str, db: Session = Depends(get_db)):
+def read_historique_by_nature(nature: str, db: Session = Depends(get_read_db)):
     """Récupérer l'historique par type de mouvement"""
     historique = crud.get_historique_by_nature(db, nature=nature)
     return historique
@@ -409,7 +609,7 @@ def read_historique_by_nature(nature: str, db: Session = Depends(get_db)):
 # =====================================================
 
 @app.get("/tables-atelier/", response_model=List[schemas.TableAtelierResponse])
-def read_tables_atelier(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_tables_atelier(skip: int = 0, limit: int = 100, db: Session = Depends(get_read_db)):
     """Récupérer toutes les tables d'atelier"""
     tables = crud.get_tables_atelier(db, skip=skip, limit=limit)
     return tables
@@ -425,7 +625,7 @@ def create_table_atelier(table: schemas.TableAtelierCreate, db: Session = Depend
     return crud.create_table_atelier(db=db, table=table)
 
 @app.get("/tables-atelier/{table_id}", response_model=schemas.TableAtelierResponse)
-def read_table_atelier(table_id: int, db: Session = Depends(get_db)):
+def read_table_atelier(table_id: int, db: Session = Depends(get_read_db)):
     """Récupérer une table d'atelier par son ID"""
     db_table = crud.get_table_atelier_by_id(db, table_id=table_id)
     if db_table is None:
@@ -433,7 +633,7 @@ def read_table_atelier(table_id: int, db: Session = Depends(get_db)):
     return db_table
 
 @app.get("/tables-atelier/type/{type_atelier}", response_model=List[schemas.TableAtelierResponse])
-def read_tables_atelier_by_type(type_atelier: str, db: Session = Depends(get_db)):
+def read_tables_atelier_by_type(type_atelier: str, db: Session = Depends(get_read_db)):
     """Récupérer les tables d'atelier par type"""
     tables = crud.get_tables_atelier_by_type(db, type_atelier=type_atelier)
     return tables
@@ -459,10 +659,10 @@ def delete_table_atelier(table_id: int, db: Session = Depends(get_db)):
 # =====================================================
 
 @app.get("/listes-inventaire/", response_model=List[schemas.ListeInventaireResponse])
-def read_listes_inventaire(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_listes_inventaire(response: Response, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, db: Session = Depends(get_read_db)):
     """Récupérer toutes les listes d'inventaire"""
-    listes = crud.get_listes_inventaire(db, skip=skip, limit=limit)
-    return listes
+    listes = crud.get_listes_inventaire(db, skip=skip, limit=limit, cursor=cursor)
+    return exposer_curseur(response, listes, crud.TRI_LISTES_INVENTAIRE, limit)
 
 @app.post("/listes-inventaire/", response_model=schemas.ListeInventaireResponse)
 def create_liste_inventaire(liste: schemas.ListeInventaireCreate, db: Session = Depends(get_db)):
@@ -475,7 +675,7 @@ def create_liste_inventaire(liste: schemas.ListeInventaireCreate, db: Session =
     return crud.create_liste_inventaire(db=db, liste=liste)
 
 @app.get("/listes-inventaire/{liste_id}", response_model=schemas.ListeInventaireResponse)
-def read_liste_inventaire(liste_id: int, db: Session = Depends(get_db)):
+def read_liste_inventaire(liste_id: int, db: Session = Depends(get_read_db)):
     """Récupérer une liste d'inventaire par son ID"""
     db_liste = crud.get_liste_inventaire_by_id(db, liste_id=liste_id)
     if db_liste is None:
@@ -499,7 +699,7 @@ def delete_liste_inventaire(liste_id: int, db: Session = Depends(get_db)):
     return {"message": "Liste d'inventaire supprimée avec succès"}
 
 @app.get("/listes-inventaire/{id_liste}/produits", response_model=List[schemas.ProduitListeInventaireResponse])
-def read_produits_liste_inventaire(id_liste: str, db: Session = Depends(get_db)):
+def read_produits_liste_inventaire(id_liste: str, db: Session = Depends(get_read_db)):
     """Récupérer tous les produits d'une liste d'inventaire"""
     produits = crud.get_produits_liste_inventaire(db, id_liste=id_liste)
     return produits
@@ -522,13 +722,50 @@ def update_produit_liste_inventaire(produit_id: int, produit: schemas.ProduitLis
 # =====================================================
 
 @app.post("/mouvements-stock/", response_model=schemas.MouvementStockResponse)
-def effectuer_mouvement_stock(mouvement: schemas.MouvementStockCreate, db: Session = Depends(get_db)):
+async def effectuer_mouvement_stock(mouvement: schemas.MouvementStockCreate, db: AsyncSession = Depends(get_async_db)):
     """Effectuer un mouvement de stock"""
-    result = crud.effectuer_mouvement_stock(db=db, mouvement=mouvement)
+    result = await crud.effectuer_mouvement_stock_async(db=db, mouvement=mouvement)
     if not result["success"]:
         raise HTTPException(status_code=400, detail=result["message"])
     return result
 
+@app.post("/mouvements-stock/batch", response_model=schemas.MouvementStockBatchResponse)
+def effectuer_mouvements_stock_batch(lot: schemas.MouvementStockBatchRequest, db: Session = Depends(get_db)):
+    """Effectuer un lot de mouvements de stock en une seule transaction.
+    
+    Route synchrone (pool de threads) : le traitement ligne à ligne d'un gros lot
+    bloquerait la boucle d'événements, et avec elle les scans servis en asynchrone.
+    """
+    return crud.effectuer_mouvements_stock_batch(db=db, mouvements=lot.mouvements, partiel=lot.partiel)
+
+# =====================================================
+# EXPORTS PARQUET POUR L'ANALYSE
+# =====================================================
+
+def verifier_parquet():
+    if not export.parquet_disponible():
+        raise HTTPException(status_code=503, detail="Export Parquet indisponible : pyarrow n'est pas installé")
+
+@app.post("/exports/parquet", dependencies=[Depends(verifier_parquet)])
+def create_exports_parquet():
+    """Ajouter les mois d'historique terminés et l'instantané d'inventaire du mois manquants"""
+    return {"fichiers": export.exporter_parquet()}
+
+@app.get("/exports/parquet", dependencies=[Depends(verifier_parquet)])
+def read_exports_parquet():
+    """Lister les fichiers Parquet disponibles"""
+    return export.fichiers_parquet()
+
+@app.get("/exports/parquet/{table}/{mois}", dependencies=[Depends(verifier_parquet)])
+def download_export_parquet(table: str, mois: str = Path(..., pattern=r"^\d{4}-\d{2}$")):
+    """Télécharger le fichier Parquet d'une table pour un mois (AAAA-MM)"""
+    if table not in export.TABLES_PARQUET:
+        raise HTTPException(status_code=404, detail="Table non exportée")
+    chemin = export.chemin_parquet(table, mois)
+    if not os.path.exists(chemin):
+        raise HTTPException(status_code=404, detail="Aucun export pour ce mois")
+    return FileResponse(chemin, media_type="application/vnd.apache.parquet", filename=f"{table}_{mois}.parquet")
+
 # =====================================================
 # ROUTES UTILITAIRES
 # =====================================================
@@ -538,6 +775,18 @@ def health_check():
     """Vérification de l'état de l'API"""
     return {"status": "healthy", "message": "API GMAO fonctionnelle"}
 
+@app.get("/metrics")
+def read_metrics():
+    """Compteurs des caches de ce worker (entrées, succès, échecs, taux de succès) et de ses
+    pools de connexions (occupation, saturation, attente des emprunts)"""
+    return {
+        "caches": {
+            "produits_reference": crud.cache_produits_reference.stats(),
+            "autocomplete": crud.cache_autocomplete.stats()
+        },
+        "pools": stats_pools()
+    }
+
 @app.get("/")
 def read_root():
     """Page d'accueil de l'API"""
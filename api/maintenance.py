@@ -0,0 +1,140 @@
+"""
+Tâches de maintenance de la base GMAO, à planifier (cron) :
+
+    python maintenance.py partitions   # créer les partitions mensuelles à venir de l'historique
+    python maintenance.py archiver     # archiver en Parquet les mois au-delà de la rétention
+"""
+
+import logging
+import os
+import sys
+from datetime import date
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.exc import DBAPIError
+import crud
+import export
+import models
+from database import SessionLocal, engine
+
+logger = logging.getLogger(__name__)
+
+# Nombre de mois d'historique gardés dans la table (mois en cours compris)
+HISTORIQUE_RETENTION_MOIS = int(os.getenv("HISTORIQUE_RETENTION_MOIS", "24"))
+# Nombre de partitions mensuelles créées à l'avance
+HISTORIQUE_PARTITIONS_AVANCE = int(os.getenv("HISTORIQUE_PARTITIONS_AVANCE", "4"))
+
+def historique_partitionne() -> bool:
+    """L'historique n'est partitionné que sous PostgreSQL (init.sql, migration 007)"""
+    return engine.dialect.name == "postgresql"
+
+def creer_partitions_historique(avance: int = HISTORIQUE_PARTITIONS_AVANCE) -> int:
+    """Créer les partitions du mois en cours et des `avance` mois suivants ; retourne le nombre créé"""
+    if not historique_partitionne():
+        return 0
+    try:
+        with engine.begin() as connexion:
+            return connexion.execute(text(
+                "SELECT gmao_creer_partitions_historique(CURRENT_DATE, "
+                "(date_trunc('month', CURRENT_DATE) + make_interval(months => :avance + 1))::date)"
+            ), {"avance": avance}).scalar()
+    except DBAPIError as e:
+        # Base non migrée (007) : les mouvements restent dans une table unique
+        logger.warning("Création des partitions de l'historique impossible : %s", e)
+        return 0
+
+def _partitions_historique(connexion):
+    """Noms des partitions mensuelles attachées à historique, de la plus ancienne à la plus récente"""
+    return connexion.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'historique'::regclass AND c.relname ~ '^historique_[0-9]{4}_[0-9]{2}$' "
+        "ORDER BY c.relname"
+    )).scalars().all()
+
+def archiver_historique(retention_mois: int = HISTORIQUE_RETENTION_MOIS, repertoire: str = export.EXPORT_PARQUET_DIR):
+    """Déplacer les mois d'historique plus anciens que la rétention vers des archives Parquet.
+
+    Chaque mois est écrit dans historique_archive/mois=AAAA-MM, relu pour vérifier le nombre
+    de lignes, puis sa partition est détachée et supprimée (ou ses lignes supprimées sans
+    partitionnement). Les archives restent lisibles par /historique/export et
+    /exports/parquet. Un mois dont l'archive existe mais ne correspond plus à la base
+    est laissé en place et signalé.
+    """
+    if not export.parquet_disponible():
+        raise RuntimeError("Archivage impossible : pyarrow n'est pas installé")
+    limite = export.debut_mois(date.today())
+    for _ in range(retention_mois - 1):
+        limite = date(limite.year - (limite.month == 1), (limite.month - 2) % 12 + 1, 1)
+
+    table = models.Historique.__table__
+    with SessionLocal() as db:
+        premier = db.execute(select(func.min(table.c.date_mouvement))).scalar()
+        partitions = _partitions_historique(db) if historique_partitionne() else []
+    mois_a_traiter = set()
+    if premier is not None:
+        mois = export.debut_mois(premier)
+        while mois < limite:
+            mois_a_traiter.add(mois)
+            mois = export.mois_suivant(mois)
+    for nom in partitions:
+        mois = date(int(nom[-7:-3]), int(nom[-2:]), 1)
+        if mois < limite:
+            mois_a_traiter.add(mois)
+
+    archives = []
+    for mois in sorted(mois_a_traiter):
+        archive = _archiver_mois(mois, repertoire)
+        if archive:
+            archives.append(archive)
+    return archives
+
+def _archiver_mois(mois: date, repertoire: str):
+    table = models.Historique.__table__
+    suivant = export.mois_suivant(mois)
+    cle = mois.strftime("%Y-%m")
+    nom_partition = f"historique_{mois:%Y_%m}"
+    chemin = export.chemin_parquet("historique_archive", cle, repertoire)
+    bornes = (table.c.date_mouvement >= mois, table.c.date_mouvement < suivant)
+
+    with SessionLocal() as db:
+        lignes = db.execute(select(func.count()).select_from(table).where(*bornes)).scalar()
+    if lignes and not os.path.exists(chemin):
+        # Lue sur le primaire : l'archive doit contenir exactement ce qui y sera supprimé
+        ecrites = export.ecrire_parquet(crud.requete_export_historique(debut=mois, fin=suivant), chemin, SessionLocal)
+        if ecrites != lignes:
+            os.remove(chemin)
+            logger.error("Archive %s incomplète (%s lignes sur %s), mois laissé en base", cle, ecrites, lignes)
+            return None
+    archivees = export.pq.read_metadata(chemin).num_rows if os.path.exists(chemin) else 0
+
+    with engine.begin() as connexion:
+        if historique_partitionne():
+            # La suppression d'un mois peut dépasser le DB_STATEMENT_TIMEOUT de l'API
+            connexion.execute(text("SET LOCAL statement_timeout = 0"))
+        partition = historique_partitionne() and connexion.execute(
+            text("SELECT to_regclass(:nom)"), {"nom": nom_partition}
+        ).scalar() is not None
+        if partition:
+            connexion.execute(text(f'LOCK TABLE "{nom_partition}" IN SHARE MODE'))
+        # Recompter sous verrou : rien ne doit être supprimé qui ne soit pas dans l'archive
+        en_base = connexion.execute(select(func.count()).select_from(table).where(*bornes)).scalar()
+        if en_base != archivees:
+            logger.error("Archive %s : %s lignes archivées, %s en base, mois laissé en base", cle, archivees, en_base)
+            return None
+        if partition:
+            connexion.execute(text(f'ALTER TABLE historique DETACH PARTITION "{nom_partition}"'))
+            connexion.execute(text(f'DROP TABLE "{nom_partition}"'))
+        # Mouvements du mois restés dans la partition par défaut, ou table non partitionnée
+        connexion.execute(delete(table).where(*bornes))
+    if not archivees and not partition:
+        return None
+    logger.info("Historique %s archivé : %s lignes", cle, archivees)
+    return {"mois": cle, "lignes": archivees}
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    taches = sys.argv[1:] or ["partitions", "archiver"]
+    if "partitions" in taches:
+        print(f"Partitions créées : {creer_partitions_historique()}")
+    if "archiver" in taches:
+        for archive in archiver_historique():
+            print(f"Historique {archive['mois']} archivé : {archive['lignes']} lignes")
@@ -0,0 +1,11 @@
+-- =====================================================
+-- MIGRATION 001 : INDEX POUR LA PAGINATION PAR CURSEUR
+-- =====================================================
+-- Pour une base déjà initialisée avec init.sql.
+-- CONCURRENTLY évite de bloquer les écritures des scanners pendant la création :
+-- exécuter hors transaction, par exemple avec
+--   psql -U $POSTGRES_USER -d $POSTGRES_DB -f api/migrations/001_pagination_curseur.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_historique_date_id ON historique(date_mouvement DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_demandes_date_id ON demandes(date_demande DESC, id DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_listes_inventaire_date_id ON listes_inventaire(date_creation DESC, id DESC);
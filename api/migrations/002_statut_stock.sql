@@ -0,0 +1,27 @@
+-- =====================================================
+-- MIGRATION 002 : STATUT DE STOCK GÉNÉRÉ ET INDEXÉ
+-- =====================================================
+-- Pour une base déjà initialisée avec init.sql (PostgreSQL 12 ou plus).
+-- L'ajout des colonnes générées réécrit la table inventaire sous verrou exclusif :
+-- à lancer hors des heures de scan. Les index sont ensuite créés sans bloquer.
+--   psql -U $POSTGRES_USER -d $POSTGRES_DB -f api/migrations/002_statut_stock.sql
+
+ALTER TABLE inventaire
+    ADD COLUMN IF NOT EXISTS seuil_alerte DOUBLE PRECISION GENERATED ALWAYS AS (
+        CASE WHEN COALESCE(stock_max, 100) > COALESCE(stock_min, 0)
+        THEN CAST(COALESCE(stock_min, 0) AS DOUBLE PRECISION)
+            + CAST(COALESCE(stock_max, 100) - COALESCE(stock_min, 0) AS DOUBLE PRECISION) * 0.3
+        ELSE CAST(COALESCE(stock_min, 0) AS DOUBLE PRECISION) END
+    ) STORED,
+    ADD COLUMN IF NOT EXISTS statut_stock VARCHAR(10) GENERATED ALWAYS AS (
+        CASE WHEN COALESCE(quantite, 0) < COALESCE(stock_min, 0) THEN 'critique'
+        WHEN COALESCE(quantite, 0) > COALESCE(stock_max, 100) THEN 'surstock'
+        WHEN COALESCE(quantite, 0) <= CASE WHEN COALESCE(stock_max, 100) > COALESCE(stock_min, 0)
+            THEN CAST(COALESCE(stock_min, 0) AS DOUBLE PRECISION)
+                + CAST(COALESCE(stock_max, 100) - COALESCE(stock_min, 0) AS DOUBLE PRECISION) * 0.3
+            ELSE CAST(COALESCE(stock_min, 0) AS DOUBLE PRECISION) END THEN 'faible'
+        ELSE 'normal' END
+    ) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_inventaire_statut_stock ON inventaire(statut_stock, fournisseur, id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_inventaire_alertes ON inventaire(id) WHERE statut_stock <> 'normal';
@@ -0,0 +1,27 @@
+-- =====================================================
+-- MIGRATION 003 : RECHERCHE TRIGRAMME SANS ACCENTS
+-- =====================================================
+-- Pour une base déjà initialisée avec init.sql. Les extensions pg_trgm et unaccent
+-- sont fournies par l'image postgres officielle (paquet contrib).
+--   psql -U $POSTGRES_USER -d $POSTGRES_DB -f api/migrations/003_recherche_trigramme.sql
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- unaccent() n'est que STABLE : enveloppe IMMUTABLE (dictionnaire explicite) pour l'indexation
+CREATE OR REPLACE FUNCTION gmao_normaliser(texte TEXT)
+RETURNS TEXT AS $$
+    SELECT lower(public.unaccent('public.unaccent'::regdictionary, texte))
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+
+-- Texte recherché d'un produit : code, désignation, référence, fournisseur et catégorie
+CREATE OR REPLACE FUNCTION gmao_document_recherche(code TEXT, produits TEXT, reference TEXT, fournisseur TEXT, categorie TEXT)
+RETURNS TEXT AS $$
+    SELECT gmao_normaliser(
+        COALESCE(code, '') || ' ' || COALESCE(produits, '') || ' ' || COALESCE(reference, '') || ' '
+        || COALESCE(fournisseur, '') || ' ' || COALESCE(categorie, '')
+    )
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_inventaire_recherche ON inventaire
+    USING GIN (gmao_document_recherche(code, produits, reference, fournisseur, categorie) gin_trgm_ops);
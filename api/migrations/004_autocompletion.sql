@@ -0,0 +1,8 @@
+-- =====================================================
+-- MIGRATION 004 : INDEX D'AUTOCOMPLÉTION PAR PRÉFIXE
+-- =====================================================
+-- Pour une base déjà initialisée avec init.sql ; nécessite la migration 003 (gmao_normaliser).
+--   psql -U $POSTGRES_USER -d $POSTGRES_DB -f api/migrations/004_autocompletion.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_inventaire_reference_prefixe ON inventaire((reference COLLATE "C"));
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_inventaire_produits_prefixe ON inventaire((gmao_normaliser(produits) COLLATE "C"));
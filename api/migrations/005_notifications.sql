@@ -0,0 +1,67 @@
+-- =====================================================
+-- MIGRATION 005 : NOTIFICATIONS DE CHANGEMENT
+-- =====================================================
+-- Pour une base déjà initialisée avec init.sql.
+--   psql -U $POSTGRES_USER -d $POSTGRES_DB -f api/migrations/005_notifications.sql
+
+CREATE OR REPLACE FUNCTION notifier_changement()
+RETURNS TRIGGER AS $$
+DECLARE
+    ligne RECORD;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        ligne := OLD;
+    ELSE
+        ligne := NEW;
+    END IF;
+    PERFORM pg_notify('gmao_changements', json_build_object(
+        'table', TG_TABLE_NAME,
+        'id', ligne.id,
+        'op', TG_OP,
+        -- Colonne clé optionnelle (argument du trigger), ex. la référence QR d'un produit
+        'cle', CASE WHEN TG_NARGS > 0 THEN to_jsonb(ligne) ->> TG_ARGV[0] END,
+        'ancienne_cle', CASE WHEN TG_NARGS > 0 AND TG_OP = 'UPDATE' THEN to_jsonb(OLD) ->> TG_ARGV[0] END
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trigger_notifier_inventaire
+    AFTER INSERT OR UPDATE OR DELETE ON inventaire
+    FOR EACH ROW EXECUTE FUNCTION notifier_changement('reference');
+
+CREATE OR REPLACE TRIGGER trigger_notifier_sites
+    AFTER INSERT OR UPDATE OR DELETE ON sites
+    FOR EACH ROW EXECUTE FUNCTION notifier_changement();
+
+CREATE OR REPLACE TRIGGER trigger_notifier_lieux
+    AFTER INSERT OR UPDATE OR DELETE ON lieux
+    FOR EACH ROW EXECUTE FUNCTION notifier_changement();
+
+CREATE OR REPLACE TRIGGER trigger_notifier_tables_atelier
+    AFTER INSERT OR UPDATE OR DELETE ON tables_atelier
+    FOR EACH ROW EXECUTE FUNCTION notifier_changement();
+
+-- Fournisseurs et emplacements : les compteurs recalculés à chaque mouvement de stock
+-- (update_fournisseur_stats, update_emplacement_stats) ne déclenchent pas de notification
+CREATE OR REPLACE TRIGGER trigger_notifier_fournisseurs
+    AFTER INSERT OR DELETE ON fournisseurs
+    FOR EACH ROW EXECUTE FUNCTION notifier_changement();
+
+CREATE OR REPLACE TRIGGER trigger_notifier_fournisseurs_update
+    AFTER UPDATE ON fournisseurs
+    FOR EACH ROW
+    WHEN ((to_jsonb(OLD) - 'nb_produits' - 'valeur_stock_total' - 'updated_at')
+          IS DISTINCT FROM (to_jsonb(NEW) - 'nb_produits' - 'valeur_stock_total' - 'updated_at'))
+    EXECUTE FUNCTION notifier_changement();
+
+CREATE OR REPLACE TRIGGER trigger_notifier_emplacements
+    AFTER INSERT OR DELETE ON emplacements
+    FOR EACH ROW EXECUTE FUNCTION notifier_changement();
+
+CREATE OR REPLACE TRIGGER trigger_notifier_emplacements_update
+    AFTER UPDATE ON emplacements
+    FOR EACH ROW
+    WHEN ((to_jsonb(OLD) - 'nb_produits' - 'taux_occupation' - 'updated_at')
+          IS DISTINCT FROM (to_jsonb(NEW) - 'nb_produits' - 'taux_occupation' - 'updated_at'))
+    EXECUTE FUNCTION notifier_changement();
@@ -0,0 +1,7 @@
+-- =====================================================
+-- MIGRATION 006 : INDEX DE L'EXPORT DE L'HISTORIQUE
+-- =====================================================
+-- Pour une base déjà initialisée avec init.sql.
+--   psql -U $POSTGRES_USER -d $POSTGRES_DB -f api/migrations/006_export_historique.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_historique_reference_date ON historique(reference, date_mouvement, id);
@@ -0,0 +1,87 @@
+-- =====================================================
+-- MIGRATION 007 : PARTITIONNEMENT MENSUEL DE L'HISTORIQUE
+-- =====================================================
+-- Pour une base déjà initialisée avec init.sql. Recopie l'historique existant dans une
+-- table partitionnée par mois : à exécuter pendant une fenêtre de maintenance (la table
+-- est verrouillée pendant la copie).
+--   psql -U $POSTGRES_USER -d $POSTGRES_DB -f api/migrations/007_partitionnement_historique.sql
+
+BEGIN;
+
+ALTER TABLE historique RENAME TO historique_ancien;
+-- Les index et la séquence sont repris par la nouvelle table
+DROP INDEX IF EXISTS idx_historique_reference;
+DROP INDEX IF EXISTS idx_historique_date;
+DROP INDEX IF EXISTS idx_historique_nature;
+DROP INDEX IF EXISTS idx_historique_date_id;
+DROP INDEX IF EXISTS idx_historique_reference_date;
+ALTER SEQUENCE historique_id_seq OWNED BY NONE;
+
+CREATE TABLE historique (
+    id INTEGER NOT NULL DEFAULT nextval('historique_id_seq'),
+    date_mouvement TIMESTAMP NOT NULL,
+    reference VARCHAR(20),
+    produit VARCHAR(500) NOT NULL,
+    nature VARCHAR(50) NOT NULL,
+    quantite_mouvement INTEGER NOT NULL,
+    quantite_avant INTEGER NOT NULL,
+    quantite_apres INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, date_mouvement)
+) PARTITION BY RANGE (date_mouvement);
+ALTER SEQUENCE historique_id_seq OWNED BY historique.id;
+
+CREATE INDEX idx_historique_reference ON historique(reference);
+CREATE INDEX idx_historique_date ON historique(date_mouvement);
+CREATE INDEX idx_historique_nature ON historique(nature);
+CREATE INDEX idx_historique_date_id ON historique(date_mouvement DESC, id DESC);
+CREATE INDEX idx_historique_reference_date ON historique(reference, date_mouvement, id);
+
+CREATE TABLE IF NOT EXISTS historique_defaut PARTITION OF historique DEFAULT;
+
+CREATE OR REPLACE FUNCTION gmao_creer_partitions_historique(
+    debut DATE DEFAULT date_trunc('month', CURRENT_DATE)::date,
+    fin DATE DEFAULT (date_trunc('month', CURRENT_DATE) + INTERVAL '4 months')::date
+)
+RETURNS INTEGER AS $$
+DECLARE
+    mois DATE := date_trunc('month', debut)::date;
+    mois_suivant DATE;
+    nom_partition TEXT;
+    creees INTEGER := 0;
+BEGIN
+    -- Plusieurs workers de l'API appellent la fonction à leur démarrage
+    PERFORM pg_advisory_xact_lock(hashtext('gmao_creer_partitions_historique'));
+    WHILE mois < fin LOOP
+        mois_suivant := (mois + INTERVAL '1 month')::date;
+        nom_partition := 'historique_' || to_char(mois, 'YYYY_MM');
+        IF to_regclass(nom_partition) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I (LIKE historique INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', nom_partition);
+            EXECUTE format(
+                'WITH deplaces AS (DELETE FROM historique_defaut WHERE date_mouvement >= %L AND date_mouvement < %L RETURNING *) '
+                'INSERT INTO %I SELECT * FROM deplaces',
+                mois, mois_suivant, nom_partition
+            );
+            EXECUTE format('ALTER TABLE historique ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', nom_partition, mois, mois_suivant);
+            creees := creees + 1;
+        END IF;
+        mois := mois_suivant;
+    END LOOP;
+    RETURN creees;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Une partition par mois depuis le plus ancien mouvement, et quatre mois d'avance
+SELECT gmao_creer_partitions_historique(
+    COALESCE((SELECT min(date_mouvement)::date FROM historique_ancien), CURRENT_DATE)
+);
+
+INSERT INTO historique (id, date_mouvement, reference, produit, nature, quantite_mouvement, quantite_avant, quantite_apres, created_at)
+SELECT id, date_mouvement, reference, produit, nature, quantite_mouvement, quantite_avant, quantite_apres, created_at
+FROM historique_ancien;
+
+DROP TABLE historique_ancien;
+
+COMMIT;
+
+ANALYZE historique;
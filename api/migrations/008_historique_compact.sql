@@ -0,0 +1,67 @@
+-- =====================================================
+-- MIGRATION 008 : FORMAT COMPACT DE L'HISTORIQUE
+-- =====================================================
+-- Pour une base déjà initialisée avec init.sql (et migrée en 007). Chaque mouvement
+-- désigne son produit par inventaire_id et sa nature par type_mouvement ; les copies de
+-- la désignation et du libellé ne sont conservées que lorsqu'elles ne s'en déduisent
+-- pas. À exécuter pendant une fenêtre de maintenance (réécriture de toute la table).
+--   psql -U $POSTGRES_USER -d $POSTGRES_DB -f api/migrations/008_historique_compact.sql
+
+BEGIN;
+
+-- Mêmes règles que models.code_type_mouvement
+CREATE FUNCTION pg_temp.type_mouvement(nature TEXT) RETURNS SMALLINT AS $$
+    SELECT CASE
+        WHEN lower(nature) LIKE '%entrée%' OR lower(nature) LIKE '%entree%' THEN 1
+        WHEN lower(nature) LIKE '%sortie%' THEN 2
+        WHEN lower(nature) LIKE '%ajustement%' OR lower(nature) LIKE '%régule%'
+             OR lower(nature) LIKE '%regule%' THEN 3
+        WHEN lower(nature) LIKE '%transfert%' THEN 5
+        ELSE 4
+    END::SMALLINT
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE FUNCTION pg_temp.libelle_mouvement(type_mouvement SMALLINT) RETURNS TEXT AS $$
+    SELECT CASE type_mouvement
+        WHEN 1 THEN 'Entrée' WHEN 2 THEN 'Sortie' WHEN 3 THEN 'Ajustement'
+        WHEN 4 THEN 'Inventaire' WHEN 5 THEN 'Transfert'
+    END
+$$ LANGUAGE sql IMMUTABLE;
+
+ALTER TABLE historique
+    ADD COLUMN IF NOT EXISTS inventaire_id INTEGER REFERENCES inventaire(id) ON DELETE SET NULL,
+    ADD COLUMN IF NOT EXISTS type_mouvement SMALLINT,
+    ALTER COLUMN produit DROP NOT NULL,
+    ALTER COLUMN nature DROP NOT NULL;
+
+-- Lier chaque mouvement à sa fiche produit et à son type, et ne garder la désignation et
+-- le libellé que s'ils diffèrent de la fiche et du libellé standard du type
+UPDATE historique h SET
+    inventaire_id = (SELECT i.id FROM inventaire i WHERE i.reference = h.reference),
+    type_mouvement = pg_temp.type_mouvement(h.nature),
+    produit = CASE WHEN h.produit = (SELECT i.produits FROM inventaire i WHERE i.reference = h.reference)
+                   THEN NULL ELSE h.produit END,
+    nature = CASE WHEN h.nature = pg_temp.libelle_mouvement(pg_temp.type_mouvement(h.nature))
+                  THEN NULL ELSE h.nature END;
+
+ALTER TABLE historique ALTER COLUMN type_mouvement SET NOT NULL;
+
+DROP INDEX IF EXISTS idx_historique_nature;
+CREATE INDEX IF NOT EXISTS idx_historique_type ON historique(type_mouvement, date_mouvement DESC);
+CREATE INDEX IF NOT EXISTS idx_historique_inventaire ON historique(inventaire_id);
+
+CREATE OR REPLACE VIEW historique_complet AS
+SELECT h.id, h.date_mouvement, h.reference,
+       COALESCE(h.produit, i.produits) AS produit,
+       COALESCE(h.nature, CASE h.type_mouvement
+           WHEN 1 THEN 'Entrée' WHEN 2 THEN 'Sortie' WHEN 3 THEN 'Ajustement'
+           WHEN 4 THEN 'Inventaire' WHEN 5 THEN 'Transfert' END) AS nature,
+       h.quantite_mouvement, h.quantite_avant, h.quantite_apres, h.created_at,
+       h.inventaire_id, h.type_mouvement
+FROM historique h
+LEFT JOIN inventaire i ON i.id = h.inventaire_id;
+
+COMMIT;
+
+-- Rendre au système l'espace des anciennes versions des lignes (verrou exclusif)
+VACUUM FULL ANALYZE historique;
@@ -0,0 +1,53 @@
+-- =====================================================
+-- MIGRATION 009 : VERSIONS DES TABLES POUR LES ETAG
+-- =====================================================
+-- Pour une base déjà initialisée avec init.sql. Remplace le calcul de version des
+-- listes (count, max et somme des updated_at sur toute la table) par un compteur
+-- maintenu par trigger.
+--   psql -U $POSTGRES_USER -d $POSTGRES_DB -f api/migrations/009_versions_tables.sql
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS versions_tables (
+    nom_table VARCHAR(63) NOT NULL,
+    tranche SMALLINT NOT NULL,
+    version BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (nom_table, tranche)
+);
+
+CREATE OR REPLACE FUNCTION incrementer_version_table()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO versions_tables (nom_table, tranche, version)
+    VALUES (TG_TABLE_NAME, pg_backend_pid() % 16, 1)
+    ON CONFLICT (nom_table, tranche) DO UPDATE SET version = versions_tables.version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_version_inventaire ON inventaire;
+CREATE TRIGGER trigger_version_inventaire
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON inventaire
+    FOR EACH STATEMENT EXECUTE FUNCTION incrementer_version_table();
+
+DROP TRIGGER IF EXISTS trigger_version_fournisseurs ON fournisseurs;
+CREATE TRIGGER trigger_version_fournisseurs
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON fournisseurs
+    FOR EACH STATEMENT EXECUTE FUNCTION incrementer_version_table();
+
+DROP TRIGGER IF EXISTS trigger_version_sites ON sites;
+CREATE TRIGGER trigger_version_sites
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON sites
+    FOR EACH STATEMENT EXECUTE FUNCTION incrementer_version_table();
+
+DROP TRIGGER IF EXISTS trigger_version_lieux ON lieux;
+CREATE TRIGGER trigger_version_lieux
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON lieux
+    FOR EACH STATEMENT EXECUTE FUNCTION incrementer_version_table();
+
+DROP TRIGGER IF EXISTS trigger_version_emplacements ON emplacements;
+CREATE TRIGGER trigger_version_emplacements
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON emplacements
+    FOR EACH STATEMENT EXECUTE FUNCTION incrementer_version_table();
+
+COMMIT;
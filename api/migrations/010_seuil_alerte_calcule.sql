@@ -0,0 +1,15 @@
+-- =====================================================
+-- MIGRATION 010 : RENOMMAGE DU SEUIL D'ALERTE CALCULÉ
+-- =====================================================
+-- Pour une base migrée en 002. La colonne générée seuil_alerte prend le nom
+-- seuil_alerte_calcule : dans l'interface, seuil_alerte désigne le stock minimum.
+--   psql -U $POSTGRES_USER -d $POSTGRES_DB -f api/migrations/010_seuil_alerte_calcule.sql
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM information_schema.columns
+               WHERE table_name = 'inventaire' AND column_name = 'seuil_alerte') THEN
+        ALTER TABLE inventaire RENAME COLUMN seuil_alerte TO seuil_alerte_calcule;
+    END IF;
+END
+$$;
@@ -0,0 +1,150 @@
+-- =====================================================
+-- MIGRATION 011 : NOTIFICATIONS PAR INSTRUCTION
+-- =====================================================
+-- Pour une base migrée en 005. Les triggers FOR EACH ROW de notifier_changement()
+-- publiaient une notification par ligne (un import de N produits : N invalidations de
+-- cache dans chaque worker) ; ils sont remplacés par des triggers FOR EACH STATEMENT
+-- qui publient une notification par instruction.
+--   psql -U $POSTGRES_USER -d $POSTGRES_DB -f api/migrations/011_notifications_par_instruction.sql
+
+BEGIN;
+
+DROP TRIGGER IF EXISTS trigger_notifier_inventaire ON inventaire;
+DROP TRIGGER IF EXISTS trigger_notifier_sites ON sites;
+DROP TRIGGER IF EXISTS trigger_notifier_lieux ON lieux;
+DROP TRIGGER IF EXISTS trigger_notifier_tables_atelier ON tables_atelier;
+DROP TRIGGER IF EXISTS trigger_notifier_fournisseurs ON fournisseurs;
+DROP TRIGGER IF EXISTS trigger_notifier_fournisseurs_update ON fournisseurs;
+DROP TRIGGER IF EXISTS trigger_notifier_emplacements ON emplacements;
+DROP TRIGGER IF EXISTS trigger_notifier_emplacements_update ON emplacements;
+DROP FUNCTION IF EXISTS notifier_changement();
+
+CREATE OR REPLACE FUNCTION notifier_changements()
+RETURNS TRIGGER AS $$
+DECLARE
+    -- Arguments du trigger : colonne clé ('' si aucune), puis colonnes dont la seule
+    -- modification ne justifie pas de notification (compteurs recalculés par trigger)
+    colonne_cle TEXT := NULLIF(TG_ARGV[0], '');
+    ignorees TEXT[] := COALESCE(TG_ARGV[1:TG_NARGS - 1], '{}');
+    lignes JSONB;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT jsonb_agg(jsonb_build_object('id', n.id, 'cle', to_jsonb(n) ->> colonne_cle))
+        INTO lignes FROM nouvelles n;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT jsonb_agg(jsonb_build_object('id', a.id, 'cle', to_jsonb(a) ->> colonne_cle))
+        INTO lignes FROM anciennes a;
+    ELSE
+        SELECT jsonb_agg(jsonb_build_object(
+                   'id', n.id, 'cle', to_jsonb(n) ->> colonne_cle, 'ancienne_cle', to_jsonb(a) ->> colonne_cle))
+        INTO lignes
+        FROM nouvelles n JOIN anciennes a ON a.id = n.id
+        WHERE (to_jsonb(a) - ignorees) IS DISTINCT FROM (to_jsonb(n) - ignorees);
+    END IF;
+    IF lignes IS NULL THEN
+        RETURN NULL;
+    END IF;
+    -- Au-delà de 50 lignes (NOTIFY est limité à 8000 octets), la notification ne détaille
+    -- pas les lignes : les écouteurs vident alors les caches de toute la table
+    PERFORM pg_notify('gmao_changements', json_build_object(
+        'table', TG_TABLE_NAME,
+        'op', TG_OP,
+        'lignes', CASE WHEN jsonb_array_length(lignes) <= 50 THEN lignes END
+    )::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_notifier_inventaire_insert ON inventaire;
+CREATE TRIGGER trigger_notifier_inventaire_insert
+    AFTER INSERT ON inventaire REFERENCING NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('reference');
+
+DROP TRIGGER IF EXISTS trigger_notifier_inventaire_update ON inventaire;
+CREATE TRIGGER trigger_notifier_inventaire_update
+    AFTER UPDATE ON inventaire REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('reference');
+
+DROP TRIGGER IF EXISTS trigger_notifier_inventaire_delete ON inventaire;
+CREATE TRIGGER trigger_notifier_inventaire_delete
+    AFTER DELETE ON inventaire REFERENCING OLD TABLE AS anciennes
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('reference');
+
+DROP TRIGGER IF EXISTS trigger_notifier_sites_insert ON sites;
+CREATE TRIGGER trigger_notifier_sites_insert
+    AFTER INSERT ON sites REFERENCING NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+DROP TRIGGER IF EXISTS trigger_notifier_sites_update ON sites;
+CREATE TRIGGER trigger_notifier_sites_update
+    AFTER UPDATE ON sites REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+DROP TRIGGER IF EXISTS trigger_notifier_sites_delete ON sites;
+CREATE TRIGGER trigger_notifier_sites_delete
+    AFTER DELETE ON sites REFERENCING OLD TABLE AS anciennes
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+DROP TRIGGER IF EXISTS trigger_notifier_lieux_insert ON lieux;
+CREATE TRIGGER trigger_notifier_lieux_insert
+    AFTER INSERT ON lieux REFERENCING NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+DROP TRIGGER IF EXISTS trigger_notifier_lieux_update ON lieux;
+CREATE TRIGGER trigger_notifier_lieux_update
+    AFTER UPDATE ON lieux REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+DROP TRIGGER IF EXISTS trigger_notifier_lieux_delete ON lieux;
+CREATE TRIGGER trigger_notifier_lieux_delete
+    AFTER DELETE ON lieux REFERENCING OLD TABLE AS anciennes
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+DROP TRIGGER IF EXISTS trigger_notifier_tables_atelier_insert ON tables_atelier;
+CREATE TRIGGER trigger_notifier_tables_atelier_insert
+    AFTER INSERT ON tables_atelier REFERENCING NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+DROP TRIGGER IF EXISTS trigger_notifier_tables_atelier_update ON tables_atelier;
+CREATE TRIGGER trigger_notifier_tables_atelier_update
+    AFTER UPDATE ON tables_atelier REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+DROP TRIGGER IF EXISTS trigger_notifier_tables_atelier_delete ON tables_atelier;
+CREATE TRIGGER trigger_notifier_tables_atelier_delete
+    AFTER DELETE ON tables_atelier REFERENCING OLD TABLE AS anciennes
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements();
+
+-- Fournisseurs et emplacements : les compteurs recalculés à chaque mouvement de stock
+-- (update_fournisseur_stats, update_emplacement_stats) ne déclenchent pas de notification
+DROP TRIGGER IF EXISTS trigger_notifier_fournisseurs_insert ON fournisseurs;
+CREATE TRIGGER trigger_notifier_fournisseurs_insert
+    AFTER INSERT ON fournisseurs REFERENCING NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('', 'nb_produits', 'valeur_stock_total', 'updated_at');
+
+DROP TRIGGER IF EXISTS trigger_notifier_fournisseurs_update ON fournisseurs;
+CREATE TRIGGER trigger_notifier_fournisseurs_update
+    AFTER UPDATE ON fournisseurs REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('', 'nb_produits', 'valeur_stock_total', 'updated_at');
+
+DROP TRIGGER IF EXISTS trigger_notifier_fournisseurs_delete ON fournisseurs;
+CREATE TRIGGER trigger_notifier_fournisseurs_delete
+    AFTER DELETE ON fournisseurs REFERENCING OLD TABLE AS anciennes
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('', 'nb_produits', 'valeur_stock_total', 'updated_at');
+
+DROP TRIGGER IF EXISTS trigger_notifier_emplacements_insert ON emplacements;
+CREATE TRIGGER trigger_notifier_emplacements_insert
+    AFTER INSERT ON emplacements REFERENCING NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('', 'nb_produits', 'taux_occupation', 'updated_at');
+
+DROP TRIGGER IF EXISTS trigger_notifier_emplacements_update ON emplacements;
+CREATE TRIGGER trigger_notifier_emplacements_update
+    AFTER UPDATE ON emplacements REFERENCING OLD TABLE AS anciennes NEW TABLE AS nouvelles
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('', 'nb_produits', 'taux_occupation', 'updated_at');
+
+DROP TRIGGER IF EXISTS trigger_notifier_emplacements_delete ON emplacements;
+CREATE TRIGGER trigger_notifier_emplacements_delete
+    AFTER DELETE ON emplacements REFERENCING OLD TABLE AS anciennes
+    FOR EACH STATEMENT EXECUTE FUNCTION notifier_changements('', 'nb_produits', 'taux_occupation', 'updated_at');
+
+COMMIT;
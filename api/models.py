@@ -1,8 +1,25 @@
-from sqlalchemy import Column, Integer, String, Text, DECIMAL, TIMESTAMP, Date, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, BigInteger, Integer, SmallInteger, String, Text, DECIMAL, TIMESTAMP, Date, ForeignKey, Float, Computed, case, select
+from sqlalchemy.orm import relationship, column_property
 from sqlalchemy.sql import func
 from database import Base
 
+# Seuil d'alerte à 30 % entre stock_min et stock_max (stock_min si l'intervalle est vide),
+# en double précision comme le calcul Python de get_stock_status
+SQL_SEUIL_ALERTE = (
+    "CASE WHEN COALESCE(stock_max, 100) > COALESCE(stock_min, 0) "
+    "THEN CAST(COALESCE(stock_min, 0) AS DOUBLE PRECISION) "
+    "+ CAST(COALESCE(stock_max, 100) - COALESCE(stock_min, 0) AS DOUBLE PRECISION) * 0.3 "
+    "ELSE CAST(COALESCE(stock_min, 0) AS DOUBLE PRECISION) END"
+)
+
+# Statut du stock : critique / surstock / faible / normal (règle de get_stock_status)
+SQL_STATUT_STOCK = (
+    "CASE WHEN COALESCE(quantite, 0) < COALESCE(stock_min, 0) THEN 'critique' "
+    "WHEN COALESCE(quantite, 0) > COALESCE(stock_max, 100) THEN 'surstock' "
+    f"WHEN COALESCE(quantite, 0) <= {SQL_SEUIL_ALERTE} THEN 'faible' "
+    "ELSE 'normal' END"
+)
+
 class Inventaire(Base):
     """Table principale des produits en stock"""
     __tablename__ = "inventaire"
@@ -27,6 +44,9 @@ class Inventaire(Base):
     date_entree = Column(Date, server_default=func.current_date())
     created_at = Column(TIMESTAMP, server_default=func.now())
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+    # Colonnes générées par la base, maintenues à chaque écriture de quantite/stock_min/stock_max
+    seuil_alerte_calcule = Column(Float, Computed(SQL_SEUIL_ALERTE, persisted=True))
+    statut_stock = Column(String(10), Computed(SQL_STATUT_STOCK, persisted=True), index=True)
 
 class Fournisseur(Base):
     """Table des fournisseurs"""
@@ -146,19 +166,50 @@ class Demande(Base):
     created_at = Column(TIMESTAMP, server_default=func.now())
     updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
 
+# Types de mouvement de l'historique (colonne type_mouvement) et leur libellé
+TYPES_MOUVEMENT = {1: "Entrée", 2: "Sortie", 3: "Ajustement", 4: "Inventaire", 5: "Transfert"}
+
+def code_type_mouvement(nature: str) -> int:
+    """Type d'un libellé de mouvement libre (mêmes règles que l'affichage de l'historique)"""
+    libelle = (nature or "").lower()
+    if "entrée" in libelle or "entree" in libelle:
+        return 1
+    if "sortie" in libelle:
+        return 2
+    if "ajustement" in libelle or "régule" in libelle or "regule" in libelle:
+        return 3
+    if "transfert" in libelle:
+        return 5
+    return 4
+
 class Historique(Base):
-    """Table de l'historique des mouvements de stock"""
+    """Table de l'historique des mouvements de stock.
+    
+    Sous PostgreSQL, partitionnée par mois sur date_mouvement (clé primaire (id,
+    date_mouvement), voir init.sql et maintenance.py).
+    """
     __tablename__ = "historique"
     
     id = Column(Integer, primary_key=True, index=True)
     date_mouvement = Column(TIMESTAMP, nullable=False, index=True)
     reference = Column(String(20), index=True)  # Référence du produit
-    produit = Column(String(500), nullable=False)
-    nature = Column(String(50), nullable=False, index=True)  # Entrée, Sortie, Ajustement
+    inventaire_id = Column(Integer, ForeignKey("inventaire.id", ondelete="SET NULL"), index=True)
+    type_mouvement = Column(SmallInteger, nullable=False, index=True)  # Clé de TYPES_MOUVEMENT
+    # Renseignés seulement quand ils ne se déduisent pas de inventaire_id / type_mouvement :
+    # produit sans fiche (ou supprimé, renommé depuis), libellé de mouvement non standard
+    produit_libelle = Column("produit", String(500))
+    nature_libre = Column("nature", String(50))
     quantite_mouvement = Column(Integer, nullable=False)
     quantite_avant = Column(Integer, nullable=False)
     quantite_apres = Column(Integer, nullable=False)
     created_at = Column(TIMESTAMP, server_default=func.now())
+    
+    # Champs historiques des réponses de l'API
+    produit = column_property(func.coalesce(
+        produit_libelle,
+        select(Inventaire.produits).where(Inventaire.id == inventaire_id).correlate_except(Inventaire).scalar_subquery()
+    ))
+    nature = column_property(func.coalesce(nature_libre, case(TYPES_MOUVEMENT, value=type_mouvement)))
 
 class TableAtelier(Base):
     """Table des tables d'atelier"""
@@ -209,4 +260,13 @@ class ProduitListeInventaire(Base):
     created_at = Column(TIMESTAMP, server_default=func.now())
     
     # Relations
-    liste = relationship("ListeInventaire", back_populates="produits") 
\ No newline at end of file
+    liste = relationship("ListeInventaire", back_populates="produits")
+
+class VersionTable(Base):
+    """Compteur de modifications d'une table, par tranche de connexions (trigger
+    incrementer_version_table de init.sql) : version des listes derrière un ETag"""
+    __tablename__ = "versions_tables"
+
+    nom_table = Column(String(63), primary_key=True)
+    tranche = Column(SmallInteger, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
@@ -0,0 +1,105 @@
+import json
+import logging
+import select
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Module partagé par l'API et l'interface : UI/notifications.py en est une copie
+# identique (vérifiée par test_notifications.py), à modifier ensemble
+
+# Canal alimenté par le trigger notifier_changements() (voir api/init.sql)
+CANAL_CHANGEMENTS = "gmao_changements"
+
+class EcouteurChangements(threading.Thread):
+    """Écoute LISTEN/NOTIFY PostgreSQL et transmet les changements à un callback.
+
+    Les notifications arrivées ensemble (une par instruction : un import en masse en
+    produit autant que d'instructions) sont regroupées : le callback est appelé une
+    fois par table avec (table, cles), cles étant l'ensemble des clés des lignes
+    modifiées, ou None si une notification ne les détaille pas. Après une coupure de
+    connexion, des notifications ont pu être perdues : le callback est alors appelé
+    avec table=None pour que l'appelant vide tous ses caches.
+    """
+
+    def __init__(self, dsn: str, callback, canal: str = CANAL_CHANGEMENTS, delai_max: float = 30.0,
+                 fenetre: float = 0.05):
+        super().__init__(name="ecouteur-changements", daemon=True)
+        self.dsn = dsn
+        self.callback = callback
+        self.canal = canal
+        self.delai_max = delai_max
+        self.fenetre = fenetre  # attente des notifications suivantes avant d'invalider
+        self._arret = threading.Event()
+
+    def arreter(self):
+        self._arret.set()
+
+    def run(self):
+        import psycopg2
+
+        delai = 1.0
+        while not self._arret.is_set():
+            try:
+                connexion = psycopg2.connect(self.dsn)
+            except psycopg2.Error as e:
+                logger.warning("Écoute des changements impossible (%s), nouvel essai dans %.0f s", e, delai)
+                self._arret.wait(delai)
+                delai = min(delai * 2, self.delai_max)
+                continue
+            try:
+                connexion.autocommit = True
+                connexion.cursor().execute(f"LISTEN {self.canal}")
+                # Tout ce qui a changé pendant la déconnexion est inconnu
+                self._transmettre(None)
+                delai = 1.0
+                while not self._arret.is_set():
+                    if select.select([connexion], [], [], 5.0) == ([], [], []):
+                        continue
+                    connexion.poll()
+                    # Regrouper les notifications d'un import en cours, sans attendre plus d'1 s
+                    limite = time.monotonic() + 1.0
+                    while (time.monotonic() < limite
+                           and select.select([connexion], [], [], self.fenetre) != ([], [], [])):
+                        connexion.poll()
+                    payloads = [notification.payload for notification in connexion.notifies]
+                    del connexion.notifies[:]
+                    self._traiter(payloads)
+            except psycopg2.Error as e:
+                logger.warning("Connexion d'écoute perdue (%s), reconnexion", e)
+                self._arret.wait(delai)
+            except Exception:
+                # Toute autre erreur ne doit pas arrêter le thread : les caches ne seraient plus
+                # jamais invalidés. Reconnexion (et vidage complet) après une attente croissante
+                logger.exception("Erreur de l'écoute des changements, reconnexion dans %.0f s", delai)
+                self._arret.wait(delai)
+                delai = min(delai * 2, self.delai_max)
+            finally:
+                connexion.close()
+
+    def _traiter(self, payloads):
+        """Regrouper des notifications par table : clés touchées, None si toute la table"""
+        changements = {}
+        for payload in payloads:
+            try:
+                message = json.loads(payload)
+                table, lignes = message["table"], message.get("lignes")
+                cles = None if lignes is None else {
+                    cle for ligne in lignes for cle in (ligne.get("cle"), ligne.get("ancienne_cle")) if cle is not None
+                }
+            except (ValueError, KeyError, TypeError, AttributeError):
+                logger.warning("Notification illisible ignorée : %r", payload)
+                continue
+            if cles is None:
+                changements[table] = None
+            elif changements.setdefault(table, set()) is not None:
+                changements[table].update(cles)
+        for table, cles in changements.items():
+            self._transmettre(table, cles)
+
+    def _transmettre(self, table, cles=None):
+        try:
+            self.callback(table, cles)
+        except Exception:
+            logger.exception("Erreur lors de l'invalidation du cache pour %s", table)
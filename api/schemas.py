@@ -53,6 +53,45 @@ class InventaireResponse(InventaireBase):
     id: int
     created_at: datetime
     updated_at: datetime
+    seuil_alerte_calcule: Optional[float] = None  # 30 % entre stock_min et stock_max (seuil_alerte de l'interface = stock_min)
+    statut_stock: Optional[str] = None  # 'critique', 'faible', 'surstock', 'normal'
+
+class InventaireAutocomplete(BaseModel):
+    id: int
+    reference: str
+    produits: str
+    quantite: Optional[int] = None
+
+class InventaireStats(BaseModel):
+    total_produits: int
+    stock_critique: int
+    stock_faible: int
+    surstock: int
+    stock_normal: int
+    valeur_totale: float
+
+class InventaireBulkItem(InventaireUpdate):
+    id: Optional[int] = None  # Renseigné : mise à jour du produit, sinon création
+    reference: Optional[str] = None
+
+class InventaireBulkRequest(BaseModel):
+    items: List[InventaireBulkItem]
+    conflit: str = 'ignorer'  # 'ignorer' ou 'mettre_a_jour' si la référence existe déjà
+
+class InventaireBulkResultat(BaseModel):
+    index: int  # Position de la ligne dans la requête
+    statut: str  # 'created', 'updated', 'skipped', 'error'
+    id: Optional[int] = None
+    reference: Optional[str] = None
+    message: Optional[str] = None
+
+class InventaireBulkResponse(BaseModel):
+    total: int
+    crees: int
+    mis_a_jour: int
+    ignores: int
+    erreurs: int
+    resultats: List[InventaireBulkResultat]
 
 # =====================================================
 # SCHÉMAS POUR FOURNISSEURS
@@ -303,6 +342,8 @@ class HistoriqueResponse(HistoriqueBase):
     
     id: int
     created_at: datetime
+    inventaire_id: Optional[int] = None
+    type_mouvement: Optional[int] = None  # 1 Entrée, 2 Sortie, 3 Ajustement, 4 Inventaire, 5 Transfert
 
 # =====================================================
 # SCHÉMAS POUR TABLES D'ATELIER
@@ -402,4 +443,24 @@ class MouvementStockResponse(BaseModel):
     
     success: bool
     message: str
-    nouveau_stock: Optional[int] = None 
\ No newline at end of file
+    nouveau_stock: Optional[int] = None
+
+class MouvementStockBatchRequest(BaseModel):
+    mouvements: List[MouvementStockCreate]
+    partiel: bool = False  # True : les lignes valides sont enregistrées malgré les erreurs
+
+class MouvementStockBatchResultat(BaseModel):
+    index: int  # Position de la ligne dans le lot
+    reference_produit: str
+    success: bool
+    message: str
+    quantite_avant: Optional[int] = None
+    nouveau_stock: Optional[int] = None
+
+class MouvementStockBatchResponse(BaseModel):
+    success: bool
+    message: str
+    total: int
+    effectues: int
+    erreurs: int
+    resultats: List[MouvementStockBatchResultat]
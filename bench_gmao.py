@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Scripts de mesure de performance de l'API GMAO.
+
+Usage :
+    python bench_gmao.py mouvements --url http://localhost:8010 --reference 1234567890
+    python bench_gmao.py pagination --url http://localhost:8010 --endpoint /historique/
+    python bench_gmao.py recherche --url http://localhost:8010 --termes ecrou vis joint
+    python bench_gmao.py pages --url http://localhost:5000 --chemins /magasin /alertes-stock
+"""
+
+import argparse
+import json
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+def appel_api(methode, url, data=None, timeout=30, entetes=False):
+    """Effectuer un appel HTTP JSON et retourner (code HTTP, corps décodé[, en-têtes])"""
+    corps = json.dumps(data).encode() if data is not None else None
+    requete = urllib.request.Request(url, data=corps, method=methode, headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(requete, timeout=timeout) as reponse:
+            resultat = (reponse.status, json.loads(reponse.read() or b'null'))
+            return resultat + (reponse.headers,) if entetes else resultat
+    except urllib.error.HTTPError as e:
+        return (e.code, None, e.headers) if entetes else (e.code, None)
+
+def bench_mouvements(args):
+    """Mouvements de stock concurrents sur une même référence et vérification des mises à jour perdues"""
+    code, produit = appel_api('GET', f"{args.url}/inventaire/reference/{args.reference}")
+    if code != 200:
+        print(f"Produit {args.reference} introuvable (HTTP {code})")
+        return
+    quantite_initiale = produit.get('quantite') or 0
+
+    def scanner(numero):
+        """Un scanner alterne entrées et sorties d'une unité"""
+        entrees = sorties = echecs = 0
+        for i in range(args.mouvements):
+            nature = 'Entrée' if (numero + i) % 2 == 0 else 'Sortie'
+            code, resultat = appel_api('POST', f"{args.url}/mouvements-stock/", {
+                'reference_produit': args.reference,
+                'nature': nature,
+                'quantite': 1,
+                'motif': f"bench scanner {numero}"
+            })
+            if code == 200 and resultat and resultat.get('success'):
+                if nature == 'Entrée':
+                    entrees += 1
+                else:
+                    sorties += 1
+            else:
+                echecs += 1
+        return entrees, sorties, echecs
+
+    debut = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.scanners) as executor:
+        resultats = list(executor.map(scanner, range(args.scanners)))
+    duree = time.perf_counter() - debut
+
+    entrees = sum(r[0] for r in resultats)
+    sorties = sum(r[1] for r in resultats)
+    echecs = sum(r[2] for r in resultats)
+    _, produit = appel_api('GET', f"{args.url}/inventaire/reference/{args.reference}")
+    attendu = quantite_initiale + entrees - sorties
+
+    print(f"Scanners              : {args.scanners}")
+    print(f"Mouvements réussis    : {entrees + sorties} ({entrees} entrées, {sorties} sorties, {echecs} refusés)")
+    print(f"Débit                 : {(entrees + sorties + echecs) / duree:.1f} mouvements/s")
+    print(f"Stock final attendu   : {attendu}")
+    print(f"Stock final constaté  : {produit.get('quantite')}")
+    print(f"Mises à jour perdues  : {abs(attendu - (produit.get('quantite') or 0))}")
+
+def bench_pagination(args):
+    """Latence par page en parcourant une liste par skip/limit puis par curseur"""
+    separateur = '&' if '?' in args.endpoint else '?'
+    
+    def parcourir(par_curseur):
+        durees = []
+        skip, curseur = 0, None
+        while len(durees) < args.pages:
+            pagination = f"cursor={curseur}" if curseur else f"skip={skip}"
+            debut = time.perf_counter()
+            code, page, entetes = appel_api('GET', f"{args.url}{args.endpoint}{separateur}{pagination}&limit={args.limit}", entetes=True)
+            durees.append(time.perf_counter() - debut)
+            if code != 200 or len(page) < args.limit:
+                break
+            skip += args.limit
+            curseur = entetes.get('X-Next-Cursor') if par_curseur else None
+        return durees
+    
+    for libelle, par_curseur in (("skip/limit", False), ("curseur", True)):
+        durees = parcourir(par_curseur)
+        if not durees:
+            continue
+        print(f"{libelle:<11}: {len(durees)} pages, première {durees[0] * 1000:.1f} ms, "
+              f"dernière {durees[-1] * 1000:.1f} ms, moyenne {sum(durees) / len(durees) * 1000:.1f} ms")
+
+def bench_recherche(args):
+    """Latence de la recherche produits pour quelques termes, répétée"""
+    for terme in args.termes:
+        durees = []
+        for _ in range(args.repetitions):
+            debut = time.perf_counter()
+            code, resultats = appel_api('GET', f"{args.url}/inventaire/search/?search={urllib.parse.quote(terme)}&limit={args.limit}")
+            durees.append(time.perf_counter() - debut)
+        durees.sort()
+        print(f"{terme:<15}: {len(resultats or [])} résultats, médiane {durees[len(durees) // 2] * 1000:.1f} ms, "
+              f"max {durees[-1] * 1000:.1f} ms")
+
+def percentile(valeurs, p):
+    """Percentile p (0-100) d'une liste de durées, par rang le plus proche"""
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(round(p / 100 * (len(valeurs) - 1))))]
+
+def bench_pages(args):
+    """Latence p50/p99 de pages de l'interface Flask sous charge concurrente"""
+    for chemin in args.chemins:
+        def charger(_):
+            debut = time.perf_counter()
+            try:
+                with urllib.request.urlopen(f"{args.url}{chemin}", timeout=60) as reponse:
+                    reponse.read()
+                    code = reponse.status
+            except urllib.error.HTTPError as e:
+                code = e.code
+            except urllib.error.URLError:
+                code = None
+            return time.perf_counter() - debut, code
+        
+        debut = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrence) as executor:
+            resultats = list(executor.map(charger, range(args.requetes)))
+        duree = time.perf_counter() - debut
+        durees = [d for d, _ in resultats]
+        erreurs = sum(1 for _, code in resultats if code != 200)
+        print(f"{chemin:<20}: p50 {percentile(durees, 50) * 1000:.1f} ms, p99 {percentile(durees, 99) * 1000:.1f} ms, "
+              f"{len(durees) / duree:.1f} pages/s, {erreurs} erreurs")
+
+def main():
+    parser = argparse.ArgumentParser(description="Mesures de performance de l'API GMAO")
+    parser.add_argument('--url', default='http://localhost:8010', help="URL de base de l'API")
+    sous_commandes = parser.add_subparsers(dest='commande', required=True)
+
+    mouvements = sous_commandes.add_parser('mouvements', help="Débit des mouvements de stock concurrents")
+    mouvements.add_argument('--reference', required=True, help="Référence QR du produit à mouvementer")
+    mouvements.add_argument('--scanners', type=int, default=20, help="Nombre de scanners simultanés")
+    mouvements.add_argument('--mouvements', type=int, default=50, help="Mouvements par scanner")
+    mouvements.set_defaults(fonction=bench_mouvements)
+
+    pagination = sous_commandes.add_parser('pagination', help="Latence des pages profondes, skip/limit contre curseur")
+    pagination.add_argument('--endpoint', default='/historique/', help="Liste paginée à parcourir")
+    pagination.add_argument('--limit', type=int, default=100, help="Taille de page")
+    pagination.add_argument('--pages', type=int, default=200, help="Nombre maximal de pages parcourues")
+    pagination.set_defaults(fonction=bench_pagination)
+
+    recherche = sous_commandes.add_parser('recherche', help="Latence de la recherche produits")
+    recherche.add_argument('--termes', nargs='+', default=['ecrou', 'vis', 'joint'], help="Termes recherchés")
+    recherche.add_argument('--limit', type=int, default=20, help="Nombre de résultats demandés")
+    recherche.add_argument('--repetitions', type=int, default=20, help="Appels par terme")
+    recherche.set_defaults(fonction=bench_recherche)
+
+    pages = sous_commandes.add_parser('pages', help="Latence p50/p99 des pages de l'interface (--url de l'interface Flask)")
+    pages.add_argument('--chemins', nargs='+', default=['/magasin'], help="Pages à charger")
+    pages.add_argument('--requetes', type=int, default=200, help="Chargements par page")
+    pages.add_argument('--concurrence', type=int, default=8, help="Chargements simultanés")
+    pages.set_defaults(fonction=bench_pages)
+
+    args = parser.parse_args()
+    args.fonction(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Fixtures des tests de l'API : application FastAPI servie par TestClient sur une base
+SQLite temporaire, vidée avant chaque test.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "api"))
+# Les moteurs sont créés à l'import de database : la base de test doit être choisie avant
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="gmao-tests-"), "gmao.db")
+os.environ.pop("DATABASE_READ_URL", None)
+os.environ.pop("ASYNC_DATABASE_URL", None)
+
+@pytest.fixture
+def client():
+    """Client HTTP de l'API sur une base vide et des caches vides"""
+    from fastapi.testclient import TestClient
+    import crud
+    import main
+    import models
+    from database import engine
+
+    with engine.begin() as connexion:
+        for table in reversed(models.Base.metadata.sorted_tables):
+            connexion.execute(table.delete())
+    crud.invalider_caches(None)
+    with TestClient(main.app) as client:
+        yield client
+
+@pytest.fixture
+def creer_produit(client):
+    """Créer un produit par POST /inventaire/ et retourner sa réponse"""
+    def creer(reference, code=None, quantite=0, **champs):
+        reponse = client.post("/inventaire/", json={
+            "code": code or f"CODE-{reference}",
+            "reference": reference,
+            "produits": f"Produit {reference}",
+            "quantite": quantite,
+            **champs
+        })
+        assert reponse.status_code == 200, reponse.text
+        return reponse.json()
+    return creer
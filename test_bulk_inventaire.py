@@ -0,0 +1,77 @@
+"""
+Tests de l'import en masse (POST /inventaire/bulk) : un statut par ligne, contrôle des
+codes en double et mises à jour sans modification.
+"""
+
+def bulk(client, items, conflit="ignorer"):
+    reponse = client.post("/inventaire/bulk", json={"items": items, "conflit": conflit})
+    assert reponse.status_code == 200, reponse.text
+    return reponse.json()
+
+def statuts(reponse):
+    return [r["statut"] for r in reponse["resultats"]]
+
+def nouveau(reference, code=None, **champs):
+    return {"reference": reference, "code": code or f"CODE-{reference}", "produits": f"Produit {reference}", **champs}
+
+def test_statut_par_ligne(client, creer_produit):
+    existant = creer_produit("R1")
+    reponse = bulk(client, [
+        nouveau("R2"),
+        nouveau("R1"),
+        {"id": existant["id"], "quantite": 8},
+        {"id": 999999, "quantite": 1},
+        {"reference": "R3"},
+        nouveau("R2"),
+    ])
+    assert statuts(reponse) == ["created", "skipped", "updated", "error", "error", "error"]
+    assert (reponse["crees"], reponse["mis_a_jour"], reponse["ignores"], reponse["erreurs"]) == (1, 1, 1, 3)
+    assert client.get("/inventaire/reference/R1").json()["quantite"] == 8
+    assert client.get("/inventaire/reference/R2").json()["code"] == "CODE-R2"
+
+def test_conflit_mettre_a_jour(client, creer_produit):
+    creer_produit("R1", quantite=1)
+    reponse = bulk(client, [nouveau("R1", quantite=5)], conflit="mettre_a_jour")
+    assert statuts(reponse) == ["updated"]
+    assert client.get("/inventaire/reference/R1").json()["quantite"] == 5
+
+def test_code_deja_porte_refuse_en_mise_a_jour(client, creer_produit):
+    creer_produit("R1", code="C1")
+    r2 = creer_produit("R2", code="C2")
+    reponse = bulk(client, [{"id": r2["id"], "code": "C1"}])
+    assert statuts(reponse) == ["error"]
+    assert reponse["resultats"][0]["message"] == "Un produit avec ce code existe déjà"
+    assert client.get("/inventaire/reference/R2").json()["code"] == "C2"
+
+def test_code_deja_porte_refuse_en_conflit_mettre_a_jour(client, creer_produit):
+    creer_produit("R1", code="C1")
+    creer_produit("R2", code="C2")
+    reponse = bulk(client, [nouveau("R2", code="C1")], conflit="mettre_a_jour")
+    assert statuts(reponse) == ["error"]
+    assert client.get("/inventaire/reference/R2").json()["code"] == "C2"
+
+def test_code_en_double_dans_le_lot(client, creer_produit):
+    r1 = creer_produit("R1", code="C1")
+    r2 = creer_produit("R2", code="C2")
+    reponse = bulk(client, [
+        {"id": r1["id"], "code": "C9"},
+        {"id": r2["id"], "code": "C9"},
+        nouveau("R3", code="C9"),
+    ])
+    # Les créations réservent leur code avant les mises à jour
+    assert statuts(reponse) == ["error", "error", "created"]
+    codes = [client.get(f"/inventaire/reference/{r}").json()["code"] for r in ("R1", "R2", "R3")]
+    assert codes.count("C9") == 1
+
+def test_code_conserve_n_est_pas_une_collision(client, creer_produit):
+    r1 = creer_produit("R1", code="C1")
+    reponse = bulk(client, [{"id": r1["id"], "code": "C1", "quantite": 3}])
+    assert statuts(reponse) == ["updated"]
+
+def test_mise_a_jour_sans_modification_ignoree(client, creer_produit):
+    r1 = creer_produit("R1", quantite=4)
+    client.get("/inventaire/reference/R1")  # mise en cache
+    reponse = bulk(client, [{"id": r1["id"]}, {"id": r1["id"], "quantite": 4}])
+    assert statuts(reponse) == ["skipped", "skipped"]
+    assert reponse["mis_a_jour"] == 0
+    assert reponse["resultats"][0]["message"] == "Aucune modification"
@@ -0,0 +1,67 @@
+"""
+Tests du cache des produits par référence QR (crud.cache_produits_reference) : chaque
+écriture invalide l'entrée, et une lecture antérieure à une écriture ne remet pas
+l'ancienne valeur en cache.
+"""
+
+import crud
+import schemas
+from cache import CacheLRU
+from database import SessionLocal
+
+def quantite(client, reference):
+    return client.get(f"/inventaire/reference/{reference}").json()["quantite"]
+
+def test_mouvement_invalide_le_cache(client, creer_produit):
+    creer_produit("R1", quantite=10)
+    assert quantite(client, "R1") == 10
+    assert crud.cache_produits_reference.get("R1") is not None
+    client.post("/mouvements-stock/", json={"reference_produit": "R1", "nature": "Sortie", "quantite": 4})
+    assert quantite(client, "R1") == 6
+    client.post("/mouvements-stock/batch", json={"mouvements": [
+        {"reference_produit": "R1", "nature": "Entrée", "quantite": 1}
+    ]})
+    assert quantite(client, "R1") == 7
+
+def test_modification_et_import_invalident_le_cache(client, creer_produit):
+    produit = creer_produit("R1", quantite=10)
+    assert quantite(client, "R1") == 10
+    client.put(f"/inventaire/{produit['id']}", json={"quantite": 3})
+    assert quantite(client, "R1") == 3
+    client.post("/inventaire/bulk", json={"items": [{"id": produit["id"], "quantite": 5}]})
+    assert quantite(client, "R1") == 5
+    client.delete(f"/inventaire/{produit['id']}")
+    assert client.get("/inventaire/reference/R1").status_code == 404
+
+def test_generation_refuse_une_valeur_lue_avant_invalidation():
+    cache = CacheLRU(taille_max=2)
+    generation = cache.generation()
+    cache.supprimer("a")
+    assert cache.set("a", 1, generation) is False
+    assert cache.set("b", 2, generation) is True
+    generation = cache.generation()
+    cache.vider()
+    assert cache.set("b", 3, generation) is False
+    # Au-delà de taille_max clés invalidées, l'oubli vaut un vidage
+    generation = cache.generation()
+    cache.supprimer("x", "y", "z")
+    assert cache.set("b", 4, generation) is False
+    assert cache.get("b") is None
+
+def test_lecture_concurrente_d_un_mouvement_non_mise_en_cache(client, creer_produit, monkeypatch):
+    creer_produit("R1", quantite=10)
+    original = crud._mettre_en_cache_produit
+
+    def mouvement_entre_lecture_et_cache(reference, db_inventaire, generation):
+        # Le mouvement est validé (et invalide le cache) après le SELECT de la lecture
+        with SessionLocal() as db:
+            crud.effectuer_mouvement_stock(db, schemas.MouvementStockCreate(
+                reference_produit="R1", nature="Sortie", quantite=4
+            ))
+        return original(reference, db_inventaire, generation)
+
+    monkeypatch.setattr(crud, "_mettre_en_cache_produit", mouvement_entre_lecture_et_cache)
+    assert quantite(client, "R1") == 10  # lecture antérieure au mouvement
+    monkeypatch.setattr(crud, "_mettre_en_cache_produit", original)
+    assert crud.cache_produits_reference.get("R1") is None
+    assert quantite(client, "R1") == 6
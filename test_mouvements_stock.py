@@ -0,0 +1,53 @@
+"""
+Tests des mouvements de stock par lot (POST /mouvements-stock/batch) : tout ou rien,
+mode partiel et lots de lecture multiples.
+"""
+
+import crud
+
+def quantite(client, reference):
+    return client.get(f"/inventaire/reference/{reference}").json()["quantite"]
+
+def test_lot_tout_ou_rien_annule_si_une_ligne_echoue(client, creer_produit):
+    creer_produit("R1", quantite=10)
+    creer_produit("R2", quantite=1)
+    reponse = client.post("/mouvements-stock/batch", json={"mouvements": [
+        {"reference_produit": "R1", "nature": "Sortie", "quantite": 3},
+        {"reference_produit": "R2", "nature": "Sortie", "quantite": 5},
+        {"reference_produit": "INCONNUE", "nature": "Entrée", "quantite": 1},
+    ]}).json()
+    assert reponse["success"] is False
+    assert reponse["effectues"] == 0
+    assert [r["message"] for r in reponse["resultats"]] == [
+        "Annulé : le lot contient des erreurs", "Stock insuffisant", "Produit non trouvé"
+    ]
+    assert quantite(client, "R1") == 10
+    assert client.get("/historique/").json() == []
+
+def test_lot_partiel_enregistre_les_lignes_valides(client, creer_produit):
+    creer_produit("R1", quantite=10)
+    creer_produit("R2", quantite=1)
+    reponse = client.post("/mouvements-stock/batch", json={"partiel": True, "mouvements": [
+        {"reference_produit": "R1", "nature": "Sortie", "quantite": 3},
+        {"reference_produit": "R2", "nature": "Sortie", "quantite": 5},
+        {"reference_produit": "R1", "nature": "Ajustement", "quantite": 4},
+    ]}).json()
+    assert reponse["success"] is False
+    assert (reponse["effectues"], reponse["erreurs"]) == (2, 1)
+    assert [(r["quantite_avant"], r["nouveau_stock"]) for r in reponse["resultats"]] == [(10, 7), (None, None), (7, 4)]
+    assert quantite(client, "R1") == 4
+    assert quantite(client, "R2") == 1
+    assert len(client.get("/historique/").json()) == 2
+
+def test_lot_sur_plusieurs_lots_de_lecture(client, creer_produit, monkeypatch):
+    # Lots de lecture de 2 références : les verrous sont pris sur plusieurs requêtes
+    monkeypatch.setattr(crud._par_lots, "__defaults__", (2,))
+    references = ["p", "d", "a", "z", "m"]
+    for reference in references:
+        creer_produit(reference, quantite=5)
+    reponse = client.post("/mouvements-stock/batch", json={"mouvements": [
+        {"reference_produit": reference, "nature": "Entrée", "quantite": 1} for reference in references
+    ]}).json()
+    assert reponse["success"] is True
+    assert [r["reference_produit"] for r in reponse["resultats"]] == references
+    assert all(quantite(client, reference) == 6 for reference in references)
@@ -0,0 +1,56 @@
+"""
+Tests de l'écouteur de notifications de changement (notifications.py), partagé par l'API
+et l'interface.
+"""
+
+import json
+import os
+
+from notifications import EcouteurChangements
+
+RACINE = os.path.dirname(os.path.abspath(__file__))
+
+def test_copie_de_l_interface_identique():
+    with open(os.path.join(RACINE, "api", "notifications.py"), "rb") as api, \
+            open(os.path.join(RACINE, "UI", "notifications.py"), "rb") as ui:
+        assert api.read() == ui.read(), "UI/notifications.py doit rester une copie de api/notifications.py"
+
+def ecouteur():
+    appels = []
+    return EcouteurChangements("", lambda table, cles: appels.append((table, cles))), appels
+
+def notification(table, lignes=None):
+    return json.dumps({"table": table, "op": "UPDATE", "lignes": lignes})
+
+def test_notifications_regroupees_par_table():
+    e, appels = ecouteur()
+    e._traiter([
+        notification("inventaire", [{"id": 1, "cle": "R1"}]),
+        notification("inventaire", [{"id": 2, "cle": "R2", "ancienne_cle": "R0"}]),
+        notification("sites", [{"id": 3, "cle": None}]),
+    ])
+    assert appels == [("inventaire", {"R0", "R1", "R2"}), ("sites", set())]
+
+def test_notification_sans_detail_invalide_toute_la_table():
+    e, appels = ecouteur()
+    e._traiter([
+        notification("inventaire", [{"id": 1, "cle": "R1"}]),
+        notification("inventaire"),
+        notification("inventaire", [{"id": 2, "cle": "R2"}]),
+    ])
+    assert appels == [("inventaire", None)]
+
+def test_notification_illisible_ignoree():
+    e, appels = ecouteur()
+    e._traiter(["pas du json", "42", json.dumps({"op": "INSERT"}), notification("lieux")])
+    assert appels == [("lieux", None)]
+
+def test_erreur_du_callback_n_interrompt_pas_l_ecoute():
+    appels = []
+
+    def callback(table, cles):
+        appels.append(table)
+        raise RuntimeError("cache indisponible")
+
+    EcouteurChangements("", callback)._traiter([notification("sites"), notification("lieux")])
+    assert appels == ["sites", "lieux"]
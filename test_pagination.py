@@ -0,0 +1,59 @@
+"""
+Tests de la pagination par curseur (en-tête X-Next-Cursor) des listes de l'API.
+"""
+
+import base64
+
+import pytest
+
+def pages(client, endpoint, limit):
+    """Parcourir une liste en suivant X-Next-Cursor ; retourne les pages reçues"""
+    resultat = []
+    params = {"limit": limit}
+    while True:
+        reponse = client.get(endpoint, params=params)
+        assert reponse.status_code == 200, reponse.text
+        resultat.append(reponse.json())
+        curseur = reponse.headers.get("X-Next-Cursor")
+        if not curseur:
+            return resultat
+        params = {"limit": limit, "cursor": curseur}
+
+def test_inventaire_parcouru_par_curseur(client, creer_produit):
+    ids = [creer_produit(f"R{i}")["id"] for i in range(5)]
+    resultat = pages(client, "/inventaire/", limit=2)
+    assert [len(page) for page in resultat] == [2, 2, 1]
+    assert [produit["id"] for page in resultat for produit in page] == sorted(ids)
+
+def test_insertion_entre_deux_pages_ne_decale_pas(client, creer_produit):
+    for i in range(4):
+        creer_produit(f"R{i}")
+    premiere = client.get("/inventaire/", params={"limit": 2})
+    creer_produit("R9")
+    suivante = client.get("/inventaire/", params={"limit": 2, "cursor": premiere.headers["X-Next-Cursor"]}).json()
+    assert suivante[0]["id"] > premiere.json()[-1]["id"]
+    assert {p["reference"] for p in suivante} == {"R2", "R3"}
+
+def test_derniere_page_sans_curseur(client, creer_produit):
+    creer_produit("R1")
+    reponse = client.get("/inventaire/", params={"limit": 10})
+    assert "X-Next-Cursor" not in reponse.headers
+
+def test_historique_parcouru_par_curseur(client, creer_produit):
+    creer_produit("R1", quantite=100)
+    for _ in range(5):
+        client.post("/mouvements-stock/", json={"reference_produit": "R1", "nature": "Sortie", "quantite": 1})
+    resultat = pages(client, "/historique/", limit=2)
+    mouvements = [m["id"] for page in resultat for m in page]
+    assert len(mouvements) == len(set(mouvements)) == 5
+
+@pytest.mark.parametrize("curseur", [
+    "pas-un-curseur",
+    base64.urlsafe_b64encode(b'{"id": 1}').decode(),
+    base64.urlsafe_b64encode(b'["a"]').decode(),
+    base64.urlsafe_b64encode(b'[1, 2]').decode(),
+])
+def test_curseur_invalide_400(client, curseur):
+    reponse = client.get("/inventaire/", params={"cursor": curseur})
+    assert reponse.status_code == 400
+    assert reponse.json()["detail"] == "Curseur de pagination invalide"